@@ -51,7 +51,7 @@ import random
 import csv
 from datetime import datetime
 
-from BSE2_msg_classes import Assignment, Order, Exch_msg
+from BSE2_msg_classes import Assignment, Order, Exch_msg, Tape_trade, Tape_cancel
 from BSE_trader_agents import Trader_ISHV, Trader_Shaver,Trader_Giveaway,Trader_AA, Trader_Sniper, Trader_ZIC,Trader_ZIP,Trader_OAA #, Trader_IAAB
 from IZIP_MLOFI import Trader_IZIP_MLOFI
 from IAA_MLOFI import Trader_IAA_MLOFI
@@ -229,7 +229,7 @@ class Orderbook_half:
 
                 def add_tapeitem(eventlist, pool_id, time, oid, otype, qty, verbose):
                         # add_tapeitem(): add an event to list of events that will be written to tape
-                        tape_event = {'pool_id':pool_id, 'type':'CAN', 'time':time, 'oid':oid, 'otype':otype, 'o_qty':qty}
+                        tape_event = Tape_cancel(pool_id, time, oid, otype, qty)
                         eventlist.append(tape_event)
                         if verbose: print('book_CAN.add_tapeitem() trans_event=%s' % tape_event)
 
@@ -285,13 +285,7 @@ class Orderbook_half:
                 def add_tapeitem(eventlist, pool_id, eventtype, time, price, qty, party_from, party_to, verbose):
                         # add_tapeitem(): add an event to list of events that will be written to tape
                         # event type within book_take should be 'Trade'
-                        tape_event = { 'pool_id': pool_id,
-                                       'type': eventtype,
-                                       'time': time,
-                                       'price': price,
-                                       'qty': qty,
-                                       'party1': party_from,
-                                       'party2': party_to}
+                        tape_event = Tape_trade(pool_id, eventtype, time, price, qty, party_from, party_to)
                         eventlist.append(tape_event)
                         if verbose: print('add_tapeitem() tape_event=%s' % tape_event)
 
@@ -1699,7 +1693,11 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, sum
 
         if verbose: print('\n%s;  ' % (sess_id))
 
+        # persistent array of trader-ids, so that choosing a trader doesn't build a new list on every timestep
+        tids = list(traders.keys())
+        n_traders = len(tids)
         tid = None
+        tid_index = None
 
         while time < endtime:
 
@@ -1793,10 +1791,16 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, sum
 
                 # get a quote (or None) from a randomly chosen trader
 
-                # first randomly select a trader id
-                old_tid = tid
-                while tid == old_tid:
-                        tid = list(traders.keys())[random.randint(0, len(traders) - 1)]
+                # first randomly select a trader id, never the same trader twice in a row:
+                # choose from the other n_traders-1 by skipping over the previous one, rather than redrawing until different
+                if tid_index is None:
+                        tid_index = random.randint(0, n_traders - 1)
+                else:
+                        new_index = random.randint(0, n_traders - 2)
+                        if new_index >= tid_index:
+                                new_index += 1
+                        tid_index = new_index
+                tid = tids[tid_index]
 
                 # currently, all quotes/orders are issued only to the single exchange at exchanges[0]
                 # it is that exchange's responsibility to then deal with Order Protection / trade-through (Reg NMS Rule611)
@@ -1,6 +1,11 @@
+# NB the message classes are slotted (no per-instance __dict__) because a long session creates millions of them,
+# so they have to be new-style classes: __slots__ is ignored on old-style classes in Python 2
+
 # Assignment:
 # The details of a customer's order/request, assigned to a trader
-class Assignment:
+class Assignment(object):
+
+        __slots__ = ('cust_id', 'trad_id', 'atype', 'astyle', 'price', 'qty', 'time', 'endtime', 'assignmentid')
 
         def __init__(self, customer_id, trader_id, otype, ostyle, price, qty, time, endtime, assignmentid):
                 self.cust_id = customer_id      # customer identifier
@@ -23,7 +28,9 @@ class Assignment:
 # has a trader id, a type (buy/sell), a style (LIM, MKT, etc), a price,
 # a quantity, a timestamp, and a unique i.d.
 # The order-style may require additional parameters which are bundled into style_params (=None if not)
-class Order:
+class Order(object):
+
+        __slots__ = ('tid', 'otype', 'ostyle', 'price', 'qty', 'time', 'endtime', 'orderid', 'myref', 'styleparams')
 
         def __init__(self, trader_id, otype, ostyle, price, qty, time, endtime, orderid):
                 self.tid = trader_id    # trader i.d.
@@ -43,7 +50,9 @@ class Order:
 
 
 # structure of the messages that the exchange sends back to the traders after processing an order
-class Exch_msg:
+class Exch_msg(object):
+
+        __slots__ = ('tid', 'oid', 'event', 'trns', 'revo', 'fee', 'balance')
 
         def __init__(self, trader_id, order_id, eventtype, transactions, revised_order, fee, balance):
                 self.tid = trader_id            # trader i.d.
@@ -57,3 +66,71 @@ class Exch_msg:
         def __str__(self):
                 return 'TID:%s OID:%s Event:%s Trns:%s RevO:%s Fee:%d Bal:%d' % \
                        (self.tid, self.oid, self.event, str(self.trns), str(self.revo), self.fee, self.balance)
+
+
+# Tape_event: an event that the exchange writes on its tape, either a trade (Tape_trade) or a cancellation (Tape_cancel)
+# these used to be dictionaries: they are slotted records now, to cut the memory used by the tape,
+# but the fields can still be read by key (event['price']) as well as by attribute (event.price),
+# and an event prints just as the dictionary did
+class Tape_event(object):
+
+        __slots__ = ()
+
+        def __getitem__(self, key):
+                if key in self.__slots__:
+                        return getattr(self, key)
+                raise KeyError(key)
+
+        def __contains__(self, key):
+                return key in self.__slots__
+
+        def get(self, key, default=None):
+                if key in self.__slots__:
+                        return getattr(self, key)
+                return default
+
+        def keys(self):
+                return list(self.__slots__)
+
+        def as_dict(self):
+                return dict((key, getattr(self, key)) for key in self.__slots__)
+
+        def __eq__(self, other):
+                if isinstance(other, Tape_event):
+                        other = other.as_dict()
+                return self.as_dict() == other
+
+        def __ne__(self, other):
+                return not self.__eq__(other)
+
+        __hash__ = None
+
+        def __repr__(self):
+                return repr(self.as_dict())
+
+
+class Tape_trade(Tape_event):
+
+        __slots__ = ('pool_id', 'type', 'time', 'price', 'qty', 'party1', 'party2')
+
+        def __init__(self, pool_id, eventtype, time, price, qty, party1, party2):
+                self.pool_id = pool_id  # which pool (lit or dark) the trade happened in
+                self.type = eventtype   # 'Trade'
+                self.time = time        # timestamp
+                self.price = price      # price
+                self.qty = qty          # quantity
+                self.party1 = party1    # trader i.d. of the party whose order was on the LOB
+                self.party2 = party2    # trader i.d. of the party whose order took it
+
+
+class Tape_cancel(Tape_event):
+
+        __slots__ = ('pool_id', 'type', 'time', 'oid', 'otype', 'o_qty')
+
+        def __init__(self, pool_id, time, oid, otype, qty):
+                self.pool_id = pool_id  # which pool (lit or dark) the order was in
+                self.type = 'CAN'
+                self.time = time        # timestamp
+                self.oid = oid          # order i.d. of the cancelled order
+                self.otype = otype      # which side of the LOB it was on
+                self.o_qty = qty        # its quantity
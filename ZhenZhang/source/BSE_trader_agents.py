@@ -5,11 +5,72 @@ from BSE2_msg_classes import Assignment, Order, Exch_msg
 ##################--Traders below here--#############
 import random
 import math
+import sys
+from collections import deque
 ##################--Traders below here--#############
 
 bse_sys_minprice = 1  # minimum price in the system, in cents/pennies
 bse_sys_maxprice = 200  # maximum price in the system, in cents/pennies
 
+
+# levels of diagnostic tracing, separate from the verbose running commentary
+trace_off = 0
+trace_info = 1
+trace_debug = 2
+
+
+# Tracer: records the traders' diagnostic messages, in a ring of the most recent ones or in a file
+# call sites check the level (or tracer.debug) before building a message, so when tracing is off it costs nothing
+class Tracer:
+
+        def __init__(self, level=trace_off, fname=None, ring_length=10000, echo=False):
+                self.level = trace_off
+                self.debug = False      # True if debug-level messages are being recorded
+                self.ring = deque(maxlen=ring_length)
+                self.outfile = None
+                self.echo = echo        # if True, also print each message
+                self.configure(level, fname)
+
+        def configure(self, level, fname=None):
+                # level is trace_off, trace_info, trace_debug, or one of their names 'off', 'info', 'debug'
+                # if fname is not None, messages are appended to that file instead of the ring
+                if level in ('off', 'info', 'debug'):
+                        level = ('off', 'info', 'debug').index(level)
+                if level not in (trace_off, trace_info, trace_debug):
+                        sys.exit('FAIL: bad tracing level %s' % str(level))
+                self.level = level
+                self.debug = level >= trace_debug
+                self.close()
+                if fname is not None:
+                        self.outfile = open(fname, 'a')
+
+        def trace(self, level, fmt, *args):
+                # the message is only formatted from its arguments if it's going to be recorded
+                if level > self.level:
+                        return
+                if len(args) > 0:
+                        msg = fmt % args
+                else:
+                        msg = fmt
+                if self.outfile is not None:
+                        self.outfile.write(msg + '\n')
+                else:
+                        self.ring.append(msg)
+                if self.echo:
+                        print(msg)
+
+        def messages(self):
+                return list(self.ring)
+
+        def close(self):
+                if self.outfile is not None:
+                        self.outfile.close()
+                        self.outfile = None
+
+
+# the tracer used by all the traders
+tracer = Tracer()
+
 # Trader superclass
 # all Traders have a trader id, bank balance, blotter, and list of orders to execute
 class Trader:
@@ -1703,16 +1764,10 @@ class Trader_IAAB(Trader):
 
                                 self.balance += profit
 
-                                print 'IAAB\'s transaction quantity = '
-                                print qty
-                                print 'IAAB\'s transaction price = '
-                                print transactionprice
-                                print 'IAAB\'s profit = '
-                                print profit
-                                print 'IAAB\'s balance = '
-                                print self.balance
-                                print 'IAAB\'s remaining quantity = '
-                                print self.remaining_quantity
+                                if tracer.debug:
+                                        tracer.trace(trace_debug, '%s IAAB transaction: qty=%s price=%s profit=%s balance=%s remaining=%s',
+                                                     self.tid, qty, transactionprice, profit, self.balance,
+                                                     self.remaining_quantity)
 
 
 
@@ -2039,8 +2094,8 @@ class Trader_IAAB(Trader):
                                     time, None, -1)
                         self.lastquote=order
 
-                        print 'IAAB deal with block order'
-                        print str(order)
+                        if tracer.debug:
+                                tracer.trace(trace_debug, '%s IAAB deal with block order: %s', self.tid, order)
                 return order
 
         def respond(self, time, lob, trade, verbose):
@@ -1,6 +1,6 @@
 
 from BSE2_msg_classes import Assignment, Order, Exch_msg
-from BSE_trader_agents import Trader;
+from BSE_trader_agents import Trader, tracer, trace_debug
 import random
 import math
 
@@ -477,7 +477,8 @@ class Trader_IAA_NEW(Trader):
                     quoteprice_iaa = self.limit
 
                 if countdown < 0.3 :
-                    print "insert"
+                    if tracer.debug:
+                        tracer.trace(trace_debug, '%s insert: countdown=%f', self.tid, countdown)
                     if self.job == 'Bid' and (len(lob['asks']['lob']) >= 1) and lob['asks']['lob'][0][0] < self.limit:
                         quoteprice_iaa = lob['asks']['lob'][0][0]
                     if self.job == 'Ask' and (len(lob['bids']['lob']) >= 1) and lob['bids']['lob'][0][0] > self.limit:
@@ -1,6 +1,6 @@
 
 from BSE2_msg_classes import Assignment, Order, Exch_msg
-from BSE_trader_agents import Trader;
+from BSE_trader_agents import Trader, tracer, trace_debug
 import random
 import math
 
@@ -335,7 +335,8 @@ class Trader_IZIP_MLOFI(Trader):
                     quoteprice_iaa = self.limit
 
                 if countdown < 0.3 :
-                    print "insert"
+                    if tracer.debug:
+                        tracer.trace(trace_debug, '%s insert: countdown=%f', self.tid, countdown)
                     if self.job == 'Bid' and (len(lob['asks']['lob']) >= 1) and lob['asks']['lob'][0][0] < self.limit:
                         quoteprice_iaa = lob['asks']['lob'][0][0]+1
                     if self.job == 'Ask' and (len(lob['bids']['lob']) >= 1) and lob['bids']['lob'][0][0] > self.limit:
@@ -621,13 +622,15 @@ class Trader_IZIP_MLOFI(Trader):
                     else:
                         if self.worst_askprice != None:
                             target_price = self.worst_askprice
-                            print('worst_askprice = %s' % self.worst_askprice)
+                            if tracer.debug:
+                                tracer.trace(trace_debug, 'worst_askprice = %s', self.worst_askprice)
                             target_price = None  # todo: does this stop the price-spikes?
                         else:
                             target_price = None
                         # target_price = lob['asks']['worstp']  # stub quote
                     if target_price != None:
-                        print('PA1: tp=%s' % target_price)
+                        if tracer.debug:
+                            tracer.trace(trace_debug, 'PA1: tp=%s', target_price)
                         profit_alter(target_price)
 
         if self.job == 'Bid':
@@ -52,17 +52,56 @@
 
 import sys
 import math
+import bisect
+import heapq
 import random
 import os
+import atexit
+import queue
+import threading
+import concurrent.futures
 import time as chrono
 import csv
+import json
+import mmap
+import struct
+import functools
+import hashlib
+import io
+import pickle
+import zlib
+import gzip
+import lzma
+from collections import deque
+from array import array
 from datetime import datetime
 
+try:
+    import numpy
+except ImportError:
+    numpy = None    # numpy is optional: wherever it would be used, there is a pure-Python fallback
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None    # zstandard is optional: only needed for zstd-compressed output files
+
 # a bunch of system constants (globals)
 bse_sys_minprice = 1                    # minimum price in the system, in cents/pennies
 bse_sys_maxprice = 500                  # maximum price in the system, in cents/pennies
 # ticksize should be a param of an exchange (so different exchanges can have different ticksizes)
 ticksize = 1  # minimum change in price, in cents/pennies
+# PRZI CDF look-up tables are shared between all traders via a cache keyed on the strategy-value, optionally rounded to
+# this quantum so that near-identical strategies share a table: None (the default) for exact strategy-values, because
+# quantising alters the prices that traders quote, and so the outcome of seeded sessions
+przi_lut_quantum = None
+# the cache holds at most this many tables: read-only, use przi_lut_cache_resize() to change it
+przi_lut_cache_size = 4096
+# if True (and numpy is available), PRZI CDF tables are computed with numpy: faster for wide price-ranges, but numpy's
+# exp() and summation aren't bit-identical to the pure-Python version, so this changes the outcome of seeded sessions
+przi_lut_numpy = False
+# default number of random choices a TraderSelector draws at a time, for its 'weighted' and 'poisson' policies
+selection_batch_size = 1000
 
 
 # an Order/quote has a trader id, a type (buy/sell) price, quantity, timestamp, and unique i.d.
@@ -71,8 +110,11 @@ class Order:
     An Order: this is used both for client-orders from exogenous customers to the robot traders acting as sales traders,
     and for the trader-orders (aka quotes) sent by the robot traders to the BSE exchange.
     In both use-cases, an order has a trader-i.d., a type (buy/sell), price, quantity, timestamp, and unique quote-i.d.
+    Orders are slotted (no per-instance __dict__) because a long session creates millions of them.
     """
 
+    __slots__ = ('tid', 'otype', 'price', 'qty', 'time', 'qid')
+
     def __init__(self, tid, otype, price, qty, time, qid):
         self.tid = tid  # trader i.d.
         self.otype = otype  # order type
@@ -86,10 +128,651 @@ class Order:
                (self.tid, self.otype, self.price, self.qty, self.time, self.qid)
 
 
+class TapeRecord:
+    """
+    Base class for the records of what happened at the exchange, written on its tape and in the traders' blotters:
+    a Trade or a Cancel. These are slotted, rather than dictionaries, to cut the memory and allocation cost of the
+    millions of them in a long session. The fields are attributes (e.g. trade.price), but for compatibility with
+    code written for the dictionaries they can also be read by key (trade['price']), and print as a dictionary would.
+    Each subclass has a class-level 'type' ('Trade' or 'Cancel'), listed first in its keys().
+    """
+
+    __slots__ = ()
+    type = None
+
+    def __getitem__(self, key):
+        if key == 'type' or key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key == 'type' or key in self.__slots__
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return ('type',) + self.__slots__
+
+    def __eq__(self, other):
+        if isinstance(other, TapeRecord):
+            other = dict((key, other[key]) for key in other.keys())
+        return dict((key, self[key]) for key in self.keys()) == other
+
+    __hash__ = None     # mutable, like the dictionaries it replaces
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % (key, self[key]) for key in self.keys())
+
+
+class Trade(TapeRecord):
+    """ A transaction: qty units at price, between party1 (whose order was on the LOB) and party2 (the aggressor) """
+
+    __slots__ = ('time', 'price', 'party1', 'party2', 'qty')
+    type = 'Trade'
+
+    def __init__(self, time, price, party1, party2, qty):
+        self.time = time
+        self.price = price
+        self.party1 = party1
+        self.party2 = party2
+        self.qty = qty
+
+
+class Cancel(TapeRecord):
+    """ A cancellation: order was deleted from the LOB """
+
+    __slots__ = ('time', 'order')
+    type = 'Cancel'
+
+    def __init__(self, time, order):
+        self.time = time
+        self.order = order
+
+
+def tape_csv_str(tapeitem):
+    """
+    Return a tape item (a trade or a cancellation) as a line of CSV text, in the format used for tape files.
+    :param tapeitem: the tape item, a Trade or a Cancel.
+    :return: the CSV string, including the trailing newline.
+    """
+    if tapeitem.type == 'Trade':
+        return 'TRD, %f, %d\n' % (tapeitem.time, tapeitem.price)
+    else:
+        order = tapeitem.order
+        return 'CAN, %f, %d, %s, %d\n' % (tapeitem.time, order.qid, order.otype, order.price)
+
+
+def tape_write(tape_file, tapeitem):
+    """
+    Write a tape item to a tape file: either a line of CSV text, or a record in a columnar binary file.
+    :param tape_file: the file, or a ColumnarWriter.
+    :param tapeitem: the tape item.
+    :return: <nothing>
+    """
+    if isinstance(tape_file, ColumnarWriter):
+        tape_file.append_tapeitem(tapeitem)
+    else:
+        tape_file.write(tape_csv_str(tapeitem))
+
+
+class Tape:
+    """
+    The exchange's tape: a fixed-capacity ring-buffer of the most recent trade and cancellation records.
+    Appending is O(1): once the tape is full, each new item overwrites the oldest one, which is first
+    passed to the optional spill function (e.g. to write it to a file) so that evicted items need not be lost.
+    Indexing, len(), iteration and reversed() behave as they would on a list holding the same items in
+    time order (oldest first), so tape[-1] is the most recent item.
+    """
+
+    def __init__(self, capacity, spill=None):
+        """
+        Create an empty tape.
+        :param capacity: the maximum number of items held on the tape.
+        :param spill: if not None, a function called with each item as it is evicted from the tape.
+        """
+        if capacity < 1:
+            sys.exit('FAIL: Tape capacity must be 1 or more')
+        self.capacity = capacity
+        self.spill = spill
+        self.items = [None] * capacity
+        self.start = 0      # index in self.items of the oldest item on the tape
+        self.n = 0          # how many items are on the tape
+        self.total = 0      # how many items have ever been appended to the tape
+
+    def append(self, tapeitem):
+        """
+        Add an item to the end of the tape, evicting the oldest item if the tape is full.
+        :param tapeitem: the item to add.
+        :return: <nothing>
+        """
+        if self.n < self.capacity:
+            self.items[(self.start + self.n) % self.capacity] = tapeitem
+            self.n += 1
+        else:
+            if self.spill is not None:
+                self.spill(self.items[self.start])
+            self.items[self.start] = tapeitem
+            self.start = (self.start + 1) % self.capacity
+        self.total += 1
+
+    def clear(self):
+        """
+        Wipe the tape: NB wiped items are not passed to the spill function.
+        :return: <nothing>
+        """
+        self.items = [None] * self.capacity
+        self.start = 0
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [self[i] for i in range(*index.indices(self.n))]
+        if index < 0:
+            index += self.n
+        if index < 0 or index >= self.n:
+            raise IndexError('tape index out of range')
+        return self.items[(self.start + index) % self.capacity]
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self.items[(self.start + i) % self.capacity]
+
+    def __reversed__(self):
+        for i in range(self.n - 1, -1, -1):
+            yield self.items[(self.start + i) % self.capacity]
+
+    def view(self):
+        """
+        Return a read-only view of the tape as it is now, which doesn't change when more items are appended.
+        :return: the TapeView.
+        """
+        return TapeView(self, self.total, self.n)
+
+
+class TapeView:
+    """
+    A read-only view of a Tape as it was at some moment: no items are copied, the view just indexes into the
+    tape's ring-buffer, so it behaves like a list of the items that were on the tape at that moment.
+    NB an item that has since been evicted from the tape (or wiped by Tape.clear()) can't be read from the view.
+    """
+
+    def __init__(self, tape, total, n):
+        """
+        Create a view of a tape.
+        :param tape: the Tape.
+        :param total: the value of tape.total at the moment the view shows.
+        :param n: how many items were on the tape at that moment.
+        """
+        self.tape = tape
+        self.total = total
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [self[i] for i in range(*index.indices(self.n))]
+        if index < 0:
+            index += self.n
+        if index < 0 or index >= self.n:
+            raise IndexError('tape index out of range')
+        # convert to an index on the tape as it is now
+        tape = self.tape
+        index += tape.n - (tape.total - self.total) - self.n
+        if index < 0:
+            raise IndexError('tape item no longer held on tape')
+        return tape.items[(tape.start + index) % tape.capacity]
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in range(self.n - 1, -1, -1):
+            yield self[i]
+
+
+# columnar binary output files: a header, then a sequence of chunks each holding a batch of records column-by-column
+columnar_magic = b'BSECOL01'
+columnar_chunk_magic = b'CHNK'
+# column types: 'd' => float64; 'q' => int64; 's' => string, stored as an int32 code into the file's string-table
+columnar_itemtypes = {'d': 'd', 'q': 'q', 's': 'i'}
+# the schemas for the columnar versions of the tape and blotter files
+columnar_tape_columns = [['event', 's'], ['time', 'd'], ['price', 'q'], ['qty', 'q'],
+                         ['party1', 's'], ['party2', 's'], ['qid', 'q'], ['otype', 's']]
+columnar_blotter_columns = [['tid', 's'], ['type', 's'], ['time', 'd'], ['price', 'q'],
+                            ['party1', 's'], ['party2', 's'], ['qty', 'q']]
+
+
+def columnar_pad(n_bytes):
+    """ How many bytes of padding are needed after n_bytes to get to the next 8-byte boundary """
+    return (8 - n_bytes % 8) % 8
+
+
+class ColumnarWriter:
+    """
+    Writes records to a columnar binary file, as an alternative to text CSV: records are buffered in typed arrays,
+    one per column, and every chunk_rows records the whole batch goes out as one large write.
+    File layout: the magic bytes, a uint32 length, and a JSON header giving the schema; then the chunks, each being
+    b'CHNK', uint32 number of rows, uint32 length of a JSON chunk-header (listing any strings first used in this
+    chunk, which are appended to the file's string-table), then each column's data as a packed array.
+    Everything is padded to 8-byte boundaries, so that ColumnarReader can memory-map the columns in place.
+    """
+
+    def __init__(self, fname, schema, columns, fmode='w', chunk_rows=65536):
+        """
+        Open a columnar file for writing.
+        :param fname: the filename.
+        :param schema: name of the schema, e.g. 'tape' or 'blotter'.
+        :param columns: list of [name, type] pairs, type being one of 'd', 'q', or 's' (see columnar_itemtypes).
+        :param fmode: 'w' to write a new file, 'a' to append chunks to an existing file with the same schema.
+        :param chunk_rows: how many records to buffer before writing them out as a chunk.
+        """
+        self.fname = fname
+        self.schema = schema
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.string_codes = {}      # string => its code in the string-table
+        self.new_strings = []       # strings added to the string-table since the last chunk was written
+        self.n_rows = 0             # number of records buffered, not yet written
+        self.buffers = []
+        for column in columns:
+            if column[1] not in columnar_itemtypes:
+                sys.exit('FAIL: bad column type %s in ColumnarWriter' % column[1])
+            self.buffers.append(array(columnar_itemtypes[column[1]]))
+
+        if fmode == 'a' and os.path.isfile(fname) and os.path.getsize(fname) > 0:
+            # carry on from the end of the existing file, using its string-table
+            existing = ColumnarReader(fname)
+            if existing.schema != schema or existing.columns != columns:
+                sys.exit('FAIL: ColumnarWriter cannot append %s records to %s' % (schema, fname))
+            for code, string in enumerate(existing.strings):
+                self.string_codes[string] = code
+            existing.close()
+            self.file = open(fname, 'ab')
+        elif fmode == 'w' or fmode == 'a':
+            self.file = open(fname, 'wb')
+            header = json.dumps({'schema': schema, 'columns': columns, 'byteorder': sys.byteorder}).encode()
+            header += b' ' * columnar_pad(len(columnar_magic) + 4 + len(header))
+            self.file.write(columnar_magic + struct.pack('<I', len(header)) + header)
+        else:
+            sys.exit('FAIL: bad fmode=%s in ColumnarWriter' % fmode)
+
+    def string_code(self, string):
+        """ The code for a string in the string-table, adding it to the table if it's not already there """
+        code = self.string_codes.get(string)
+        if code is None:
+            code = len(self.string_codes)
+            self.string_codes[string] = code
+            self.new_strings.append(string)
+        return code
+
+    def append(self, record):
+        """
+        Add one record to the file.
+        :param record: list/tuple of values, one per column, in the same order as the columns.
+        :return: <nothing>
+        """
+        for c in range(len(self.columns)):
+            ctype = self.columns[c][1]
+            if ctype == 's':
+                self.buffers[c].append(self.string_code(str(record[c])))
+            elif ctype == 'q':
+                self.buffers[c].append(int(record[c]))
+            else:
+                self.buffers[c].append(record[c])
+        self.n_rows += 1
+        if self.n_rows >= self.chunk_rows:
+            self.flush()
+
+    def append_tapeitem(self, tapeitem):
+        """
+        Add a tape item (a trade or a cancellation) to a file with the columnar_tape_columns schema.
+        :param tapeitem: the tape item.
+        :return: <nothing>
+        """
+        if tapeitem.type == 'Trade':
+            self.append(['TRD', tapeitem.time, tapeitem.price, tapeitem.qty,
+                         tapeitem.party1, tapeitem.party2, -1, ''])
+        else:
+            order = tapeitem.order
+            self.append(['CAN', tapeitem.time, order.price, order.qty, order.tid, '', order.qid, order.otype])
+
+    def flush(self):
+        """
+        Write out any buffered records as one chunk.
+        :return: <nothing>
+        """
+        if self.n_rows == 0:
+            return
+        chunk_header = json.dumps({'strings': self.new_strings}).encode()
+        chunk_header += b' ' * columnar_pad(len(columnar_chunk_magic) + 8 + len(chunk_header))
+        blocks = [columnar_chunk_magic + struct.pack('<II', self.n_rows, len(chunk_header)) + chunk_header]
+        for buf in self.buffers:
+            data = buf.tobytes()
+            blocks.append(data + b'\0' * columnar_pad(len(data)))
+        self.file.write(b''.join(blocks))
+        self.file.flush()
+        self.new_strings = []
+        self.n_rows = 0
+        for c in range(len(self.buffers)):
+            self.buffers[c] = array(self.buffers[c].typecode)
+
+    def close(self):
+        """
+        Write out any buffered records and close the file.
+        :return: <nothing>
+        """
+        self.flush()
+        self.file.close()
+
+
+class ColumnarReader:
+    """
+    Reads a file written by ColumnarWriter, memory-mapping it so that the columns are read in place, not parsed.
+    column(name) gives a whole column: as a numpy array if numpy is available (zero-copy when the file has only one
+    chunk), otherwise as a memoryview (one chunk) or an array.array. String columns hold codes into self.strings.
+    """
+
+    def __init__(self, fname):
+        """
+        Open a columnar file and index its chunks.
+        :param fname: the filename.
+        """
+        self.fname = fname
+        self.file = open(fname, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(columnar_magic)] != columnar_magic:
+            sys.exit('FAIL: %s is not a BSE columnar file' % fname)
+        pos = len(columnar_magic)
+        header_len = struct.unpack_from('<I', self.mm, pos)[0]
+        pos += 4
+        header = json.loads(self.mm[pos:pos + header_len].decode())
+        pos += header_len
+        self.schema = header['schema']
+        self.columns = header['columns']
+        self.swap = header['byteorder'] != sys.byteorder
+        self.strings = []
+        self.chunks = []    # for each chunk: [number of rows, list of the file-offsets of each column's data]
+        self.n_rows = 0
+        while pos + 12 <= len(self.mm):
+            if self.mm[pos:pos + 4] != columnar_chunk_magic:
+                sys.exit('FAIL: bad chunk at offset %d in %s' % (pos, fname))
+            n_rows, chunk_header_len = struct.unpack_from('<II', self.mm, pos + 4)
+            pos += 12
+            self.strings += json.loads(self.mm[pos:pos + chunk_header_len].decode())['strings']
+            pos += chunk_header_len
+            offsets = []
+            for column in self.columns:
+                offsets.append(pos)
+                n_bytes = n_rows * array(columnar_itemtypes[column[1]]).itemsize
+                pos += n_bytes + columnar_pad(n_bytes)
+            self.chunks.append([n_rows, offsets])
+            self.n_rows += n_rows
+
+    def column(self, name):
+        """
+        Read a whole column.
+        :param name: the column's name.
+        :return: the column's values (codes into self.strings, for a string column).
+        """
+        c = [column[0] for column in self.columns].index(name)
+        itemtype = columnar_itemtypes[self.columns[c][1]]
+        itemsize = array(itemtype).itemsize
+        if numpy is not None:
+            dtype = numpy.dtype(itemtype)
+            if self.swap:
+                dtype = dtype.newbyteorder()
+            parts = [numpy.frombuffer(self.mm, dtype=dtype, count=n_rows, offset=offsets[c])
+                     for [n_rows, offsets] in self.chunks]
+            if len(parts) == 1:
+                return parts[0]
+            return numpy.concatenate(parts) if len(parts) > 0 else numpy.zeros(0, dtype=dtype)
+        if len(self.chunks) == 1 and not self.swap:
+            [n_rows, offsets] = self.chunks[0]
+            return memoryview(self.mm)[offsets[c]:offsets[c] + n_rows * itemsize].cast(itemtype)
+        values = array(itemtype)
+        for [n_rows, offsets] in self.chunks:
+            values.frombytes(self.mm[offsets[c]:offsets[c] + n_rows * itemsize])
+        if self.swap:
+            values.byteswap()
+        return values
+
+    def rows(self):
+        """
+        Iterate over the records, decoded back into dictionaries keyed by column name (slow, but handy).
+        :return: generator of dictionaries.
+        """
+        names = [column[0] for column in self.columns]
+        data = [self.column(name) for name in names]
+        is_string = [column[1] == 's' for column in self.columns]
+        for r in range(self.n_rows):
+            record = {}
+            for c in range(len(names)):
+                if is_string[c]:
+                    record[names[c]] = self.strings[data[c][r]]
+                else:
+                    record[names[c]] = data[c][r].item() if numpy is not None else data[c][r]
+            yield record
+
+    def close(self):
+        """ NB the memory-map can't be closed while any zero-copy column returned by column() is still in use """
+        self.mm.close()
+        self.file.close()
+
+
+class TradeStats:
+    """
+    Rolling statistics of recent transaction prices, maintained by the exchange: each trade updates them in O(1),
+    so traders can read the mean/VWAP/EMA/min/max of recent prices via the published LOB instead of rescanning the tape.
+    The most recent trades (up to capacity of them) are held in ring-buffers along with running totals, so the mean or
+    VWAP of the last n trades is just a difference of two running totals.
+    For each of the windows (in seconds) the min and max prices over that window are tracked with monotonic queues.
+    """
+
+    def __init__(self, capacity=10000, ema_alpha=0.1, windows=(60, 300)):
+        """
+        Create an empty set of trade statistics.
+        :param capacity: how many of the most recent trades are held (so the max n for mean() and vwap()).
+        :param ema_alpha: smoothing constant for the exponential moving average of trade prices.
+        :param windows: time-windows (in seconds) for which the min and max prices are tracked incrementally.
+        """
+        if capacity < 1:
+            sys.exit('FAIL: TradeStats capacity must be 1 or more')
+        self.capacity = capacity
+        # the ring-buffers hold one more than capacity, because the stats of n trades need the totals before them
+        self.ring = capacity + 1
+        self.times = [None] * self.ring
+        self.prices = [None] * self.ring
+        self.qtys = [None] * self.ring
+        # running totals of price, price*qty, and qty after each trade; cum_x[k % ring] is the total after k trades
+        self.cum_p = [0] * self.ring
+        self.cum_pq = [0] * self.ring
+        self.cum_q = [0] * self.ring
+        self.sum_p = 0
+        self.sum_pq = 0
+        self.sum_q = 0
+        self.total = 0          # how many trades there have ever been
+        self.ema_alpha = ema_alpha
+        self.ema = None         # exponential moving average of trade prices
+        self.windows = windows
+        # monotonic queues of [time, price]: prices increasing in win_min, decreasing in win_max
+        self.win_min = {}
+        self.win_max = {}
+        for window in windows:
+            self.win_min[window] = deque()
+            self.win_max[window] = deque()
+
+    def add(self, time, price, qty):
+        """
+        Update the statistics with a new trade.
+        :param time: the time of the trade.
+        :param price: the transaction price.
+        :param qty: the quantity traded.
+        :return: <nothing>
+        """
+        self.sum_p += price
+        self.sum_pq += price * qty
+        self.sum_q += qty
+        self.total += 1
+        i = self.total % self.ring
+        self.times[i] = time
+        self.prices[i] = price
+        self.qtys[i] = qty
+        self.cum_p[i] = self.sum_p
+        self.cum_pq[i] = self.sum_pq
+        self.cum_q[i] = self.sum_q
+        if self.ema is None:
+            self.ema = float(price)
+        else:
+            self.ema = self.ema_alpha * price + (1.0 - self.ema_alpha) * self.ema
+        for window in self.windows:
+            # trades that have dropped out of the window can never come back in, so discard them
+            t_from = time - window
+            wmin = self.win_min[window]
+            while len(wmin) > 0 and wmin[-1][1] >= price:
+                wmin.pop()
+            wmin.append([time, price])
+            while wmin[0][0] < t_from:
+                wmin.popleft()
+            wmax = self.win_max[window]
+            while len(wmax) > 0 and wmax[-1][1] <= price:
+                wmax.pop()
+            wmax.append([time, price])
+            while wmax[0][0] < t_from:
+                wmax.popleft()
+
+    def view(self, time):
+        """
+        Return a read-only view of the statistics as they are now, which doesn't change when more trades happen.
+        :param time: the current time (the end of the windows for window_min() and window_max()).
+        :return: the TradeStatsView.
+        """
+        return TradeStatsView(self, self.total, self.ema, time)
+
+
+class TradeStatsView:
+    """
+    A read-only view of an exchange's TradeStats as they were at some moment: this is what the published LOB holds.
+    n is the number of trades so far, ema is the exponential moving average price (None if no trades yet), and
+    the methods give the statistics of the last n trades or of the trades within a time-window.
+    """
+
+    def __init__(self, stats, total, ema, time):
+        """
+        Create a view of a set of trade statistics.
+        :param stats: the TradeStats.
+        :param total: the value of stats.total at the moment the view shows.
+        :param ema: the value of stats.ema at that moment.
+        :param time: the time of that moment.
+        """
+        self.stats = stats
+        self.n = total
+        self.ema = ema
+        self.time = time
+
+    def cum(self, k, cum_x):
+        """ The running total cum_x after k trades, or None if that's no longer held """
+        if k == 0:
+            return 0
+        if k < 0 or k < self.stats.total - self.stats.capacity:
+            return None
+        return cum_x[k % self.stats.ring]
+
+    def last(self):
+        """
+        :return: the most recent transaction price, or None if there have been no trades.
+        """
+        if self.n == 0 or self.n <= self.stats.total - self.stats.capacity:
+            return None
+        return self.stats.prices[self.n % self.stats.ring]
+
+    def mean(self, n_last):
+        """
+        Mean transaction price of the last n_last trades.
+        :param n_last: how many trades to average over.
+        :return: the mean price, or None if there haven't been n_last trades yet.
+        """
+        if n_last < 1 or n_last > self.n:
+            return None
+        if n_last > self.stats.capacity:
+            sys.exit('FAIL: TradeStatsView.mean() n_last=%d > capacity %d' % (n_last, self.stats.capacity))
+        return (self.cum(self.n, self.stats.cum_p) - self.cum(self.n - n_last, self.stats.cum_p)) / n_last
+
+    def vwap(self, n_last=None):
+        """
+        Volume-weighted average transaction price.
+        :param n_last: how many trades to average over; if None then over all trades so far.
+        :return: the VWAP, or None if there haven't been n_last trades yet (or no trades at all).
+        """
+        if n_last is None:
+            n_last = self.n
+            if n_last > self.stats.capacity:
+                # the running totals are still held for the very first trade, so use them
+                sum_pq = self.cum(self.n, self.stats.cum_pq)
+                sum_q = self.cum(self.n, self.stats.cum_q)
+                return sum_pq / sum_q
+        if n_last < 1 or n_last > self.n:
+            return None
+        if n_last > self.stats.capacity:
+            sys.exit('FAIL: TradeStatsView.vwap() n_last=%d > capacity %d' % (n_last, self.stats.capacity))
+        sum_pq = self.cum(self.n, self.stats.cum_pq) - self.cum(self.n - n_last, self.stats.cum_pq)
+        sum_q = self.cum(self.n, self.stats.cum_q) - self.cum(self.n - n_last, self.stats.cum_q)
+        return sum_pq / sum_q
+
+    def window_min(self, window):
+        """
+        :param window: length of the time-window, in seconds.
+        :return: the lowest transaction price in the window ending at the view's time, or None if no trades in it.
+        """
+        return self.window_extreme(window, self.stats.win_min, min)
+
+    def window_max(self, window):
+        """
+        :param window: length of the time-window, in seconds.
+        :return: the highest transaction price in the window ending at the view's time, or None if no trades in it.
+        """
+        return self.window_extreme(window, self.stats.win_max, max)
+
+    def window_extreme(self, window, queues, extreme):
+        """
+        Min or max transaction price over a time-window: O(1) amortised if the window is one that's tracked and the
+        view is of the latest trade; otherwise found by scanning back over the held trades.
+        NB the queues are shared by all views, so they're only read here: TradeStats.add() discards old trades.
+        """
+        t_from = self.time - window
+        stats = self.stats
+        if window in queues and self.n == stats.total:
+            # skip any trades that have dropped out of the window since the latest trade
+            for [t, price] in queues[window]:
+                if t >= t_from:
+                    return price
+            return None
+        result = None
+        k = self.n
+        while k > 0 and k > stats.total - stats.capacity and stats.times[k % stats.ring] >= t_from:
+            price = stats.prices[k % stats.ring]
+            if result is None:
+                result = price
+            else:
+                result = extreme(result, price)
+            k -= 1
+        return result
+
+
 class OrderbookHalf:
     """
     OrderbookHalf is one side of the book: a list of bids or a list of asks, each sorted best-price-first,
     and with orders at the same price arranged by arrival time (oldest first) for time-priority processing.
+    The book is maintained incrementally: each addition, overwrite, deletion, or fill updates only the
+    price-level that it touches, rather than rebuilding the whole book from the dictionary of orders.
     """
 
     def __init__(self, booktype, worstprice):
@@ -104,8 +787,13 @@ class OrderbookHalf:
         self.orders = {}
         # limit order book, dictionary indexed by price, with order info
         self.lob = {}
-        # anonymized LOB, lists, with only price/qty info
+        # anonymized LOB, list of (price, qty) tuples: immutable, so they can be published without copying
         self.lob_anon = []
+        # sorted list of the prices currently on the LOB (same sequence as the prices in lob_anon)
+        self.lob_prices = []
+        # arrival sequence-number of each trader's order: queue position within a price-level
+        self.order_seq = {}
+        self.seq_counter = 0
         # summary stats
         self.best_price = None
         self.best_tid = None
@@ -113,6 +801,47 @@ class OrderbookHalf:
         self.session_extreme = None    # most extreme price quoted in this session
         self.n_orders = 0  # how many orders?
         self.lob_depth = 0  # how many different prices on lob?
+        # version number, incremented on every change to the book: used to decide when to republish
+        self.version = 0
+        self.side_snapshot = None   # most recently published snapshot of this side of the book
+        self.level_changes = None   # if not None, set of prices whose levels have changed (see LOBDeltaWriter)
+
+    def __getstate__(self):
+        """ For pickling (e.g. in a session checkpoint): the published snapshot is left out, it gets rebuilt """
+        state = self.__dict__.copy()
+        state['side_snapshot'] = None
+        return state
+
+    def book_changing(self):
+        """
+        Called at the start of every change to the book: bumps the version number and makes sure that the most
+        recent published snapshot keeps showing the book as it was before this change. That only takes a shallow
+        copy of lob_anon, as its (price, qty) tuples are shared with the snapshot rather than copied.
+        :return: <nothing>
+        """
+        self.version += 1
+        if self.side_snapshot is not None:
+            self.side_snapshot.materialise()
+            self.side_snapshot = None
+
+    def anon_publish(self):
+        """
+        Hand out the anonymized LOB for publishing.
+        :return: lob_anon as a tuple of (price, qty) tuples: immutable, so no trader can alter the book through it.
+        """
+        return tuple(self.lob_anon)
+
+    def snapshot(self, depth):
+        """
+        Return a read-only snapshot of this side of the LOB, reusing the previous one if the book hasn't changed.
+        :param depth: if not None, the max number of price-levels to show in the snapshot's 'lob'.
+        :return: the LOBSideSnapshot.
+        """
+        snap = self.side_snapshot
+        if snap is None or snap.depth != depth:
+            snap = LOBSideSnapshot(self, depth)
+            self.side_snapshot = snap
+        return snap
 
     def anonymize_lob(self):
         """
@@ -120,47 +849,132 @@ class OrderbookHalf:
         NB for asks, the sorting should be reversed
         :return: <nothing>
         """
+        self.lob_prices = sorted(self.lob)
         self.lob_anon = []
-        for price in sorted(self.lob):
+        for price in self.lob_prices:
             qty = self.lob[price][0]
-            self.lob_anon.append([price, qty])
+            self.lob_anon.append((price, qty))
 
     def build_lob(self):
         """
-        Take a list of orders and build a limit-order-book (lob) from it
+        Take a list of orders and build a limit-order-book (lob) from it, from scratch.
+        The book is normally kept up to date incrementally by book_add(), book_del(), and delete_best(),
+        so this full rebuild is only needed if self.orders has been altered directly.
         NB the exchange needs to know arrival times and trader-id associated with each order
         also builds anonymized version (just price/quantity, sorted, as a list) for publishing to traders
-        :return: lob as a dictionary (i.e., unsorted)
+        :return: <nothing>
         """
-        lob_verbose = False
+        self.book_changing()
+        if self.level_changes is not None:
+            self.level_changes.update([price for [price, qty] in self.lob_anon])
         self.lob = {}
+        self.lob_prices = []
+        self.lob_anon = []
         for tid in self.orders:
-            order = self.orders.get(tid)
-            price = order.price
-            if price in self.lob:
-                # update existing entry
-                qty = self.lob[price][0]
-                orderlist = self.lob[price][1]
-                orderlist.append([order.time, order.qty, order.tid, order.qid])
-                self.lob[price] = [qty + order.qty, orderlist]
-            else:
-                # create a new dictionary entry
-                self.lob[price] = [order.qty, [[order.time, order.qty, order.tid, order.qid]]]
-        # create anonymized version
-        self.anonymize_lob()
-        # record best price and associated trader-id
-        if len(self.lob) > 0:
+            if tid not in self.order_seq:
+                self.order_seq[tid] = self.seq_counter
+                self.seq_counter += 1
+            self.level_add(self.orders[tid])
+        self.best_update()
+
+        if tracer.debug:
+            tracer.trace(trace_debug, 'build_lob: %s', self.lob)
+
+    def level_add(self, order):
+        """
+        Add an order to its price-level on the LOB, creating the level if needed.
+        Within a level, orders are queued by their sequence-number in self.order_seq,
+        which is the position of the trader's order in self.orders (an overwrite keeps its place).
+        :param order: the order to be added: its trader-i.d. must already have a sequence-number.
+        :return: <nothing>
+        """
+        price = order.price
+        if self.level_changes is not None:
+            self.level_changes.add(price)
+        entry = [order.time, order.qty, order.tid, order.qid]
+        level = self.lob.get(price)
+        if level is None:
+            # create a new price-level, inserted into the sorted list of prices
+            i = bisect.bisect_left(self.lob_prices, price)
+            self.lob_prices.insert(i, price)
+            self.lob_anon.insert(i, (price, order.qty))
+            self.lob[price] = [order.qty, [entry]]
+            self.lob_depth = len(self.lob_prices)
+        else:
+            # join the queue at this price: usually at the back, but an overwrite may have an older seq-number
+            orderlist = level[1]
+            seq = self.order_seq[order.tid]
+            pos = len(orderlist)
+            while pos > 0 and self.order_seq[orderlist[pos - 1][2]] > seq:
+                pos -= 1
+            orderlist.insert(pos, entry)
+            level[0] += order.qty
+            i = bisect.bisect_left(self.lob_prices, price)
+            self.lob_anon[i] = (price, level[0])
+
+    def level_del(self, order):
+        """
+        Remove an order from its price-level on the LOB, deleting the level if it is left empty.
+        :param order: the order to be removed, as currently recorded in self.orders.
+        :return: <nothing>
+        """
+        price = order.price
+        if self.level_changes is not None:
+            self.level_changes.add(price)
+        level = self.lob[price]
+        orderlist = level[1]
+        for pos in range(len(orderlist)):
+            if orderlist[pos][2] == order.tid:
+                del (orderlist[pos])
+                break
+        level[0] -= order.qty
+        i = bisect.bisect_left(self.lob_prices, price)
+        if len(orderlist) == 0:
+            del (self.lob[price])
+            del (self.lob_prices[i])
+            del (self.lob_anon[i])
+            self.lob_depth = len(self.lob_prices)
+        else:
+            self.lob_anon[i] = (price, level[0])
+
+    def best_update(self):
+        """
+        Record the best price on this side of the LOB, and the trader-i.d. at the front of the queue at that price.
+        :return: <nothing>
+        """
+        if len(self.lob_prices) > 0:
             if self.booktype == 'Bid':
-                self.best_price = self.lob_anon[-1][0]
+                self.best_price = self.lob_prices[-1]
             else:
-                self.best_price = self.lob_anon[0][0]
+                self.best_price = self.lob_prices[0]
             self.best_tid = self.lob[self.best_price][1][0][2]
         else:
             self.best_price = None
             self.best_tid = None
 
-        if lob_verbose:
-            print(self.lob)
+    def depth_at(self, price):
+        """
+        How much quantity is on this side of the LOB at the given price?
+        :param price: the price.
+        :return: the total quantity at that price (zero if none).
+        """
+        level = self.lob.get(price)
+        if level is None:
+            return 0
+        return level[0]
+
+    def anon_top(self, n):
+        """
+        The n best price-levels on this side of the LOB.
+        :param n: how many price-levels.
+        :return: tuple of (price, qty) in the same ascending-price layout as lob_anon (so for bids the best is last).
+        """
+        if n >= len(self.lob_anon):
+            return self.anon_publish()
+        if self.booktype == 'Bid':
+            return tuple(self.lob_anon[-n:])
+        else:
+            return tuple(self.lob_anon[:n])
 
     def book_add(self, order):
         """
@@ -178,15 +992,22 @@ class OrderbookHalf:
             self.session_extreme = int(order.price)
 
         # add the order to the book
-        n_orders = self.n_orders
+        self.book_changing()
+        old_order = self.orders.get(order.tid)
+        if old_order is not None:
+            # overwrite: take the old order off its price-level
+            self.level_del(old_order)
+            response = 'Overwrite'
+        else:
+            self.order_seq[order.tid] = self.seq_counter
+            self.seq_counter += 1
+            response = 'Addition'
         self.orders[order.tid] = order
         self.n_orders = len(self.orders)
-        self.build_lob()
+        self.level_add(order)
+        self.best_update()
         # print('book_add < %s %s' % (order, self.orders))
-        if n_orders != self.n_orders:
-            return 'Addition'
-        else:
-            return 'Overwrite'
+        return response
 
     def book_del(self, order):
         """
@@ -196,10 +1017,14 @@ class OrderbookHalf:
         :param order: the order to be deleted.
         :return: <nothing>
         """
-        if self.orders.get(order.tid) is not None:
+        old_order = self.orders.get(order.tid)
+        if old_order is not None:
+            self.book_changing()
+            self.level_del(old_order)
             del (self.orders[order.tid])
+            del (self.order_seq[order.tid])
             self.n_orders = len(self.orders)
-            self.build_lob()
+            self.best_update()
         # print('book_del %s', self.orders)
 
     def delete_best(self):
@@ -207,48 +1032,592 @@ class OrderbookHalf:
         When the best bid/ask has been hit/lifted, delete it from the book.
         :return: TraderID of the deleted order is return-value, as counterparty to the trade.
         """
+        self.book_changing()
+        best_price_counterparty = self.lob[self.best_price][1][0][2]
+        self.level_del(self.orders[best_price_counterparty])
+        del (self.orders[best_price_counterparty])
+        del (self.order_seq[best_price_counterparty])
+        self.n_orders = self.n_orders - 1
+        self.best_update()
+        return best_price_counterparty
+
+
+class OrderbookHalfLadder(OrderbookHalf):
+    """
+    An alternative implementation of OrderbookHalf, with the same interface and the same results, in which
+    the book is a dense array ("ladder") indexed by price in ticks, holding the total quantity and the queue
+    of orders at each price, plus cursors on the lowest and highest prices currently on the book.
+    Best bid/ask and depth-at-price are then O(1), and the n best price-levels can be read straight off the
+    ladder. The anonymized LOB is only rebuilt (by a scan between the cursors) when it is asked for after a change.
+    The ladder initially spans the system min/max prices, and is extended if an order arrives outside that range.
+    """
+
+    def __init__(self, booktype, worstprice):
+        """
+        Create one side of the LOB
+        :param booktype: specifies bid or ask side of the LOB.
+        :param worstprice: the initial value of the worst price currently showing on the LOB.
+        """
+        self.booktype = booktype
+        # dictionary of orders received, indexed by Trader ID
+        self.orders = {}
+        # arrival sequence-number of each trader's order: queue position within a price-level
+        self.order_seq = {}
+        self.seq_counter = 0
+        # the ladder: ladder_qty[i] and ladder_queue[i] are the quantity and order-queue at price ladder_min + i
+        self.ladder_min = bse_sys_minprice
+        self.ladder_qty = [0] * (bse_sys_maxprice + 1 - bse_sys_minprice)
+        self.ladder_queue = [None] * (bse_sys_maxprice + 1 - bse_sys_minprice)
+        self.lo_price = None        # lowest price with nonzero quantity on the ladder
+        self.hi_price = None        # highest price with nonzero quantity on the ladder
+        self.anon_cache = []        # anonymized LOB, rebuilt when anon_dirty
+        self.anon_dirty = False
+        # summary stats
+        self.best_price = None
+        self.best_tid = None
+        self.worstprice = worstprice
+        self.session_extreme = None    # most extreme price quoted in this session
+        self.n_orders = 0  # how many orders?
+        self.lob_depth = 0  # how many different prices on lob?
+        self.version = 0
+        self.side_snapshot = None   # most recently published snapshot of this side of the book
+        self.level_changes = None   # if not None, set of prices whose levels have changed (see LOBDeltaWriter)
 
-        best_price_orders = self.lob[self.best_price]
-        best_price_qty = best_price_orders[0]
-        best_price_counterparty = best_price_orders[1][0][2]
-        if best_price_qty == 1:
-            # here the order deletes the best price
-            del (self.lob[self.best_price])
-            del (self.orders[best_price_counterparty])
-            self.n_orders = self.n_orders - 1
-            if self.n_orders > 0:
-                if self.booktype == 'Bid':
-                    self.best_price = max(self.lob.keys())
-                else:
-                    self.best_price = min(self.lob.keys())
-                self.lob_depth = len(self.lob.keys())
+    def anon_publish(self):
+        """
+        Hand out the anonymized LOB for publishing.
+        :return: lob_anon (rebuilt first if the ladder has changed) as a tuple of (price, qty) tuples: immutable,
+            so no trader can alter the ladder's cached copy through it.
+        """
+        return tuple(self.lob_anon)
+
+    @property
+    def lob_anon(self):
+        """ anonymized LOB: sorted list of (price, qty), as in OrderbookHalf, rebuilt only if the ladder has changed """
+        if self.anon_dirty:
+            self.anonymize_lob()
+        return self.anon_cache
+
+    @property
+    def lob(self):
+        """ limit order book as a dictionary indexed by price (as in OrderbookHalf), built from the ladder """
+        lob = {}
+        for [price, qty] in self.lob_anon:
+            lob[price] = [qty, self.ladder_queue[price - self.ladder_min]]
+        return lob
+
+    def anonymize_lob(self):
+        """
+        anonymize a lob, strip out order details, format as a sorted list
+        :return: <nothing>
+        """
+        self.anon_cache = []
+        if self.lo_price is not None:
+            for i in range(self.lo_price - self.ladder_min, self.hi_price - self.ladder_min + 1):
+                if self.ladder_qty[i] > 0:
+                    self.anon_cache.append((self.ladder_min + i, self.ladder_qty[i]))
+        self.anon_dirty = False
+
+    def build_lob(self):
+        """
+        Rebuild the ladder from scratch from the dictionary of orders.
+        :return: <nothing>
+        """
+        self.book_changing()
+        if self.level_changes is not None:
+            self.level_changes.update([price for [price, qty] in self.lob_anon])
+        n_ticks = len(self.ladder_qty)
+        self.ladder_qty = [0] * n_ticks
+        self.ladder_queue = [None] * n_ticks
+        self.lo_price = None
+        self.hi_price = None
+        self.lob_depth = 0
+        for tid in self.orders:
+            if tid not in self.order_seq:
+                self.order_seq[tid] = self.seq_counter
+                self.seq_counter += 1
+            self.level_add(self.orders[tid])
+        self.best_update()
+
+    def ladder_fit(self, price):
+        """
+        Extend the ladder, if necessary, so that it spans the given price.
+        :param price: the price that needs to be on the ladder.
+        :return: <nothing>
+        """
+        if price < self.ladder_min:
+            n_extra = self.ladder_min - price
+            self.ladder_qty = [0] * n_extra + self.ladder_qty
+            self.ladder_queue = [None] * n_extra + self.ladder_queue
+            self.ladder_min = price
+        elif price >= self.ladder_min + len(self.ladder_qty):
+            # at least double the length of the ladder, so that repeated extensions are rare
+            n_extra = max(price + 1 - (self.ladder_min + len(self.ladder_qty)), len(self.ladder_qty))
+            self.ladder_qty = self.ladder_qty + [0] * n_extra
+            self.ladder_queue = self.ladder_queue + [None] * n_extra
+
+    def level_add(self, order):
+        """
+        Add an order to its price-level on the ladder (cf. OrderbookHalf.level_add()).
+        :param order: the order to be added: its trader-i.d. must already have a sequence-number.
+        :return: <nothing>
+        """
+        price = order.price
+        if self.level_changes is not None:
+            self.level_changes.add(price)
+        if price < self.ladder_min or price >= self.ladder_min + len(self.ladder_qty):
+            self.ladder_fit(price)
+        i = price - self.ladder_min
+        entry = [order.time, order.qty, order.tid, order.qid]
+        orderlist = self.ladder_queue[i]
+        if orderlist is None:
+            self.ladder_queue[i] = [entry]
+            self.lob_depth += 1
+            if self.lo_price is None or price < self.lo_price:
+                self.lo_price = price
+            if self.hi_price is None or price > self.hi_price:
+                self.hi_price = price
+        else:
+            seq = self.order_seq[order.tid]
+            pos = len(orderlist)
+            while pos > 0 and self.order_seq[orderlist[pos - 1][2]] > seq:
+                pos -= 1
+            orderlist.insert(pos, entry)
+        self.ladder_qty[i] += order.qty
+        self.anon_dirty = True
+
+    def level_del(self, order):
+        """
+        Remove an order from its price-level on the ladder, moving the lo/hi cursors if the level is emptied.
+        :param order: the order to be removed, as currently recorded in self.orders.
+        :return: <nothing>
+        """
+        price = order.price
+        if self.level_changes is not None:
+            self.level_changes.add(price)
+        i = price - self.ladder_min
+        orderlist = self.ladder_queue[i]
+        for pos in range(len(orderlist)):
+            if orderlist[pos][2] == order.tid:
+                del (orderlist[pos])
+                break
+        self.ladder_qty[i] -= order.qty
+        if len(orderlist) == 0:
+            self.ladder_queue[i] = None
+            self.lob_depth -= 1
+            if self.lob_depth == 0:
+                self.lo_price = None
+                self.hi_price = None
             else:
-                self.best_price = self.worstprice
-                self.lob_depth = 0
+                # walk the cursor(s) inward to the next occupied price
+                while self.ladder_queue[self.lo_price - self.ladder_min] is None:
+                    self.lo_price += 1
+                while self.ladder_queue[self.hi_price - self.ladder_min] is None:
+                    self.hi_price -= 1
+        self.anon_dirty = True
+
+    def best_update(self):
+        """
+        Record the best price on this side of the LOB, and the trader-i.d. at the front of the queue at that price.
+        :return: <nothing>
+        """
+        if self.booktype == 'Bid':
+            self.best_price = self.hi_price
+        else:
+            self.best_price = self.lo_price
+        if self.best_price is None:
+            self.best_tid = None
         else:
-            # best_bid_qty>1 so the order decrements the quantity of the best bid
-            # update the lob with the decremented order data
-            self.lob[self.best_price] = [best_price_qty - 1, best_price_orders[1][1:]]
-
-            # update the bid list: counterparty's bid has been deleted
-            del (self.orders[best_price_counterparty])
-            self.n_orders = self.n_orders - 1
-        self.build_lob()
+            self.best_tid = self.ladder_queue[self.best_price - self.ladder_min][0][2]
+
+    def delete_best(self):
+        """
+        When the best bid/ask has been hit/lifted, delete it from the book.
+        :return: TraderID of the deleted order is return-value, as counterparty to the trade.
+        """
+        self.book_changing()
+        best_price_counterparty = self.best_tid
+        self.level_del(self.orders[best_price_counterparty])
+        del (self.orders[best_price_counterparty])
+        del (self.order_seq[best_price_counterparty])
+        self.n_orders = self.n_orders - 1
+        self.best_update()
         return best_price_counterparty
 
+    def depth_at(self, price):
+        """
+        How much quantity is on this side of the LOB at the given price?
+        :param price: the price.
+        :return: the total quantity at that price (zero if none).
+        """
+        i = price - self.ladder_min
+        if i < 0 or i >= len(self.ladder_qty):
+            return 0
+        return self.ladder_qty[i]
+
+    def anon_top(self, n):
+        """
+        The n best price-levels on this side of the LOB, read off the ladder from the best price outward.
+        :param n: how many price-levels.
+        :return: tuple of (price, qty) in the same ascending-price layout as lob_anon.
+        """
+        if not self.anon_dirty:
+            return OrderbookHalf.anon_top(self, n)
+        top = []
+        if self.best_price is not None:
+            if self.booktype == 'Bid':
+                i = self.hi_price - self.ladder_min
+                i_end = self.lo_price - self.ladder_min
+                while i >= i_end and len(top) < n:
+                    if self.ladder_qty[i] > 0:
+                        top.append((self.ladder_min + i, self.ladder_qty[i]))
+                    i -= 1
+                top.reverse()
+            else:
+                i = self.lo_price - self.ladder_min
+                i_end = self.hi_price - self.ladder_min
+                while i <= i_end and len(top) < n:
+                    if self.ladder_qty[i] > 0:
+                        top.append((self.ladder_min + i, self.ladder_qty[i]))
+                    i += 1
+        return tuple(top)
+
+
+class ReadOnlyDict(dict):
+    """
+    A dictionary that can't be altered after it has been created: used for the LOB data published to traders.
+    Reading is exactly as fast as for an ordinary dictionary.
+    """
+
+    def read_only(self, *args, **kwargs):
+        """ Any attempt to alter the dictionary ends up here. """
+        raise TypeError('%s is read-only' % type(self).__name__)
+
+    __setitem__ = read_only
+    __delitem__ = read_only
+    clear = read_only
+    pop = read_only
+    popitem = read_only
+    setdefault = read_only
+    update = read_only
+
+
+class LOBSideSnapshot(ReadOnlyDict):
+    """
+    Read-only snapshot of one side of the LOB, as published to traders: a dictionary with the same keys as
+    publish_lob() has always given -- 'best', 'worst', ('sess_hi' for asks), 'n', and 'lob'.
+    The 'lob' tuple of (price, qty) items is only taken from the book when first read, or when the book is about
+    to change (whichever comes first), so it always shows the book as it was when published; being a tuple of
+    tuples, it can't be altered by a trader.
+    """
+
+    def __init__(self, book, depth):
+        """
+        Create a snapshot of one side of the book.
+        :param book: the OrderbookHalf.
+        :param depth: if not None, the max number of price-levels to show in 'lob'.
+        """
+        if book.booktype == 'Ask':
+            dict.__init__(self, best=book.best_price, worst=book.worstprice,
+                          sess_hi=book.session_extreme, n=book.n_orders)
+        else:
+            dict.__init__(self, best=book.best_price, worst=book.worstprice, n=book.n_orders)
+        self.book = book
+        self.depth = depth
+
+    def materialise(self):
+        """
+        Take the 'lob' tuple from the book, if that hasn't already been done.
+        :return: <nothing>
+        """
+        if self.book is not None:
+            if self.depth is None:
+                dict.__setitem__(self, 'lob', self.book.anon_publish())
+            else:
+                dict.__setitem__(self, 'lob', self.book.anon_top(self.depth))
+            self.book = None
+
+    def __missing__(self, key):
+        # dict only calls this for keys not yet present: i.e. 'lob' before it's been materialised
+        if key == 'lob' and self.book is not None:
+            self.materialise()
+            return dict.__getitem__(self, 'lob')
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        self.materialise()
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key == 'lob' or dict.__contains__(self, key)
+
+    def __iter__(self):
+        self.materialise()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.materialise()
+        return dict.__len__(self)
+
+    def __repr__(self):
+        self.materialise()
+        return dict.__repr__(self)
+
+    def keys(self):
+        self.materialise()
+        return dict.keys(self)
+
+    def values(self):
+        self.materialise()
+        return dict.values(self)
+
+    def items(self):
+        self.materialise()
+        return dict.items(self)
+
+    def copy(self):
+        self.materialise()
+        return dict(self)
+
+
+class LOBSnapshot(ReadOnlyDict):
+    """
+    Read-only, versioned snapshot of the public LOB data published by the exchange: a dictionary with keys
+    'time', 'bids', 'asks', 'QID', and 'tape', accessed just like the dictionary publish_lob() has always given,
+    plus 'price_stats', the exchange's rolling statistics of recent transaction prices.
+    The exchange only builds a new snapshot when the time or the state of the book/tape has changed.
+    """
+
+    def __init__(self, time, version, bids, asks, qid, tape, price_stats):
+        """
+        Create a snapshot.
+        :param time: the current time.
+        :param version: the exchange's version key for the state of the book/tape.
+        :param bids: LOBSideSnapshot of the bids.
+        :param asks: LOBSideSnapshot of the asks.
+        :param qid: the next quote i.d.
+        :param tape: TapeView of the tape.
+        :param price_stats: TradeStatsView of the recent transaction prices.
+        """
+        dict.__init__(self, time=time, bids=bids, asks=asks, QID=qid, tape=tape, price_stats=price_stats)
+        self.version = version
+
+
+def lob_frame_string(bids_anon, asks_anon):
+    """
+    The linear character-string summary of the LOB that is written as a LOB frame: for each side, the number of
+    price-levels followed by the price and quantity at each level, in ascending price order.
+    :param bids_anon: the anonymized bids, list of [price, qty].
+    :param asks_anon: the anonymized asks, list of [price, qty].
+    :return: the string.
+    """
+    return 'Bid:,%d,%sAsk:,%d,%s' % (len(bids_anon), ''.join(['%d,%d,' % (p, q) for [p, q] in bids_anon]),
+                                     len(asks_anon), ''.join(['%d,%d,' % (p, q) for [p, q] in asks_anon]))
+
+
+class LOBDeltaWriter:
+    """
+    Writes LOB frames as deltas: rather than the whole book, each frame has only the price-levels that have changed
+    since the previous frame, found from the set of prices that each side of the book records as it changes (see
+    OrderbookHalf.level_changes) -- so the cost of a frame depends on how much changed, not on the depth of the book.
+    Every keyframe_every frames, a keyframe with the whole book is written instead.
+    One line per frame: the time, then 'K' for a keyframe or 'D' for a delta, then the levels in the same layout as
+    a full LOB frame (see lob_frame_string); in a delta, a quantity of zero means that the level has gone. E.g.
+        12.345, D, Bid:,1,97,0,Ask:,2,120,1,121,2,
+    Frames are written at exactly the times that full LOB frames would be; lob_frames_from_deltas() replays them.
+    """
+
+    def __init__(self, outfile, keyframe_every=1000):
+        """
+        :param outfile: the file to write to.
+        :param keyframe_every: number of frames from one keyframe to the next.
+        """
+        self.outfile = outfile
+        self.keyframe_every = keyframe_every
+        self.levels = None      # [bids, asks], each a dictionary of price: qty, as of the last frame written
+        self.n_frames = 0       # frames written since the last keyframe
+
+    def __getstate__(self):
+        """ For pickling (e.g. in a session checkpoint): the output file is left out, and has to be reattached """
+        state = self.__dict__.copy()
+        state['outfile'] = None
+        return state
+
+    def record(self, time, bids, asks):
+        """
+        Write a frame, if any price-level has changed since the last one.
+        :param time: the current time.
+        :param bids: the bid side of the book (an OrderbookHalf).
+        :param asks: the ask side of the book.
+        :return: <nothing>
+        """
+        if self.levels is None:
+            # first frame: start tracking the changes to each side of the book, and write the whole book
+            bids.level_changes = set()
+            asks.level_changes = set()
+            self.levels = [{p: q for [p, q] in bids.lob_anon}, {p: q for [p, q] in asks.lob_anon}]
+            self.outfile.write('%.3f, K, %s\n' % (time, lob_frame_string(bids.lob_anon, asks.lob_anon)))
+            return
+
+        deltas = []
+        n_changed = 0
+        for half, levels in ((bids, self.levels[0]), (asks, self.levels[1])):
+            changed = []
+            for price in sorted(half.level_changes):
+                qty = half.depth_at(price)
+                # NB a level can be touched and yet end up as it was, e.g. an order overwritten at the same price
+                if qty != levels.get(price, 0):
+                    changed.append('%d,%d,' % (price, qty))
+                    if qty == 0:
+                        del (levels[price])
+                    else:
+                        levels[price] = qty
+            half.level_changes.clear()
+            deltas.append(changed)
+            n_changed += len(changed)
+        if n_changed == 0:
+            return
+
+        self.n_frames += 1
+        if self.n_frames >= self.keyframe_every:
+            self.outfile.write('%.3f, K, %s\n' % (time, lob_frame_string(bids.lob_anon, asks.lob_anon)))
+            self.n_frames = 0
+        else:
+            self.outfile.write('%.3f, D, Bid:,%d,%sAsk:,%d,%s\n' % (time, len(deltas[0]), ''.join(deltas[0]),
+                                                                    len(deltas[1]), ''.join(deltas[1])))
+
+    def flush(self):
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+def lob_frames_from_deltas(delta_fname, frames_fname=None, at_time=None):
+    """
+    Reconstruction tool for LOB delta files written by LOBDeltaWriter: replays the deltas into full LOB frames.
+    :param delta_fname: the delta file (if it was written compressed, give its uncompressed name: see sink_read_open).
+    :param frames_fname: if not None, all the frames (up to at_time) are written to this file, in exactly the format
+                         of a full LOB frames file.
+    :param at_time: if not None, replay only up to this time; if frames_fname is None, only the frames since the last
+                    keyframe before at_time need replaying.
+    :return: the frame at at_time (or the last frame) as [time, bids, asks], bids and asks being lists of [price, qty]
+             in ascending price order; or None if there are no frames that early.
+    """
+    delta_file = sink_read_open(delta_fname)
+    if delta_file is None:
+        sys.exit('FAIL: no LOB delta file %s' % delta_fname)
+    frames_file = None
+    if frames_fname is not None:
+        frames_file = open(frames_fname, 'w')
+
+    book = [{}, {}]
+    frame_time = None
+    pending = []    # lines since the most recent keyframe, when not writing every frame
+
+    def replay(frame_line):
+        """ Apply one line of the delta file to the book """
+        [time_str, kind, levels] = frame_line.split(', ', 2)
+        items = levels.split(',')
+        n_bids = int(items[1])
+        sides = [items[2:2 + 2 * n_bids], items[4 + 2 * n_bids:4 + 2 * n_bids + 2 * int(items[3 + 2 * n_bids])]]
+        for s in range(2):
+            if kind == 'K':
+                book[s] = {}
+            for i in range(0, len(sides[s]), 2):
+                qty = int(sides[s][i + 1])
+                if qty == 0:
+                    del (book[s][int(sides[s][i])])
+                else:
+                    book[s][int(sides[s][i])] = qty
+        return time_str
+
+    for line in delta_file:
+        [time_str, kind] = line.split(', ', 2)[:2]
+        if at_time is not None and float(time_str) > at_time:
+            break
+        if frames_file is None:
+            if kind == 'K':
+                pending = []
+            pending.append(line)
+        else:
+            replay(line)
+            frames_file.write('%s, %s\n' % (time_str, lob_frame_string(sorted(book[0].items()),
+                                                                         sorted(book[1].items()))))
+        frame_time = time_str
+    delta_file.close()
+
+    for line in pending:
+        replay(line)
+    if frames_file is not None:
+        frames_file.close()
+
+    if frame_time is None:
+        return None
+    return [float(frame_time), [[p, book[0][p]] for p in sorted(book[0])], [[p, book[1][p]] for p in sorted(book[1])]]
+
 
 class Orderbook(OrderbookHalf):
     """ Orderbook for a single tradeable asset: list of bids and list of asks """
 
-    def __init__(self):
-        """Construct a new orderbook"""
+    def __init__(self, tape_length=10000, tape_spill=None, lob_impl='dict', pub_depth=None):
+        """
+        Construct a new orderbook
+        :param tape_length: max events on the in-memory tape.
+        :param tape_spill: if not None, a file that events are written to as they are evicted from the tape.
+        :param lob_impl: how each side of the book is implemented:
+                'dict' => OrderbookHalf, price-levels in a dictionary plus a sorted list of prices;
+                'ladder' => OrderbookHalfLadder, price-levels in an array indexed by price.
+        :param pub_depth: if not None, the max number of price-levels on each side of the LOB given to traders.
+        """
 
-        self.bids = OrderbookHalf('Bid', bse_sys_minprice)
-        self.asks = OrderbookHalf('Ask', bse_sys_maxprice)
-        self.tape = []
-        self.tape_length = 10000    # max events on in-memory tape (older events can be written to tape_dump file)
+        if lob_impl == 'dict':
+            self.bids = OrderbookHalf('Bid', bse_sys_minprice)
+            self.asks = OrderbookHalf('Ask', bse_sys_maxprice)
+        elif lob_impl == 'ladder':
+            self.bids = OrderbookHalfLadder('Bid', bse_sys_minprice)
+            self.asks = OrderbookHalfLadder('Ask', bse_sys_maxprice)
+        else:
+            sys.exit('FAIL: unknown lob_impl=%s in Orderbook' % lob_impl)
+        self.lob_impl = lob_impl
+        self.pub_depth = pub_depth
+        self.tape_length = tape_length  # max events on in-memory tape (older events can be written to tape_spill file)
+        self.tape_spill = tape_spill
+        self.tape = Tape(self.tape_length)
+        if tape_spill is not None:
+            self.tape.spill = self.tape_spill_write
+        self.price_stats = TradeStats()     # rolling statistics of recent transaction prices
         self.quote_id = 0           # unique ID code for each quote accepted onto the book
         self.lob_string = ''        # character-string linearization of public lob items with nonzero quantities
+        self.lob_snapshot = None    # most recent LOBSnapshot returned by publish_lob()
+        self.lob_frame_version = None   # versions of the two sides of the book when lob_string was last checked
+
+    def __getstate__(self):
+        """ For pickling (e.g. in a session checkpoint): the published snapshot is left out, it gets rebuilt """
+        if self.tape_spill is not None:
+            sys.exit('FAIL: cannot pickle an Orderbook that has a tape_spill file')
+        state = self.__dict__.copy()
+        state['lob_snapshot'] = None
+        return state
+
+    def best_quotes(self):
+        """
+        The best price, and the total quantity at that price, on each side of the book.
+        :return: tuple (best bid price, best bid qty, best ask price, best ask qty); prices and qtys are None if empty.
+        """
+        bid_p = self.bids.best_price
+        ask_p = self.asks.best_price
+        bid_q = None if bid_p is None else self.bids.depth_at(bid_p)
+        ask_q = None if ask_p is None else self.asks.depth_at(ask_p)
+        return bid_p, bid_q, ask_p, ask_q
+
+    def tape_spill_write(self, tapeitem):
+        """
+        Write an item that is being evicted from the in-memory tape to the tape_spill file.
+        :param tapeitem: the evicted trade or cancellation record.
+        :return: <nothing>
+        """
+        tape_write(self.tape_spill, tapeitem)
 
 
 class Exchange(Orderbook):
@@ -266,16 +1635,11 @@ class Exchange(Orderbook):
         self.quote_id = order.qid + 1
         if vrbs:
             print('add_order QID=%d self.quote.id=%d' % (order.qid, self.quote_id))
+        # NB book_add() also updates that side's best_price and best_tid
         if order.otype == 'Bid':
             response = self.bids.book_add(order)
-            best_price = self.bids.lob_anon[-1][0]
-            self.bids.best_price = best_price
-            self.bids.best_tid = self.bids.lob[best_price][1][0][2]
         else:
             response = self.asks.book_add(order)
-            best_price = self.asks.lob_anon[0][0]
-            self.asks.best_price = best_price
-            self.asks.best_tid = self.asks.lob[best_price][1][0][2]
         return [order.qid, response]
 
     def del_order(self, time, order, tape_file, vrbs):
@@ -291,37 +1655,21 @@ class Exchange(Orderbook):
         if vrbs:
             print('del_order QID=%d' % order.qid)
         if order.otype == 'Bid':
+            # NB book_del() also updates best_price and best_tid (both None if this side of book is now empty)
             self.bids.book_del(order)
-            if self.bids.n_orders > 0:
-                best_price = self.bids.lob_anon[-1][0]
-                self.bids.best_price = best_price
-                self.bids.best_tid = self.bids.lob[best_price][1][0][2]
-            else:  # this side of book is empty
-                self.bids.best_price = None
-                self.bids.best_tid = None
-            cancel_record = {'type': 'Cancel', 'time': time, 'order': order}
+            cancel_record = Cancel(time, order)
             if tape_file is not None:
-                tape_file.write('CAN, %f, %d, Bid, %d\n' % (time, order.qid, order.price))
+                tape_write(tape_file, cancel_record)
+            # the tape is a ring-buffer so it keeps only the most recent items
             self.tape.append(cancel_record)
-            # right-truncate the tape so that it keeps only the most recent items
-            self.tape = self.tape[-self.tape_length:]
 
         elif order.otype == 'Ask':
             self.asks.book_del(order)
-            if self.asks.n_orders > 0:
-                best_price = self.asks.lob_anon[0][0]
-                self.asks.best_price = best_price
-                self.asks.best_tid = self.asks.lob[best_price][1][0][2]
-            else:  # this side of book is empty
-                self.asks.best_price = None
-                self.asks.best_tid = None
-            
-            cancel_record = {'type': 'Cancel', 'time': time, 'order': order}
+            cancel_record = Cancel(time, order)
             if tape_file is not None:
-                tape_file.write('CAN, %f, %d, Ask, %d\n' % (time, order.qid, order.price))
+                tape_write(tape_file, cancel_record)
+            # the tape is a ring-buffer so it keeps only the most recent items
             self.tape.append(cancel_record)
-            # right-truncate the tape so that it keeps only the most recent items
-            self.tape = self.tape[-self.tape_length:]
         else:
             # neither bid nor ask?
             sys.exit('bad order type in del_quote()')
@@ -387,91 +1735,80 @@ class Exchange(Orderbook):
             # process the trade
             if vrbs:
                 print('>>>>>>>>>>>>>>>>>TRADE t=%010.3f $%d %s %s' % (time, price, counterparty, order.tid))
-            transaction_record = {'type': 'Trade',
-                                  'time': time,
-                                  'price': price,
-                                  'party1': counterparty,
-                                  'party2': order.tid,
-                                  'qty': order.qty
-                                  }
+            transaction_record = Trade(time, price, counterparty, order.tid, order.qty)
             if tape_file is not None:
-                tape_file.write('TRD, %f, %d\n' % (time, price))
+                tape_write(tape_file, transaction_record)
+            # the tape is a ring-buffer so it keeps only the most recent items
             self.tape.append(transaction_record)
-            # right-truncate the tape so that it keeps only the most recent items
-            self.tape = self.tape[-self.tape_length:]
+            self.price_stats.add(time, price, order.qty)
 
             return transaction_record
         else:
             return None
 
-    def tape_dump(self, fname, fmode, tmode):
+    def tape_dump(self, fname, fmode, tmode, fformat='csv'):
         """
         Currently tape_dump only writes a list of transactions (i.e., it ignores any cancellations)
         :param fname: filename to write to.
         :param fmode: file-open write/append mode.
         :param tmode: if set to 'wipe', wipes the tape clean after writing it to file.
+        :param fformat: 'csv' for a text file; 'columnar' for a columnar binary file (see ColumnarWriter).
         :return:
         """
+        if fformat == 'columnar':
+            dumpfile = ColumnarWriter(fname, 'tape', columnar_tape_columns, fmode[:1])
+            for tapeitem in self.tape:
+                if tapeitem.type == 'Trade':
+                    dumpfile.append_tapeitem(tapeitem)
+            dumpfile.close()
+            if tmode == 'wipe':
+                self.tape.clear()
+            return
         dumpfile = open(fname, fmode)
         dumpfile.write('Event Type, Time, Price\n')
         for tapeitem in self.tape:
-            if tapeitem['type'] == 'Trade':
-                dumpfile.write('Trd, %010.3f, %s\n' % (tapeitem['time'], tapeitem['price']))
+            if tapeitem.type == 'Trade':
+                dumpfile.write('Trd, %010.3f, %s\n' % (tapeitem.time, tapeitem.price))
         dumpfile.close()
         if tmode == 'wipe':
-            self.tape = []
+            self.tape.clear()
 
     def publish_lob(self, time, lob_file, vrbs):
         """
         Returns the public LOB data published by the exchange, 
         i.e. the version of the LOB that's accessible to the traders.
+        This is a read-only LOBSnapshot: if neither the time nor the book/tape have changed since the previous call,
+        the previous snapshot is returned again; and each side of the book is only re-snapshotted if it has changed.
         :param time: the current time.
-        :param lob_file: 
+        :param lob_file: if not None, write a frame of LOB data to this file whenever the LOB has changed.
         :param vrbs: verbosity: if True, print a running commentary; if False, stay silent.
         :return: the public LOB data.
         """
-        public_data = dict()
-        public_data['time'] = time
-        public_data['bids'] = {'best': self.bids.best_price,
-                               'worst': self.bids.worstprice,
-                               'n': self.bids.n_orders,
-                               'lob': self.bids.lob_anon}
-        public_data['asks'] = {'best': self.asks.best_price,
-                               'worst': self.asks.worstprice,
-                               'sess_hi': self.asks.session_extreme,
-                               'n': self.asks.n_orders,
-                               'lob': self.asks.lob_anon}
-        public_data['QID'] = self.quote_id
-        public_data['tape'] = self.tape
-
-        if lob_file is not None:
-            # build a linear character-string summary of only those prices on LOB with nonzero quantities
-            lobstring = 'Bid:,'
-            n_bids = len(self.bids.lob_anon)
-            if n_bids > 0:
-                lobstring += '%d,' % n_bids
-                for lobitem in self.bids.lob_anon:
-                    price_str = '%d,' % lobitem[0]
-                    qty_str = '%d,' % lobitem[1]
-                    lobstring = lobstring + price_str + qty_str
-            else:
-                lobstring += '0,'
-            lobstring += 'Ask:,'
-            n_asks = len(self.asks.lob_anon)
-            if n_asks > 0:
-                lobstring += '%d,' % n_asks
-                for lobitem in self.asks.lob_anon:
-                    price_str = '%d,' % lobitem[0]
-                    qty_str = '%d,' % lobitem[1]
-                    lobstring = lobstring + price_str + qty_str
+        version = (time, self.bids.version, self.asks.version, self.tape.total, self.quote_id)
+        if self.lob_snapshot is not None and self.lob_snapshot.version == version:
+            public_data = self.lob_snapshot
+        else:
+            # NB if pub_depth is not None then only the best pub_depth price-levels on each side are published
+            public_data = LOBSnapshot(time, version,
+                                      self.bids.snapshot(self.pub_depth), self.asks.snapshot(self.pub_depth),
+                                      self.quote_id, self.tape.view(), self.price_stats.view(time))
+            self.lob_snapshot = public_data
+
+        if lob_file is not None and self.lob_frame_version != (self.bids.version, self.asks.version):
+            # the book has changed since the last check, so maybe need to write a new frame
+            self.lob_frame_version = (self.bids.version, self.asks.version)
+            if isinstance(lob_file, LOBDeltaWriter):
+                # only the price-levels that have changed get written
+                lob_file.record(time, self.bids, self.asks)
             else:
-                lobstring += '0,'
-            # is this different to the last lob_string?
-            if lobstring != self.lob_string:
-                # write it
-                lob_file.write('%.3f, %s\n' % (time, lobstring))
-                # remember it
-                self.lob_string = lobstring
+                # build a linear character-string summary of only those prices on LOB with nonzero quantities
+                lobstring = lob_frame_string(self.bids.lob_anon, self.asks.lob_anon)
+                # is this different to the last lob_string?
+                if lobstring != self.lob_string:
+                    # write it
+                    lob_file.write('%.3f, %s\n' % (time, lobstring))
+                    # remember it
+                    self.lob_string = lobstring
 
         if vrbs:
             vstr = 'publish_lob: t=%f' % time
@@ -484,6 +1821,97 @@ class Exchange(Orderbook):
         return public_data
 
 
+# diagnostic tracing levels: a message is only recorded if its level is no more than the tracer's level
+trace_off = 0       # record nothing
+trace_info = 1      # occasional messages, e.g. when traders are created or switch strategy
+trace_debug = 2     # detailed messages from inside traders' getorder()/respond(), possibly on every call
+
+
+class Tracer:
+    """
+    Level-based tracing of diagnostic messages from the traders, separate from the vrbs running commentary.
+    Messages are recorded in an in-memory ring of the most recent ones, or written to a file.
+    Call sites check the tracer's level before building a message, and the message is only formatted
+    from its arguments once it's known to be wanted, so with tracing switched off (the default) diagnostics cost nothing.
+    """
+
+    def __init__(self, level=trace_off, fname=None, ring_length=10000, echo=False):
+        """
+        Create a tracer.
+        :param level: trace_off, trace_info, or trace_debug.
+        :param fname: if not None, write messages to this file rather than to the in-memory ring.
+        :param ring_length: how many of the most recent messages the in-memory ring holds.
+        :param echo: if True, also print each message.
+        """
+        self.level = trace_off
+        self.debug = False      # True if debug-level messages are being recorded: cheapest check for call sites
+        self.ring = deque(maxlen=ring_length)
+        self.outfile = None
+        self.echo = echo
+        self.configure(level, fname)
+
+    def __getstate__(self):
+        # a trace file isn't carried over, e.g. into a session checkpoint
+        state = self.__dict__.copy()
+        state['outfile'] = None
+        return state
+
+    def configure(self, level, fname=None):
+        """
+        Set the tracing level, and where the messages go.
+        :param level: trace_off, trace_info, or trace_debug; or their names 'off', 'info', or 'debug'.
+        :param fname: if not None, write messages to this file (appending); if None, to the in-memory ring.
+        :return: <nothing>
+        """
+        if level in ('off', 'info', 'debug'):
+            level = ('off', 'info', 'debug').index(level)
+        if level not in (trace_off, trace_info, trace_debug):
+            sys.exit('FAIL: bad tracing level %s' % str(level))
+        self.level = level
+        self.debug = level >= trace_debug
+        self.close()
+        if fname is not None:
+            self.outfile = open(fname, 'a')
+
+    def trace(self, level, fmt, *args):
+        """
+        Record a message, if the tracing level is high enough.
+        :param level: the message's level, trace_info or trace_debug.
+        :param fmt: %-format string for the message.
+        :param args: the values to be formatted into the message (only formatted if the message is recorded).
+        :return: <nothing>
+        """
+        if level > self.level:
+            return
+        if len(args) > 0:
+            msg = fmt % args
+        else:
+            msg = fmt
+        if self.outfile is not None:
+            self.outfile.write(msg + '\n')
+        else:
+            self.ring.append(msg)
+        if self.echo:
+            print(msg)
+
+    def messages(self):
+        """
+        The messages in the in-memory ring.
+        :return: list of message strings, oldest first.
+        """
+        return list(self.ring)
+
+    def close(self):
+        """ Close the trace file, if there is one """
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+
+# the tracer used by the traders (and by anything else wanting to record diagnostics)
+tracer = Tracer()
+
+
 # #################--Traders below here--#############
 
 
@@ -492,6 +1920,12 @@ class Exchange(Orderbook):
 class Trader:
     """The parent class for all types of robot trader in BSE"""
 
+    # which market events this type of trader wants its respond() called for: see RespondDispatcher
+    # 'timer' => every time that the traders get to respond, i.e. the same as notifying every trader every time
+    subscriptions = ('timer',)
+    # does this type of trader give itself customer orders in respond()? (cf. the event-driven kernel's active traders)
+    self_orders = False
+
     def __init__(self, ttype, tid, balance, params, time):
         """
         Initializes a generic trader with attributes common to all/most types of trader
@@ -504,18 +1938,86 @@ class Trader:
         """
         self.ttype = ttype          # what type / strategy this trader is
         self.tid = tid              # trader unique ID code
-        self.balance = balance      # money in the bank
+        self.popstats = None        # if not None, the PopulationStats that are kept up to date with this trader's balance
+        self._balance = balance     # money in the bank: NB accessed via the balance property
         self.params = params        # parameters/extras associated with this trader-type or individual trader.
         self.blotter = []           # record of trades executed
         self.blotter_length = 100   # maximum length of blotter
         self.orders = []            # customer orders currently being worked (fixed at len=1 in BSE1.x)
         self.n_quotes = 0           # number of quotes live on LOB
         self.birthtime = time       # used when calculating age of a trader/strategy
+        self.dispatcher = None      # if not None, the RespondDispatcher that works out profitpertime for this trader
+        self.profitpertime_round = 0    # the dispatcher's count of respond-rounds when profitpertime was last set
+        self.profitpertime_time = None  # if not None, profitpertime is worked out lazily as of this time
+        self.profitpertime_key = None   # the (time, balance) that the lazily worked-out profitpertime is for
         self.profitpertime = 0      # profit per unit time
         self.profit_mintime = 60    # minimum duration in seconds for calculating profitpertime
         self.n_trades = 0           # how many trades has this trader done?
         self.lastquote = None       # record of what its last quote was
 
+    @property
+    def balance(self):
+        """ The trader's money in the bank """
+        return self._balance
+
+    @balance.setter
+    def balance(self, value):
+        """ Set the trader's balance, passing on the change to the population statistics if there are any """
+        if self.popstats is not None:
+            self.popstats.balance_change(self.ttype, value - self._balance)
+        if self.profitpertime_time is not None or self.dispatcher is not None:
+            # a lazily worked-out profitpertime is for the old balance, so pin it down before the balance changes
+            self.profitpertime = self.profitpertime
+        self._balance = value
+
+    @property
+    def profitpertime(self):
+        """
+        The trader's profit per unit time.
+        After respond() this is worked out lazily, only when it's read: respond() just notes the time it should be
+        worked out as of, and the value is cached for that time and balance until it is next set (e.g. by bookkeep()).
+        For a trader that subscribes to no events (so its respond() is never called) it's worked out as of
+        the most recent time that the traders were given the chance to respond.
+        """
+        if self.dispatcher is not None and self.profitpertime_round != self.dispatcher.rounds:
+            self.profitpertime_round = self.dispatcher.rounds
+            self.profitpertime_time = self.dispatcher.time
+        if self.profitpertime_time is not None:
+            key = (self.profitpertime_time, self._balance)
+            if key != self.profitpertime_key:
+                self._profitpertime = self.profitpertime_update(self.profitpertime_time, self.birthtime, self._balance)
+                self.profitpertime_key = key
+        return self._profitpertime
+
+    @profitpertime.setter
+    def profitpertime(self, value):
+        """ Set the trader's profit per unit time """
+        self._profitpertime = value
+        self.profitpertime_time = None
+        self.profitpertime_key = None
+        if self.dispatcher is not None:
+            self.profitpertime_round = self.dispatcher.rounds
+
+    def __getstate__(self):
+        """
+        For pickling (e.g. in a session checkpoint): any open file (e.g. a PRZI landscape-mapper or ZIP logfile)
+        is flushed and replaced by its name and current size, and __setstate__() reopens it cut back to that size.
+        """
+        state = self.__dict__.copy()
+        for key, value in state.items():
+            if isinstance(value, io.IOBase) and not value.closed:
+                value.flush()
+                state[key] = ['__file__', value.name, value.tell()]
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            if isinstance(value, list) and len(value) == 3 and value[0] == '__file__':
+                reopened = open(value[1], 'a')
+                reopened.truncate(value[2])
+                state[key] = reopened
+        self.__dict__.update(state)
+
     def __str__(self):
         """ return a character-string that summarises a trader """
         return '[TID %s type %s balance %s blotter %s orders %s n_trades %s profitpertime %s]' \
@@ -566,6 +2068,20 @@ class Trader:
             profitpertime = totalprofit / self.profit_mintime
         return profitpertime
 
+    def strats_pps_settle(self):
+        """
+        For traders with multiple strategies (e.g. PRSH/PRDE/ZIPSH): respond() doesn't work out the profit-per-second
+        (pps) of the active strategies every time, it just notes the time in self.strats_pps_time, and this then
+        works them out as of that time. Must be called before the strategies are looked at or altered.
+        :return: <nothing>
+        """
+        pps_time = getattr(self, 'strats_pps_time', None)
+        if pps_time is not None:
+            for s in self.strats:
+                if s['active']:
+                    s['pps'] = self.profitpertime_update(pps_time, s['start_t'], s['profit'])
+            self.strats_pps_time = None
+
     def bookkeep(self, time, trade, order, vrbs):
         """
         Update trader's individual records of transactions, profit/loss etc.
@@ -583,7 +2099,7 @@ class Trader:
         self.blotter = self.blotter[-self.blotter_length:]  # right-truncate to keep to length
 
         # NB What follows is **LAZY** -- assumes all orders are quantity=1
-        transactionprice = trade['price']
+        transactionprice = trade.price
         if self.orders[0].otype == 'Bid':
             profit = self.orders[0].price - transactionprice
         else:
@@ -605,6 +2121,7 @@ class Trader:
         # if the trader has multiple strategies (e.g. PRSH/PRDE/ZIPSH/ZIPDE) then there is more work to do...
         if hasattr(self, 'strats') and hasattr(self, 'active_strat'):
             if self.strats is not None:
+                self.strats_pps_settle()
                 self.strats[self.active_strat]['profit'] += profit
                 totalprofit = self.strats[self.active_strat]['profit']
                 birthtime = self.strats[self.active_strat]['start_t']
@@ -622,7 +2139,8 @@ class Trader:
         """
 
         # any trader subclass with custom respond() must include this update of profitpertime
-        self.profitpertime = self.profitpertime_update(time, self.birthtime, self.balance)
+        # NB it's only worked out when it's next read, so here just note the time it should be worked out as of
+        self.profitpertime_time = time
         return None
 
 
@@ -631,6 +2149,8 @@ class TraderGiveaway(Trader):
     Trader subclass Giveaway (GVWY): even dumber than a ZI-U: just give the deal away (but never make a loss)
     """
 
+    subscriptions = ()     # respond() does nothing but update profitpertime, so that's done lazily
+
     def getorder(self, time, countdown, lob):
         """
         Create this trader's order to be sent to the exchange.
@@ -661,6 +2181,8 @@ class TraderZIC(Trader):
     Trader subclass ZI-C: after Gode & Sunder 1993
     """
 
+    subscriptions = ()
+
     def getorder(self, time, countdown, lob):
         """
         Create this trader's order to be sent to the exchange.
@@ -698,6 +2220,8 @@ class TraderShaver(Trader):
     but if there is no best price, creates "stub quote" at system max/min
     """
 
+    subscriptions = ()
+
     def getorder(self, time, countdown, lob):
         """
         Create this trader's order to be sent to the exchange.
@@ -741,6 +2265,8 @@ class TraderSniper(Trader):
     then gets increasing aggressive, increasing "shave thickness" as time runs out
     """
 
+    subscriptions = ()
+
     def getorder(self, time, countdown, lob):
         """
         Create this trader's order to be sent to the exchange.
@@ -777,6 +2303,187 @@ class TraderSniper(Trader):
         return order
 
 
+def przi_strat_quantise(strategy):
+    """
+    Round a PRZI strategy-value to the nearest multiple of przi_lut_quantum, for use as a look-up table cache key.
+    Nonzero strategies that would round to zero are left as they are, because strategy==0.0 is a special case (ZIC).
+    :param strategy: strategy-value in [-1,+1]
+    :return: the quantised strategy-value.
+    """
+    if przi_lut_quantum is None or przi_lut_quantum <= 0 or strategy == 0.0:
+        return strategy
+    q_strat = round(strategy / przi_lut_quantum) * przi_lut_quantum
+    if q_strat == 0.0:
+        q_strat = strategy
+    return max(-1.0, min(1.0, q_strat))
+
+
+def przi_cdf_lut_uncached(strategy, t0, m, dirn, pmin, pmax):
+    """
+    Calculate the cumulative distribution function (CDF) look-up table (LUT) for a PRZI trader.
+    The traders call przi_cdf_lut(), the cached version of this: its results are cached (least-recently-used tables
+    get evicted) and shared by all PRZI/PRSH/PRDE traders, so the returned table must not be altered:
+    use przi_cdf_lut.cache_info() or .cache_clear() to manage the cache, and przi_lut_cache_resize() to resize it.
+    Callers should pass the strategy through przi_strat_quantise() first, so that near-identical strategies share.
+    :param strategy: strategy-value in [-1,+1]
+    :param t0: constant used in the threshold function
+    :param m: constant used in the threshold function
+    :param dirn: direction: 'buy' or 'sell'
+    :param pmin: lower bound on discrete-valued price-range
+    :param pmax: upper bound on discrete-valued price-range
+    :return: {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cum_probs': cdf}
+            where cdf[i] is the cumulative probability of price pmin+i: cdf is a numpy array if przi_lut_numpy is set
+            (and numpy is available), otherwise an array.array of doubles.
+    """
+
+    epsilon = 0.000001  # used to catch DIV0 errors
+
+    if (strategy > 1.0) or (strategy < -1.0):
+        # out of range
+        sys.exit('PRSH FAIL: strategy=%f out of range\n' % strategy)
+
+    if (dirn != 'buy') and (dirn != 'sell'):
+        # out of range
+        sys.exit('PRSH FAIL: bad dirn=%s\n' % dirn)
+
+    if pmax < pmin:
+        # screwed
+        sys.exit('PRSH FAIL: pmax %f < pmin %f \n' % (pmax, pmin))
+
+    if tracer.debug:
+        tracer.trace(trace_debug, 'przi_cdf_lut: strategy=%f dirn=%s pmin=%d pmax=%d', strategy, dirn, pmin, pmax)
+
+    p_range = float(pmax - pmin)
+    if p_range < 1:
+        # special case: the SHVR-style strategy has shaved all the way to the limit price
+        # the lower and upper bounds on the interval are adjacent prices;
+        # so cdf is simply the limit-price with probability 1
+        return {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cum_probs': array('d', [1.0])}
+
+    # the threshold function used to clip
+    c = max(-1 * t0, min(t0, m * math.tan(math.pi * (strategy + 0.5))))
+
+    # catch div0 errors here
+    if abs(c) < epsilon:
+        if c > 0:
+            c = epsilon
+        else:
+            c = -epsilon
+
+    e2cm1 = math.exp(c) - 1
+
+    # calculate the discrete calligraphic-P function over interval [pmin, pmax]
+    # (i.e., this is Equation 8 in the PRZI Technical Note), then sum and normalize to give the CDF
+    if przi_lut_numpy and numpy is not None:
+        # vectorised version: NB not bit-identical to the pure-Python version (see przi_lut_numpy)
+        p_r = (numpy.arange(pmin, pmax + 1) - pmin) / p_range     # normalized prices, p_r in [0.0, 1.0]
+        if strategy == 0.0:
+            # special case: this is just ZIC
+            cal_p = numpy.full(len(p_r), 1 / (p_range + 1))
+        else:
+            if dirn == 'buy':
+                cal_p = (numpy.exp(c * p_r) - 1.0) / e2cm1
+            else:   # dirn == 'sell'
+                cal_p = (numpy.exp(c * (1 - p_r)) - 1.0) / e2cm1
+            if strategy < 0:
+                cal_p = 1.0 - cal_p
+            cal_p = numpy.maximum(cal_p, 0.0)   # just in case
+        calp_sum = cal_p.sum()
+        cdf = numpy.cumsum(cal_p / calp_sum)
+    else:
+        # pure-Python version
+        calp_interval = []
+        calp_sum = 0
+        for p in range(pmin, pmax + 1):
+            # normalize the price to proportion of its range
+            p_r = (p - pmin) / p_range  # p_r in [0.0, 1.0]
+            if strategy == 0.0:
+                # special case: this is just ZIC
+                cal_p = 1 / (p_range + 1)
+            elif strategy > 0:
+                if dirn == 'buy':
+                    cal_p = (math.exp(c * p_r) - 1.0) / e2cm1
+                else:   # dirn == 'sell'
+                    cal_p = (math.exp(c * (1 - p_r)) - 1.0) / e2cm1
+            else:   # self.strat < 0
+                if dirn == 'buy':
+                    cal_p = 1.0 - ((math.exp(c * p_r) - 1.0) / e2cm1)
+                else:   # dirn == 'sell'
+                    cal_p = 1.0 - ((math.exp(c * (1 - p_r)) - 1.0) / e2cm1)
+
+            if cal_p < 0:
+                cal_p = 0   # just in case
+
+            calp_interval.append(cal_p)
+            calp_sum += cal_p
+
+        cdf = array('d')
+        cum_prob = 0
+        for cal_p in calp_interval:
+            cum_prob += cal_p / calp_sum
+            cdf.append(cum_prob)
+
+    if calp_sum <= 0 and tracer.debug:
+        tracer.trace(trace_debug, 'pmin=%f, pmax=%f, calp_sum=%f', pmin, pmax, calp_sum)
+
+    if tracer.debug:
+        tracer.trace(trace_debug, 'cdf: %s', list(cdf))
+
+    return {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cum_probs': cdf}
+
+
+# the cached przi_cdf_lut_uncached(), which is what the traders call
+przi_cdf_lut = functools.lru_cache(maxsize=przi_lut_cache_size)(przi_cdf_lut_uncached)
+
+
+def przi_lut_cache_resize(maxsize):
+    """
+    Change the maximum number of tables held in przi_cdf_lut()'s cache, emptying the cache.
+    NB setting przi_lut_cache_size directly has no effect: the size is fixed when the cache is created.
+    :param maxsize: the new maximum number of tables (None for no limit).
+    :return: <nothing>
+    """
+    global przi_lut_cache_size, przi_cdf_lut
+    if maxsize is not None and maxsize < 0:
+        sys.exit('FAIL: przi_lut_cache_resize maxsize=%s can\'t be negative' % str(maxsize))
+    przi_lut_cache_size = maxsize
+    przi_cdf_lut = functools.lru_cache(maxsize=maxsize)(przi_cdf_lut_uncached)
+
+
+def przi_lut_price(lut, u):
+    """
+    Inverse look-up on a PRZI CDF table: binary search for the lowest price whose cumulative probability exceeds u.
+    :param lut: the look-up table, as returned by przi_cdf_lut().
+    :param u: a draw from the uniform distribution U(0,1).
+    :return: the price.
+    """
+    cum_probs = lut['cum_probs']
+    i = bisect.bisect_right(cum_probs, u)
+    if i >= len(cum_probs):
+        # u is above the final cumulative probability, which can be fractionally less than 1.0 due to rounding errors
+        i = len(cum_probs) - 1
+    return lut['pmin'] + i
+
+
+def przi_lut_prices(lut, n):
+    """
+    Draw a batch of n prices from a PRZI CDF table in one go.
+    The uniform draws are taken from the random module in sequence, so this gives the same prices as n successive
+    calls of przi_lut_price(lut, random.random()).
+    :param lut: the look-up table, as returned by przi_cdf_lut().
+    :param n: how many prices to draw.
+    :return: list of n prices.
+    """
+    cum_probs = lut['cum_probs']
+    us = [random.random() for _ in range(n)]
+    if numpy is not None and type(cum_probs) is numpy.ndarray:
+        indices = numpy.minimum(numpy.searchsorted(cum_probs, us, side='right'), len(cum_probs) - 1).tolist()
+    else:
+        indices = [min(bisect.bisect_right(cum_probs, u), len(cum_probs) - 1) for u in us]
+    pmin = lut['pmin']
+    return [pmin + i for i in indices]
+
+
 class TraderPRZI(Trader):
     """
     Cliff's Parameterized-Response Zero-Intelligence (PRZI) trader -- pronounced "prezzie"
@@ -833,6 +2540,7 @@ class TraderPRZI(Trader):
         Pretty-print a string summarising this trader's strategy/strategies
         :return: the string
         """
+        self.strats_pps_settle()
         string = '%s: %s active_strat=[%d]:\n' % (self.tid, self.ttype, self.active_strat)
         for s in range(0, self.k):
             strat = self.strats[s]
@@ -852,8 +2560,6 @@ class TraderPRZI(Trader):
         :param time: the current time.
         """
 
-        vrbs = True
-
         Trader.__init__(self, ttype, tid, balance, params, time)
 
         # unpack the params
@@ -866,6 +2572,7 @@ class TraderPRZI(Trader):
         optimizer = None    # no optimizer => plain non-adaptive PRZI
         s_min = -1.0
         s_max = +1.0
+        quote_batch = 1     # no pre-drawing of quote-prices
 
         # did call provide different params?
         if type(params) is dict:
@@ -873,6 +2580,8 @@ class TraderPRZI(Trader):
                 k = params['k']
             if 'optimizer' in params:
                 optimizer = params['optimizer']
+            if 'quote_batch' in params:
+                quote_batch = params['quote_batch']
             s_min = params['strat_min']
             s_max = params['strat_max']
 
@@ -889,8 +2598,12 @@ class TraderPRZI(Trader):
         self.last_strat_change_time = time  # what time did we last change strategies?
         self.profit_epsilon = 0.0 * random.random()    # min profit-per-sec difference between strategies that counts
         self.strats = []            # strategies awaiting initialization
+        self.strats_pps_time = None     # if not None, the time as of which the active strats' pps is due
         self.pmax = None            # this trader's estimate of the maximum price the market will bear
         self.pmax_c_i = math.sqrt(random.randint(1, 10))  # multiplier coefficient when estimating p_max
+        self.quote_batch = quote_batch  # how many quote-prices to pre-draw at a time from the current LUT
+        self.quote_buffer = []          # pre-drawn quote-prices, not yet used
+        self.quote_buffer_key = None    # strat, dirn, pmin, pmax of the LUT that the quote_buffer prices were drawn from
         self.mapper_outfile = None
         # differential evolution parameters all in one dictionary
         self.diffevol = {'de_state': 'active_s0',          # initial state: strategy 0 is active (being evaluated)
@@ -955,8 +2668,8 @@ class TraderPRZI(Trader):
             self.k = k
             self.strat_eval_time = self.k * self.strat_wait_time
 
-        if vrbs:
-            print("%s\n" % self.strat_str())
+        if tracer.level >= trace_info:
+            tracer.trace(trace_info, '%s', self.strat_str())
 
     def getorder(self, time, countdown, lob):
         """
@@ -997,117 +2710,8 @@ class TraderPRZI(Trader):
             # print('shvr_p=%f; ' % shvr_p)
             return shvr_p
 
-        def calc_cdf_lut(strategy, t0, m, dirn, pmin, pmax):
-            """
-            calculate cumulative distribution function (CDF) look-up table (LUT)
-            :param strategy: strategy-value in [-1,+1]
-            :param t0: constant used in the threshold function
-            :param m: constant used in the threshold function
-            :param dirn: direction: 'buy' or 'sell'
-            :param pmin: lower bound on discrete-valued price-range
-            :param pmax: upper bound on discrete-valued price-range
-            :return: {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cdf_lut': cdf}
-            """
-
-            # the threshold function used to clip
-            def threshold(theta0, x):
-                t = max(-1*theta0, min(theta0, x))
-                return t
-
-            epsilon = 0.000001  # used to catch DIV0 errors
-            lut_vrbs = False
-
-            if (strategy > 1.0) or (strategy < -1.0):
-                # out of range
-                sys.exit('PRSH FAIL: strategy=%f out of range\n' % strategy)
-
-            if (dirn != 'buy') and (dirn != 'sell'):
-                # out of range
-                sys.exit('PRSH FAIL: bad dirn=%s\n' % dirn)
-
-            if pmax < pmin:
-                # screwed
-                sys.exit('PRSH FAIL: pmax %f < pmin %f \n' % (pmax, pmin))
-
-            if lut_vrbs:
-                print('PRSH calc_cdf_lut: strategy=%f dirn=%d pmin=%d pmax=%d\n' % (strategy, dirn, pmin, pmax))
-
-            p_range = float(pmax - pmin)
-            if p_range < 1:
-                # special case: the SHVR-style strategy has shaved all the way to the limit price
-                # the lower and upper bounds on the interval are adjacent prices;
-                # so cdf is simply the limit-price with probability 1
-
-                if dirn == 'buy':
-                    cdf = [{'price': pmax, 'cum_prob': 1.0}]
-                else:   # must be a sell
-                    cdf = [{'price': pmin, 'cum_prob': 1.0}]
-
-                if lut_vrbs:
-                    print('\n\ncdf:', cdf)
-
-                return {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cdf_lut': cdf}
-
-            c = threshold(t0, m * math.tan(math.pi * (strategy + 0.5)))
-
-            # catch div0 errors here
-            if abs(c) < epsilon:
-                if c > 0:
-                    c = epsilon
-                else:
-                    c = -epsilon
-
-            e2cm1 = math.exp(c) - 1
-
-            # calculate the discrete calligraphic-P function over interval [pmin, pmax]
-            # (i.e., this is Equation 8 in the PRZI Technical Note)
-            calp_interval = []
-            calp_sum = 0
-            for p in range(pmin, pmax + 1):
-                # normalize the price to proportion of its range
-                p_r = (p - pmin) / p_range  # p_r in [0.0, 1.0]
-                if strategy == 0.0:
-                    # special case: this is just ZIC
-                    cal_p = 1 / (p_range + 1)
-                elif strategy > 0:
-                    if dirn == 'buy':
-                        cal_p = (math.exp(c * p_r) - 1.0) / e2cm1
-                    else:   # dirn == 'sell'
-                        cal_p = (math.exp(c * (1 - p_r)) - 1.0) / e2cm1
-                else:   # self.strat < 0
-                    if dirn == 'buy':
-                        cal_p = 1.0 - ((math.exp(c * p_r) - 1.0) / e2cm1)
-                    else:   # dirn == 'sell'
-                        cal_p = 1.0 - ((math.exp(c * (1 - p_r)) - 1.0) / e2cm1)
-
-                if cal_p < 0:
-                    cal_p = 0   # just in case
-
-                calp_interval.append({'price': p, "cal_p": cal_p})
-                calp_sum += cal_p
-
-            if calp_sum <= 0:
-                print('calp_interval:', calp_interval)
-                print('pmin=%f, pmax=%f, calp_sum=%f' % (pmin, pmax, calp_sum))
-
-            cdf = []
-            cum_prob = 0
-            # now go thru interval summing and normalizing to give the CDF
-            for p in range(pmin, pmax + 1):
-                cal_p = calp_interval[p-pmin]['cal_p']
-                prob = cal_p / calp_sum
-                cum_prob += prob
-                cdf.append({'price': p, 'cum_prob': cum_prob})
-
-            if lut_vrbs:
-                print('\n\ncdf:', cdf)
-
-            return {'strat': strategy, 'dirn': dirn, 'pmin': pmin, 'pmax': pmax, 'cdf_lut': cdf}
-
-        vrbs = False
-
-        if vrbs:
-            print('t=%.1f PRSH getorder: %s, %s' % (time, self.tid, self.strat_str()))
+        if tracer.debug:
+            tracer.trace(trace_debug, 't=%.1f PRSH getorder: %s, %s', time, self.tid, self.strat_str())
 
         if len(self.orders) < 1:
             # no orders: return NULL
@@ -1142,14 +2746,13 @@ class TraderPRZI(Trader):
                     self.pmax = maxprice
 
             # use the cdf look-up table
-            # cdf_lut is a list of little dictionaries
-            # each dictionary has form: {'cum_prob':nnn, 'price':nnn}
+            # cum_probs is an array of cumulative probabilities, for prices pmin, pmin+1, ... pmax
             # generate u=U(0,1) uniform disrtibution
-            # starting with the lowest nonzero cdf value at cdf_lut[0],
-            # walk up the lut (i.e., examine higher cumulative probabilities),
-            # until we're in the range of u; then return the relevant price
+            # then binary-search the lut for the lowest price whose cumulative probability is greater than u
+            # NB the look-up tables are shared between traders, via przi_cdf_lut()'s cache
 
             strat = self.strats[self.active_strat]['stratval']
+            lut_strat = przi_strat_quantise(strat)
 
             # what price would a SHVR quote?
             p_shvr = shvr_price(otype, limit, lob)
@@ -1167,12 +2770,12 @@ class TraderPRZI(Trader):
                 lut_bid = self.strats[self.active_strat]['lut_bid']
 
                 if (lut_bid is None) or \
-                        (lut_bid['strat'] != strat) or (lut_bid['pmin'] != p_min) or (lut_bid['pmax'] != p_max):
-                    # need to compute a new LUT
-                    if vrbs:
-                        print('New bid LUT')
+                        (lut_bid['strat'] != lut_strat) or (lut_bid['pmin'] != p_min) or (lut_bid['pmax'] != p_max):
+                    # need to compute a new LUT (or fetch it from the cache)
+                    if tracer.debug:
+                        tracer.trace(trace_debug, '%s New bid LUT', self.tid)
                     self.strats[self.active_strat]['lut_bid'] = \
-                        calc_cdf_lut(strat, self.theta0, self.m, 'buy', p_min, p_max)
+                        przi_cdf_lut(lut_strat, self.theta0, self.m, 'buy', p_min, p_max)
 
                 lut = self.strats[self.active_strat]['lut_bid']
 
@@ -1192,37 +2795,38 @@ class TraderPRZI(Trader):
                 lut_ask = self.strats[self.active_strat]['lut_ask']
 
                 if (lut_ask is None) or \
-                        (lut_ask['strat'] != strat) or \
+                        (lut_ask['strat'] != lut_strat) or \
                         (lut_ask['pmin'] != p_min) or \
                         (lut_ask['pmax'] != p_max):
-                    # need to compute a new LUT
-                    if vrbs:
-                        print('New ask LUT')
+                    # need to compute a new LUT (or fetch it from the cache)
+                    if tracer.debug:
+                        tracer.trace(trace_debug, '%s New ask LUT', self.tid)
                     self.strats[self.active_strat]['lut_ask'] = \
-                        calc_cdf_lut(strat, self.theta0, self.m, 'sell', p_min, p_max)
+                        przi_cdf_lut(lut_strat, self.theta0, self.m, 'sell', p_min, p_max)
 
                 lut = self.strats[self.active_strat]['lut_ask']
 
-            vrbs = False
-            if vrbs:
-                print('PRZI strat=%f LUT=%s \n \n' % (strat, lut))
-                # for debugging: print a table of lut: price and cum_prob, with the discrete derivative (gives PMF).
+            if tracer.debug:
+                tracer.trace(trace_debug, 'PRZI strat=%f LUT=%s', strat, lut)
+                # for debugging: a table of lut: price and cum_prob, with the discrete derivative (gives PMF).
                 last_cprob = 0.0
-                for lut_entry in lut['cdf_lut']:
-                    cprob = lut_entry['cum_prob']
-                    print('%d, %f, %f' % (lut_entry['price'], cprob - last_cprob, cprob))
+                for i, cprob in enumerate(lut['cum_probs']):
+                    tracer.trace(trace_debug, '%d, %f, %f', lut['pmin'] + i, cprob - last_cprob, cprob)
                     last_cprob = cprob
-                print('\n')
-                
-                # print ('[LUT print suppressed]')
-            
+
             # do inverse lookup on the LUT to find the price
-            quoteprice = None
-            u = random.random()
-            for entry in lut['cdf_lut']:
-                if u < entry['cum_prob']:
-                    quoteprice = entry['price']
-                    break
+            if self.quote_batch > 1:
+                # use a pre-drawn quote-price if there is one left from this same LUT, otherwise draw a new batch
+                # NB the LUT is identified by its key, not by object identity, so this is unaffected by whether the
+                # LUT came fresh from przi_cdf_lut()'s cache or was restored from a session checkpoint
+                lut_key = (lut['strat'], lut['dirn'], lut['pmin'], lut['pmax'])
+                if self.quote_buffer_key != lut_key or len(self.quote_buffer) == 0:
+                    self.quote_buffer = przi_lut_prices(lut, self.quote_batch)
+                    self.quote_buffer.reverse()
+                    self.quote_buffer_key = lut_key
+                quoteprice = self.quote_buffer.pop()
+            else:
+                quoteprice = przi_lut_price(lut, random.random())
 
             order = Order(self.tid, otype, quoteprice, self.orders[0].qty, time, lob['QID'])
 
@@ -1248,7 +2852,7 @@ class TraderPRZI(Trader):
         self.blotter = self.blotter[-self.blotter_length:]      # right-truncate to keep to length
 
         # NB What follows is **LAZY** -- assumes all orders are quantity=1
-        transactionprice = trade['price']
+        transactionprice = trade.price
         if self.orders[0].otype == 'Bid':
             profit = self.orders[0].price - transactionprice
         else:
@@ -1267,6 +2871,7 @@ class TraderPRZI(Trader):
             print('%s profit=%d balance=%d profit/time=%d' % (outstr, profit, self.balance, self.profitpertime))
         self.del_order(order)  # delete the order
 
+        self.strats_pps_settle()
         self.strats[self.active_strat]['profit'] += profit
         time_alive = time - self.strats[self.active_strat]['start_t']
         if time_alive > 0:
@@ -1318,24 +2923,13 @@ class TraderPRZI(Trader):
             self.strats[s_index]['profit'] = 0.0
             self.strats[s_index]['pps'] = 0.0
 
-        vrbs = False
-
         # first update each active strategy's profit-per-second (pps) value -- this is the "fitness" of each strategy
-        for s in self.strats:
-            # debugging check: make profit be directly proportional to strategy, no noise
-            # s['profit'] = 100 * abs(s['stratval'])
-            # update pps
-            active_flag = s['active']
-            if active_flag:
-                s['pps'] = self.profitpertime_update(time, s['start_t'], s['profit'])
+        # NB this is done lazily: the pps values are only worked out, as of now, by strats_pps_settle()
+        # when the strategies next get looked at or altered
+        self.strats_pps_time = time
 
         if self.optmzr == 'PRSH':
 
-            if vrbs:
-                # print('t=%f %s PRSH respond: shc_algo=%s eval_t=%f max_wait_t=%f' %
-                #     (time, self.tid, shc_algo, self.strat_eval_time, self.strat_wait_time))
-                pass
-
             # do we need to swap strategies?
             # this is based on time elapsed since last reset -- waiting for the current strategy to get a deal
             # -- otherwise a hopeless strategy can just sit there for ages doing nothing,
@@ -1347,6 +2941,7 @@ class TraderPRZI(Trader):
             time_elapsed = time - self.last_strat_change_time
             if time_elapsed > self.strat_wait_time:
                 # we have waited long enough: swap to another strategy
+                self.strats_pps_settle()
                 self.strats[s]['active'] = False
 
                 new_strat = s + 1
@@ -1357,10 +2952,10 @@ class TraderPRZI(Trader):
                 self.strats[new_strat]['active'] = True
                 self.last_strat_change_time = time
 
-                if vrbs:
-                    swt = self.strat_wait_time
-                    print('t=%.3f (%.2fdays), %s PRSHrespond: strat[%d] elpsd=%.3f; wait_t=%.3f, pps=%f, new strat=%d' %
-                          (time, time/86400, self.tid, s, time_elapsed, swt, self.strats[s]['pps'], new_strat))
+                if tracer.level >= trace_info:
+                    tracer.trace(trace_info, 't=%.3f (%.2fdays), %s PRSHrespond: strat[%d] elpsd=%.3f; wait_t=%.3f, '
+                                 'pps=%f, new strat=%d', time, time/86400, self.tid, s, time_elapsed,
+                                 self.strat_wait_time, self.strats[s]['pps'], new_strat)
 
             # code below here deals with creating a new set of k-1 mutants from the best of the k strats
 
@@ -1374,16 +2969,18 @@ class TraderPRZI(Trader):
 
             if all_old_enough:
                 # all strategies have had long enough: which has made most profit?
+                self.strats_pps_settle()
 
                 # sort them by profit
                 strats_sorted = sorted(self.strats, key=lambda k: k['pps'], reverse=True)
                 # strats_sorted = self.strats     # use this as a control: unsorts the strats, gives pure random walk.
 
-                if vrbs:
-                    print('PRSH %s: strat_eval_time=%f, all_old_enough=True' % (self.tid, self.strat_eval_time))
+                if tracer.level >= trace_info:
+                    tracer.trace(trace_info, 'PRSH %s: strat_eval_time=%f, all_old_enough=True',
+                                 self.tid, self.strat_eval_time)
                     for s in strats_sorted:
-                        print('s=%f, start_t=%f, lifetime=%f, $=%f, pps=%f' %
-                              (s['stratval'], s['start_t'], time-s['start_t'], s['profit'], s['pps']))
+                        tracer.trace(trace_info, 's=%f, start_t=%f, lifetime=%f, $=%f, pps=%f',
+                                     s['stratval'], s['start_t'], time-s['start_t'], s['profit'], s['pps'])
 
                 if self.params == 'landscape-mapper':
                     for s in self.strats:
@@ -1424,11 +3021,11 @@ class TraderPRZI(Trader):
                     self.strats[0]['pps'] = 0.0
                     self.active_strat = 0
 
-                if vrbs:
-                    print('%s: strat_eval_time=%f, MUTATED:' % (self.tid, self.strat_eval_time))
+                if tracer.level >= trace_info:
+                    tracer.trace(trace_info, '%s: strat_eval_time=%f, MUTATED:', self.tid, self.strat_eval_time)
                     for s in self.strats:
-                        print('s=%f start_t=%f, lifetime=%f, $=%f, pps=%f' %
-                              (s['stratval'], s['start_t'], time-s['start_t'], s['profit'], s['pps']))
+                        tracer.trace(trace_info, 's=%f start_t=%f, lifetime=%f, $=%f, pps=%f',
+                                     s['stratval'], s['start_t'], time-s['start_t'], s['profit'], s['pps'])
 
         elif self.optmzr == 'PRDE':
             # simple differential evolution
@@ -1437,6 +3034,8 @@ class TraderPRZI(Trader):
             actv_lifetime = time - self.strats[self.active_strat]['start_t']
             if actv_lifetime >= self.strat_wait_time:
 
+                self.strats_pps_settle()
+
                 if self.k < 4:
                     sys.exit('FAIL: k too small for diffevol')
 
@@ -1450,16 +3049,16 @@ class TraderPRZI(Trader):
 
                 elif self.diffevol['de_state'] == 'active_snew':
                     # now we've evaluated s_0 and s_new, so we can do DE adaptive step
-                    if vrbs:
-                        print('PRDE trader %s' % self.tid)
+                    if tracer.level >= trace_info:
+                        tracer.trace(trace_info, 'PRDE trader %s', self.tid)
                     i_0 = self.diffevol['s0_index']
                     i_new = self.diffevol['snew_index']
                     fit_0 = self.strats[i_0]['pps']
                     fit_new = self.strats[i_new]['pps']
 
-                    if verbose:
-                        print('DiffEvol: t=%.1f, i_0=%d, i0fit=%f, i_new=%d, i_new_fit=%f' %
-                              (time, i_0, fit_0, i_new, fit_new))
+                    if tracer.level >= trace_info:
+                        tracer.trace(trace_info, 'DiffEvol: t=%.1f, i_0=%d, i0fit=%f, i_new=%d, i_new_fit=%f',
+                                     time, i_0, fit_0, i_new, fit_new)
 
                     if fit_new >= fit_0:
                         # new strat did better than old strat0, so overwrite new into strat0
@@ -1493,10 +3092,11 @@ class TraderPRZI(Trader):
                     # record it for future use (s0 will be evaluated first, then s_new)
                     self.strats[self.diffevol['snew_index']]['stratval'] = new_stratval
 
-                    if verbose:
-                        print('DiffEvol: t=%.1f, s0=%d, s1=%d, (s=%+f), s2=%d, (s=%+f), s3=%d, (s=%+f), sNew=%+f' %
-                              (time, self.diffevol['s0_index'],
-                               s1_index, s1_stratval, s2_index, s2_stratval, s3_index, s3_stratval, new_stratval))
+                    if tracer.level >= trace_info:
+                        tracer.trace(trace_info,
+                                     'DiffEvol: t=%.1f, s0=%d, s1=%d, (s=%+f), s2=%d, (s=%+f), s3=%d, (s=%+f), sNew=%+f',
+                                     time, self.diffevol['s0_index'],
+                                     s1_index, s1_stratval, s2_index, s2_stratval, s3_index, s3_stratval, new_stratval)
 
                     # DC's intervention for fully converged populations
                     # is the stddev of the strategies in the population equal/close to zero?
@@ -1509,16 +3109,16 @@ class TraderPRZI(Trader):
                         diff = self.strats[s]['stratval'] - strat_mean
                         sumsq += (diff * diff)
                     strat_stdev = math.sqrt(sumsq / self.k)
-                    if vrbs:
-                        print('t=,%.1f, MeanStrat=, %+f, stdev=,%f' % (time, strat_mean, strat_stdev))
+                    if tracer.level >= trace_info:
+                        tracer.trace(trace_info, 't=,%.1f, MeanStrat=, %+f, stdev=,%f', time, strat_mean, strat_stdev)
                     if strat_stdev < 0.0001:
                         # this population has converged
                         # mutate one strategy at random
                         randindex = random.randint(0, self.k - 1)
                         self.strats[randindex]['stratval'] = random.uniform(-1.0, +1.0)
-                        if verbose:
-                            print('Converged pop: set strategy %d to %+f' %
-                                  (randindex, self.strats[randindex]['stratval']))
+                        if tracer.level >= trace_info:
+                            tracer.trace(trace_info, 'Converged pop: set strategy %d to %+f',
+                                         randindex, self.strats[randindex]['stratval'])
 
                     # set up next iteration: first evaluate s0
                     self.active_strat = self.diffevol['s0_index']
@@ -1698,6 +3298,11 @@ class TraderZIP(Trader):
         self.last_strat_change_time = time  # what time did we last change strategies?
         self.active_strat = 0       # which of the k strategies are we currently playing? -- start with 0
         self.profit_epsilon = 0.0 * random.random()     # min profit-per-sec difference between strategies that counts
+        self.strats_pps_time = None     # if not None, the time as of which the active strats' pps is due
+
+        if self.optmzr is None:
+            # plain ZIP's respond() only does anything if there's been a trade or the best bid/ask has changed
+            self.subscriptions = ('trade', 'best')
 
         if self.optmzr is not None and k > 1:
             # we're doing some form of k-armed strategy-optimization with multiple strategies
@@ -1865,11 +3470,8 @@ class TraderZIP(Trader):
             # NB this *cycles* through the available strats in sequence (i.e., it doesn't shuffle them)
 
             # first update the pps for each active strategy
-            for s in self.strats:
-                # update pps
-                active_flag = s['active']
-                if active_flag:
-                    s['pps'] = self.profitpertime_update(time, s['start_t'], s['profit'])
+            # NB done lazily: worked out as of now by strats_pps_settle() when the strategies are next looked at
+            self.strats_pps_time = time
 
             # have we evaluated all the strategies?
             # (could instead just compare active_strat to k, but checking them all in sequence is arguably clearer)
@@ -1884,6 +3486,7 @@ class TraderZIP(Trader):
                 # time to generate a new set/population of k candidate strategies
                 # NB when the final strategy in the trader's set/popln is evaluated, the set is then sorted into
                 # descending order of profitability, so when we get to here we know that strats[0] is elite
+                self.strats_pps_settle()
 
                 if vrbs and self.tid == 'S00':
                     print('t=%.3f, ZIPSH %s: strat_eval_time=%.3f,' % (time, self.tid, self.strat_eval_time))
@@ -1935,6 +3538,7 @@ class TraderZIP(Trader):
                 time_elapsed = time - self.strats[s]['start_t']
                 if time_elapsed >= self.strat_wait_time:
                     # this strategy has had long enough: update records for this strategy, then swap to another strategy
+                    self.strats_pps_settle()
                     self.strats[s]['active'] = False
                     self.strats[s]['profit'] = self.balance
                     self.strats[s]['pps'] = self.profitpertime
@@ -1998,7 +3602,7 @@ class TraderZIP(Trader):
         elif self.prev_best_bid_p is not None:
             # the bid LOB has been emptied: was it cancelled or hit?
             last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
+            if last_tape_item.type == 'Cancel':
                 bid_hit = False
             else:
                 bid_hit = True
@@ -2022,7 +3626,7 @@ class TraderZIP(Trader):
         elif self.prev_best_ask_p is not None:
             # the ask LOB is empty now but was not previously: canceled or lifted?
             last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
+            if last_tape_item.type == 'Cancel':
                 ask_lifted = False
             else:
                 ask_lifted = True
@@ -2036,7 +3640,7 @@ class TraderZIP(Trader):
         if self.job == 'Ask':
             # seller
             if deal:
-                tradeprice = trade['price']
+                tradeprice = trade.price
                 if self.price <= tradeprice:
                     # could sell for more? raise margin
                     target_price = target_up(tradeprice)
@@ -2057,7 +3661,7 @@ class TraderZIP(Trader):
         if self.job == 'Bid':
             # buyer
             if deal:
-                tradeprice = trade['price']
+                tradeprice = trade.price
                 if self.price >= tradeprice:
                     # could buy for less? raise margin (i.e. cut the price)
                     target_price = target_down(tradeprice)
@@ -2085,6 +3689,336 @@ class TraderZIP(Trader):
         return snapshot
 
 
+class ZIPPopulation:
+    """
+    Structure-of-arrays engine for a population of plain (non-optimizing) ZIP traders.
+    All ZIP state is held in one array per variable, with one slot per member trader; the member traders
+    (TraderZIPV) only work their own orders, and respond() is done once per market event for the whole
+    population, as a batch of masked array operations.
+    Uses NumPy arrays and a NumPy random generator if NumPy is available, else Python lists and a per-slot loop.
+    The margin-update rules are exactly those of TraderZIP.respond(), but the random draws for target prices
+    come in batches, so a ZIPV population is statistically equivalent to (rather than identical with) a ZIP one.
+    """
+
+    fields = ('margin_buy', 'margin_sell', 'beta', 'momntm', 'ca', 'cr', 'prev_change', 'margin',
+              'price', 'limit', 'job', 'active')
+
+    def __init__(self):
+        self.n = 0
+        for field in self.fields:
+            if numpy is None:
+                setattr(self, field, [])
+            elif field == 'job':
+                setattr(self, field, numpy.zeros(0, dtype=numpy.int8))    # +1 for 'Bid', -1 for 'Ask', 0 for None
+            elif field == 'active':
+                setattr(self, field, numpy.zeros(0, dtype=bool))
+            else:
+                setattr(self, field, numpy.zeros(0))
+        # seed the generator from Python's random, so the session's random.seed() still determines everything
+        self.rng = None
+        if numpy is not None:
+            self.rng = numpy.random.default_rng(random.getrandbits(64))
+        # every member sees the same LOB, so the previous-best-quote state is common to the whole population
+        self.prev_best_bid_p = None
+        self.prev_best_bid_q = None
+        self.prev_best_ask_p = None
+        self.prev_best_ask_q = None
+        self.last_lob = None
+        self.last_trade = None
+
+    def __getstate__(self):
+        # the LOB snapshot is only held to spot repeat calls, and is not picklable
+        state = self.__dict__.copy()
+        state['last_lob'] = None
+        state['last_trade'] = None
+        return state
+
+    def add(self, values):
+        """
+        Add a member to the population.
+        :param values: dictionary of initial values for the member's slot, keyed by the names in self.fields.
+        :return: the index of the member's slot.
+        """
+        for field in self.fields:
+            value = values[field]
+            if numpy is None:
+                getattr(self, field).append(value)
+            else:
+                if value is None:
+                    value = numpy.nan
+                setattr(self, field, numpy.append(getattr(self, field), value))
+        self.n += 1
+        return self.n - 1
+
+    def respond(self, lob, trade, vrbs):
+        """
+        Update the profit margins of every member of the population on the basis of what happened in the market.
+        Members call this from their own respond(): only the first call for any one LOB and trade does anything,
+        the rest return straight away (and re-running ZIP's response to an unchanged LOB would be a no-op anyway).
+        :param lob: the current state of the LOB.
+        :param trade: details of most recent trade, if any.
+        :param vrbs: if True then print a running commentary of what is going on.
+        :return: <nothing>
+        """
+        if lob is self.last_lob and trade is self.last_trade:
+            return
+        self.last_lob = lob
+        self.last_trade = trade
+
+        # what, if anything, has happened on the bid LOB? -- same logic as in TraderZIP.respond()
+        bid_improved = False
+        bid_hit = False
+        lob_best_bid_p = lob['bids']['best']
+        lob_best_bid_q = None
+        if lob_best_bid_p is not None:
+            lob_best_bid_q = lob['bids']['lob'][-1][1]
+            if (self.prev_best_bid_p is not None) and (self.prev_best_bid_p < lob_best_bid_p):
+                bid_improved = True
+            elif trade is not None and ((self.prev_best_bid_p > lob_best_bid_p) or (
+                    (self.prev_best_bid_p == lob_best_bid_p) and (self.prev_best_bid_q > lob_best_bid_q))):
+                bid_hit = True
+        elif self.prev_best_bid_p is not None:
+            bid_hit = lob['tape'][-1].type != 'Cancel'
+
+        # what, if anything, has happened on the ask LOB?
+        ask_improved = False
+        ask_lifted = False
+        lob_best_ask_p = lob['asks']['best']
+        lob_best_ask_q = None
+        if lob_best_ask_p is not None:
+            lob_best_ask_q = lob['asks']['lob'][0][1]
+            if (self.prev_best_ask_p is not None) and (self.prev_best_ask_p > lob_best_ask_p):
+                ask_improved = True
+            elif trade is not None and ((self.prev_best_ask_p < lob_best_ask_p) or (
+                    (self.prev_best_ask_p == lob_best_ask_p) and (self.prev_best_ask_q > lob_best_ask_q))):
+                ask_lifted = True
+        elif self.prev_best_ask_p is not None:
+            ask_lifted = lob['tape'][-1].type != 'Cancel'
+
+        if vrbs and (bid_improved or bid_hit or ask_improved or ask_lifted):
+            print('ZIPV respond: B_improved', bid_improved, 'B_hit', bid_hit,
+                  'A_improved', ask_improved, 'A_lifted', ask_lifted)
+
+        deal = bid_hit or ask_lifted
+
+        if self.n > 0 and (deal or bid_improved or ask_improved):
+            if numpy is None:
+                self.respond_loop(lob, trade, deal, bid_hit, ask_lifted, bid_improved, ask_improved,
+                                  lob_best_bid_p, lob_best_ask_p)
+            else:
+                self.respond_arrays(lob, trade, deal, bid_hit, ask_lifted, bid_improved, ask_improved,
+                                    lob_best_bid_p, lob_best_ask_p)
+
+        # remember the best LOB data ready for next response
+        self.prev_best_bid_p = lob_best_bid_p
+        self.prev_best_bid_q = lob_best_bid_q
+        self.prev_best_ask_p = lob_best_ask_p
+        self.prev_best_ask_q = lob_best_ask_q
+
+    def respond_arrays(self, lob, trade, deal, bid_hit, ask_lifted, bid_improved, ask_improved,
+                       lob_best_bid_p, lob_best_ask_p):
+        """
+        The NumPy version of the batched margin update: work out which members alter their margins,
+        in which direction, from what base price; draw all the perturbations at once; then do ZIP's profit_alter().
+        :return: <nothing>
+        """
+        price = self.price
+        is_ask = self.job == -1
+        is_bid = self.job == 1
+        up = numpy.zeros(self.n, dtype=bool)        # alter towards a perturbed-upwards target
+        down = numpy.zeros(self.n, dtype=bool)      # alter towards a perturbed-downwards target
+        stub = numpy.zeros(self.n, dtype=bool)      # alter towards a stub quote
+        base = numpy.zeros(self.n)                  # the price that the target is a perturbation of
+
+        if deal:
+            tradeprice = trade.price
+            base[:] = tradeprice
+            # sellers: could sell for more? raise margin; else if wouldn't have got this deal, reduce margin
+            up |= is_ask & (price <= tradeprice)
+            if ask_lifted:
+                down |= is_ask & (price > tradeprice) & self.active
+            # buyers: could buy for less? raise margin; else if wouldn't have got this deal, reduce margin
+            down |= is_bid & (price >= tradeprice)
+            if bid_hit:
+                up |= is_bid & (price < tradeprice) & self.active
+        else:
+            if ask_improved:
+                sellers = is_ask & (price > lob_best_ask_p)
+                if lob_best_bid_p is not None:
+                    up |= sellers
+                    base[sellers] = lob_best_bid_p
+                else:
+                    stub |= sellers
+                    base[sellers] = lob['asks']['worst']
+            if bid_improved:
+                buyers = is_bid & (price < lob_best_bid_p)
+                if lob_best_ask_p is not None:
+                    down |= buyers
+                    base[buyers] = lob_best_ask_p
+                else:
+                    stub |= buyers
+                    base[buyers] = lob['bids']['worst']
+
+        idx = numpy.flatnonzero(up | down | stub)
+        if len(idx) == 0:
+            return
+
+        # perturbed targets: one absolute and one relative uniform draw per altering trader, as in target_up/down
+        target = base[idx]
+        perturbed = ~stub[idx]
+        pidx = idx[perturbed]
+        if len(pidx) > 0:
+            u = self.rng.random((len(pidx), 2))
+            sign = numpy.where(up[pidx], 1.0, -1.0)
+            ptrb_abs = self.ca[pidx] * u[:, 0]
+            ptrb_rel = base[pidx] * (1.0 + sign * (self.cr[pidx] * u[:, 1]))
+            target[perturbed] = numpy.round(ptrb_rel + sign * ptrb_abs)
+
+        # profit_alter(), for all the altering traders at once
+        oldprice = price[idx]
+        momntm = self.momntm[idx]
+        change = ((1.0 - momntm) * (self.beta[idx] * (target - oldprice))) + (momntm * self.prev_change[idx])
+        self.prev_change[idx] = change
+        newmargin = ((oldprice + change) / self.limit[idx]) - 1.0
+        bidding = self.job[idx] == 1
+        buy_alter = bidding & (newmargin < 0.0)
+        sell_alter = ~bidding & (newmargin > 0.0)
+        self.margin_buy[idx[buy_alter]] = newmargin[buy_alter]
+        self.margin_sell[idx[sell_alter]] = newmargin[sell_alter]
+        altered = buy_alter | sell_alter
+        self.margin[idx[altered]] = newmargin[altered]
+        # set the price from limit and profit-margin
+        self.price[idx] = numpy.round(self.limit[idx] * (1.0 + self.margin[idx]))
+
+    def respond_loop(self, lob, trade, deal, bid_hit, ask_lifted, bid_improved, ask_improved,
+                     lob_best_bid_p, lob_best_ask_p):
+        """
+        The pure-Python version of the batched margin update, for when NumPy is not available.
+        :return: <nothing>
+        """
+        for i in range(self.n):
+            job = self.job[i]
+            if job == 0:
+                continue
+            price = self.price[i]
+            target = None
+            dirn = 0
+            if deal:
+                tradeprice = trade.price
+                if job == -1:
+                    if price <= tradeprice:
+                        target, dirn = tradeprice, 1
+                    elif ask_lifted and self.active[i]:
+                        target, dirn = tradeprice, -1
+                else:
+                    if price >= tradeprice:
+                        target, dirn = tradeprice, -1
+                    elif bid_hit and self.active[i]:
+                        target, dirn = tradeprice, 1
+            elif job == -1 and ask_improved and price > lob_best_ask_p:
+                if lob_best_bid_p is not None:
+                    target, dirn = lob_best_bid_p, 1
+                else:
+                    target = lob['asks']['worst']
+            elif job == 1 and bid_improved and price < lob_best_bid_p:
+                if lob_best_ask_p is not None:
+                    target, dirn = lob_best_ask_p, -1
+                else:
+                    target = lob['bids']['worst']
+            if target is None:
+                continue
+
+            if dirn != 0:
+                ptrb_abs = self.ca[i] * random.random()
+                ptrb_rel = target * (1.0 + dirn * (self.cr[i] * random.random()))
+                target = int(round(ptrb_rel + dirn * ptrb_abs, 0))
+
+            change = ((1.0 - self.momntm[i]) * (self.beta[i] * (target - price))) + \
+                     (self.momntm[i] * self.prev_change[i])
+            self.prev_change[i] = change
+            newmargin = ((price + change) / self.limit[i]) - 1.0
+            if job == 1:
+                if newmargin < 0.0:
+                    self.margin_buy[i] = newmargin
+                    self.margin[i] = newmargin
+            else:
+                if newmargin > 0.0:
+                    self.margin_sell[i] = newmargin
+                    self.margin[i] = newmargin
+            self.price[i] = int(round(self.limit[i] * (1.0 + self.margin[i]), 0))
+
+
+class TraderZIPV(Trader):
+    """
+    A plain (non-optimizing) ZIP trader whose strategy state lives in a slot of a shared ZIPPopulation.
+    Each ZIPV trader works its own orders, but margin updates are done for the whole population at once.
+    """
+
+    subscriptions = ('trade', 'best')
+
+    def __init__(self, ttype, tid, balance, params, time, population):
+        """
+        Create a ZIPV trader, and add it to its population.
+        :param ttype: the string identifying the trader-type (what strategy is this).
+        :param tid: the trader i.d. string.
+        :param balance: the starting bank balance for this trader.
+        :param params: any additional parameters (not used in ZIPV).
+        :param time: the current time.
+        :param population: the ZIPPopulation that this trader is a member of.
+        """
+        Trader.__init__(self, ttype, tid, balance, params, time)
+        # initial values drawn from the same distributions, in the same order, as in TraderZIP
+        values = {'beta': random.uniform(0.1, 0.5), 'momntm': random.uniform(0.0, 0.1),
+                  'ca': random.uniform(0.01, 0.05), 'cr': random.uniform(0.01, 0.05),
+                  'margin_buy': -1.0 * random.uniform(0.05, 0.35), 'margin_sell': random.uniform(0.05, 0.35),
+                  'prev_change': 0, 'margin': None, 'price': None, 'limit': None, 'job': 0, 'active': False}
+        self.population = population
+        self.slot = population.add(values)
+
+    def getorder(self, time, countdown, lob):
+        """
+        Create the next order for this trader
+        :param time: the current time
+        :param countdown: time remaining until market closes (not used in ZIPV)
+        :param lob: the current state of the LOB
+        :return: this trader's next order.
+        """
+        popln = self.population
+        i = self.slot
+        if len(self.orders) < 1:
+            popln.active[i] = False
+            order = None
+        else:
+            popln.active[i] = True
+            limit = self.orders[0].price
+            otype = self.orders[0].otype
+            popln.limit[i] = limit
+            if otype == 'Bid':
+                popln.job[i] = 1
+                margin = popln.margin_buy[i]
+            else:
+                popln.job[i] = -1
+                margin = popln.margin_sell[i]
+            popln.margin[i] = margin
+            quoteprice = int(limit * (1 + margin))
+            popln.price[i] = quoteprice
+            order = Order(self.tid, otype, quoteprice, self.orders[0].qty, time, lob['QID'])
+            self.lastquote = order
+        return order
+
+    def respond(self, time, lob, trade, vrbs):
+        """
+        Have the population update its margins, if that hasn't already been done for this LOB and trade.
+        :param time: the current time.
+        :param lob: the current state of the LOB.
+        :param trade: details of most recent trade, if any.
+        :param vrbs: if True then print a running commentary of what is going on.
+        :return: snapshot: always False for ZIPV.
+        """
+        self.population.respond(lob, trade, vrbs)
+        return False
+
+
 class TraderPT1(Trader):
     """
     A minimally simple propreitary trader that buys & sells to make profit
@@ -2108,6 +4042,9 @@ class TraderPT1(Trader):
     2.4.1.2    (put the money in my bank)
     """
 
+    # proprietary traders set their own orders in respond()
+    self_orders = True
+
     def __init__(self, ttype, tid, balance, params, time):
         """
         Construct a PT1 trader
@@ -2118,8 +4055,6 @@ class TraderPT1(Trader):
         :param time: the current time.
         """
         
-        init_verbose = True
-        
         Trader.__init__(self, ttype, tid, balance, params, time)
         self.job = 'Buy'  # flag switches between 'Buy' & 'Sell'; shows what PT1 is currently trying to do
         self.last_purchase_price = None
@@ -2144,9 +4079,9 @@ class TraderPT1(Trader):
                 if self.n_past_trades < 1:
                     sys.exit('Fail: PT1 n_past trades must be 1 or more')
                     
-        if init_verbose:
-            print('PT1 init: n_past_trades=%d, bid_percent=%6.5f, ask_delta=%d\n'
-                  % (self.n_past_trades, self.bid_percent, self.ask_delta))
+        if tracer.level >= trace_info:
+            tracer.trace(trace_info, 'PT1 init: n_past_trades=%d, bid_percent=%6.5f, ask_delta=%d',
+                         self.n_past_trades, self.bid_percent, self.ask_delta)
             
     def getorder(self, time, countdown, lob):
         """
@@ -2184,30 +4119,26 @@ class TraderPT1(Trader):
         :return: <nothing>
         """
 
-        vstr = 't=%f PT1 respond: ' % time
+        trc = vrbs or tracer.debug      # only build the commentary string if someone will read it
+        if trc:
+            vstr = 't=%f PT1 respond: ' % time
 
         # what is average price of most recent n trades?
-        # work backwards from end of tape (most recent trade)
-        tape_position = -1
-        n_prices = 0
-        sum_prices = 0
+        # the exchange maintains rolling statistics of trade prices, so no need to work backwards through the tape
         avg_price_ok = False
         avg_price = -1
-        while n_prices < self.n_past_trades and abs(tape_position) < len(lob['tape']):
-            if lob['tape'][tape_position]['type'] == 'Trade':
-                price = lob['tape'][tape_position]['price']
-                n_prices += 1
-                sum_prices += price
-            tape_position -= 1
-        if n_prices == self.n_past_trades:
+        mean_price = lob['price_stats'].mean(self.n_past_trades)
+        if mean_price is not None:
             # there's been enough trades to form an acceptable average
-            avg_price = int(round(sum_prices / n_prices))
+            avg_price = int(round(mean_price))
             avg_price_ok = True
-        vstr += "avg_price_ok=%s, avg_price=%d " % (avg_price_ok, avg_price)
+        if trc:
+            vstr += "avg_price_ok=%s, avg_price=%d " % (avg_price_ok, avg_price)
 
         # buying?
         if self.job == 'Buy' and avg_price_ok:
-            vstr += 'Buying - '
+            if trc:
+                vstr += 'Buying - '
             # see what's on the LOB
             if lob['asks']['n'] > 0:
                 # there is at least one ask on the LOB
@@ -2220,14 +4151,16 @@ class TraderPT1(Trader):
                         # create the bid by issuing order to self, which will be processed in getorder()
                         order = Order(self.tid, 'Bid', bidprice, 1, time, lob['QID'])
                         self.orders = [order]
-                        vstr += 'Best ask=%d, bidprice=%d, order=%s ' % (best_ask, bidprice, order)
-                else:
+                        if trc:
+                            vstr += 'Best ask=%d, bidprice=%d, order=%s ' % (best_ask, bidprice, order)
+                elif trc:
                     vstr += 'bestask=%d >= avg_price=%d' % (best_ask, avg_price)
-            else:
+            elif trc:
                 vstr += 'No asks on LOB'
         # selling?
         elif self.job == 'Sell':
-            vstr += 'Selling - '
+            if trc:
+                vstr += 'Selling - '
             # see what's on the LOB
             if lob['bids']['n'] > 0:
                 # there is at least one bid on the LOB
@@ -2239,16 +4172,19 @@ class TraderPT1(Trader):
                     # lift the ask by issuing order to self, which will processed in getorder()
                     order = Order(self.tid, 'Ask', askprice, 1, time, lob['QID'])
                     self.orders = [order]
-                    vstr += 'Best bid=%d greater than askprice=%d order=%s ' % (best_bid, askprice, order)
-                else:
+                    if trc:
+                        vstr += 'Best bid=%d greater than askprice=%d order=%s ' % (best_bid, askprice, order)
+                elif trc:
                     vstr += 'Best bid=%d too low for askprice=%d ' % (best_bid, askprice)
-            else:
+            elif trc:
                 vstr += 'No bids on LOB'
 
-        self.profitpertime = self.profitpertime_update(time, self.birthtime, self.balance)
+        self.profitpertime_time = time     # profitpertime is worked out lazily, as of now
 
         if vrbs:
             print(vstr)
+        if tracer.debug:
+            tracer.trace(trace_debug, '%s', vstr)
 
     def bookkeep(self, time, trade, order, vrbs):
         """
@@ -2272,7 +4208,7 @@ class TraderPT1(Trader):
         self.blotter.append(trade)  # add trade record to trader's blotter
 
         # NB What follows is **LAZY** -- assumes all orders are quantity=1
-        transactionprice = trade['price']
+        transactionprice = trade.price
         if self.orders[0].otype == 'Bid':
             # Bid order succeeded, remember the price and adjust the balance
             self.balance -= transactionprice
@@ -2318,6 +4254,9 @@ class TraderPT2(Trader):
     2.4.1.2    (put the money in my bank)
     """
 
+    # proprietary traders set their own orders in respond()
+    self_orders = True
+
     def __init__(self, ttype, tid, balance, params, time):
         """
         Construct a PT2 trader
@@ -2331,8 +4270,6 @@ class TraderPT2(Trader):
         Trader.__init__(self, ttype, tid, balance, params, time)
         self.job = 'Buy'  # flag switches between 'Buy' & 'Sell'; shows what PT2 is currently trying to do
         self.last_purchase_price = None
-        
-        init_verbose = True
 
         # Default parameter-values
         self.n_past_trades = 5      # how many recent trades used to compute average price (avg_p)?
@@ -2354,9 +4291,9 @@ class TraderPT2(Trader):
                 if self.n_past_trades < 1:
                     sys.exit('Fail: PT2 n_past trades must be 1 or more')
                     
-        if init_verbose:
-            print('PT2 init: n_past_trades=%d, bid_percent=%6.5f, ask_delta=%d\n'
-                  % (self.n_past_trades, self.bid_percent, self.ask_delta))
+        if tracer.level >= trace_info:
+            tracer.trace(trace_info, 'PT2 init: n_past_trades=%d, bid_percent=%6.5f, ask_delta=%d',
+                         self.n_past_trades, self.bid_percent, self.ask_delta)
 
     def getorder(self, time, countdown, lob):
         """
@@ -2394,30 +4331,26 @@ class TraderPT2(Trader):
         :return: <nothing>
         """
 
-        vstr = 't=%f PT2 respond: ' % time
+        trc = vrbs or tracer.debug      # only build the commentary string if someone will read it
+        if trc:
+            vstr = 't=%f PT2 respond: ' % time
 
         # what is average price of most recent n trades?
-        # work backwards from end of tape (most recent trade)
-        tape_position = -1
-        n_prices = 0
-        sum_prices = 0
+        # the exchange maintains rolling statistics of trade prices, so no need to work backwards through the tape
         avg_price_ok = False
         avg_price = -1
-        while n_prices < self.n_past_trades and abs(tape_position) < len(lob['tape']):
-            if lob['tape'][tape_position]['type'] == 'Trade':
-                price = lob['tape'][tape_position]['price']
-                n_prices += 1
-                sum_prices += price
-            tape_position -= 1
-        if n_prices == self.n_past_trades:
+        mean_price = lob['price_stats'].mean(self.n_past_trades)
+        if mean_price is not None:
             # there's been enough trades to form an acceptable average
-            avg_price = int(round(sum_prices / n_prices))
+            avg_price = int(round(mean_price))
             avg_price_ok = True
-        vstr += "avg_price_ok=%s, avg_price=%d " % (avg_price_ok, avg_price)
+        if trc:
+            vstr += "avg_price_ok=%s, avg_price=%d " % (avg_price_ok, avg_price)
 
         # buying?
         if self.job == 'Buy' and avg_price_ok:
-            vstr += 'Buying - '
+            if trc:
+                vstr += 'Buying - '
             # see what's on the LOB
             if lob['asks']['n'] > 0:
                 # there is at least one ask on the LOB
@@ -2430,14 +4363,16 @@ class TraderPT2(Trader):
                         # create the bid by issuing order to self, which will be processed in getorder()
                         order = Order(self.tid, 'Bid', bidprice, 1, time, lob['QID'])
                         self.orders = [order]
-                        vstr += 'Best ask=%d, bidprice=%d, order=%s ' % (best_ask, bidprice, order)
-                else:
+                        if trc:
+                            vstr += 'Best ask=%d, bidprice=%d, order=%s ' % (best_ask, bidprice, order)
+                elif trc:
                     vstr += 'bestask=%d >= avg_price=%d' % (best_ask, avg_price)
-            else:
+            elif trc:
                 vstr += 'No asks on LOB'
         # selling?
         elif self.job == 'Sell':
-            vstr += 'Selling - '
+            if trc:
+                vstr += 'Selling - '
             # see what's on the LOB
             if lob['bids']['n'] > 0:
                 # there is at least one bid on the LOB
@@ -2449,16 +4384,19 @@ class TraderPT2(Trader):
                     # lift the ask by issuing order to self, which will processed in getorder()
                     order = Order(self.tid, 'Ask', askprice, 1, time, lob['QID'])
                     self.orders = [order]
-                    vstr += 'Best bid=%d greater than askprice=%d order=%s ' % (best_bid, askprice, order)
-                else:
+                    if trc:
+                        vstr += 'Best bid=%d greater than askprice=%d order=%s ' % (best_bid, askprice, order)
+                elif trc:
                     vstr += 'Best bid=%d too low for askprice=%d ' % (best_bid, askprice)
-            else:
+            elif trc:
                 vstr += 'No bids on LOB'
 
-        self.profitpertime = self.profitpertime_update(time, self.birthtime, self.balance)
+        self.profitpertime_time = time     # profitpertime is worked out lazily, as of now
 
         if vrbs:
             print(vstr)
+        if tracer.debug:
+            tracer.trace(trace_debug, '%s', vstr)
 
     def bookkeep(self, time, trade, order, vrbs):
         """
@@ -2482,7 +4420,7 @@ class TraderPT2(Trader):
         self.blotter.append(trade)  # add trade record to trader's blotter
 
         # NB What follows is **LAZY** -- assumes all orders are quantity=1
-        transactionprice = trade['price']
+        transactionprice = trade.price
         if self.orders[0].otype == 'Bid':
             # Bid order succeeded, remember the price and adjust the balance
             self.balance -= transactionprice
@@ -2507,34 +4445,313 @@ class TraderPT2(Trader):
 # ########################---trader-types have all been defined now--################
 
 
-# #########################---Below lies the experiment/test-rig---##################
+# #########################---Below lies the experiment/test-rig---##################
+
+
+class PopulationStats:
+    """
+    Per-trader-type aggregate statistics of a population of traders -- number of traders, sum of their balances,
+    and number of trades -- kept up to date incrementally: every change to a trader's balance (whether in bookkeep()
+    or elsewhere) is passed on via the Trader.balance property, so trade_stats() doesn't need to re-walk the traders.
+    Also decides when the next row of trade_stats is due, if they're being down-sampled.
+    """
+
+    def __init__(self, traders, every_trades=None, every_secs=None):
+        """
+        Build the statistics for a population of traders, and attach them to each trader.
+        :param traders: the population of traders (dictionary, keyed by trader-id).
+        :param every_trades: if not None, a trade_stats row is due after this many trades since the last one.
+        :param every_secs: if not None, a trade_stats row is due on the first trade this many seconds after the last one.
+            If every_trades and every_secs are both None, a row is due after every trade.
+        """
+        self.types = {}     # for each trader-type: {'n': number of traders, 'balance_sum': sum, 'n_trades': trades}
+        for tid in traders:
+            trader = traders[tid]
+            ttype = trader.ttype
+            if ttype in self.types:
+                self.types[ttype]['n'] += 1
+                self.types[ttype]['balance_sum'] += trader.balance
+            else:
+                self.types[ttype] = {'n': 1, 'balance_sum': trader.balance, 'n_trades': 0}
+            trader.popstats = self
+        self.every_trades = every_trades
+        self.every_secs = every_secs
+        self.trades_since_row = 0
+        self.last_row_time = None
+
+    def balance_change(self, ttype, delta):
+        """
+        Record a change in the balance of a trader of this type.
+        :param ttype: the trader's type.
+        :param delta: the change in its balance.
+        :return: <nothing>
+        """
+        self.types[ttype]['balance_sum'] += delta
+
+    def trade(self, ttype1, ttype2, time):
+        """
+        Record a trade between traders of these two types.
+        :param ttype1: type of the first party to the trade.
+        :param ttype2: type of the second party.
+        :param time: the time of the trade.
+        :return: True if a trade_stats row is now due, otherwise False.
+        """
+        self.types[ttype1]['n_trades'] += 1
+        self.types[ttype2]['n_trades'] += 1
+        self.trades_since_row += 1
+        if self.every_trades is None and self.every_secs is None:
+            due = True
+        else:
+            due = False
+            if self.every_trades is not None and self.trades_since_row >= self.every_trades:
+                due = True
+            if self.every_secs is not None and \
+                    (self.last_row_time is None or time - self.last_row_time >= self.every_secs):
+                due = True
+        if due:
+            self.trades_since_row = 0
+            self.last_row_time = time
+        return due
+
+
+class RespondDispatcher:
+    """
+    Passes market events on to only those traders that want them, rather than calling every trader's respond().
+    Each trader lists the kinds of event it wants in its subscriptions attribute:
+        'trade' => a trade has just happened;
+        'best' => the best price, or the quantity at the best price, has changed on either side of the LOB;
+        'book' => anything on the LOB has changed;
+        'timer' => every time the traders get to respond, whether or not anything has happened.
+    Changes are relative to the previous time the traders got to respond. A trader that subscribes to nothing
+    (e.g. GVWY, ZIC) never has its respond() called, and its profitpertime is instead worked out lazily.
+    The traders that get called are called in the same order as the traders dictionary.
+    """
+
+    def __init__(self, traders):
+        """
+        Set up the dispatcher for a population of traders, and attach it to each trader that subscribes to nothing.
+        :param traders: the population of traders (dictionary, keyed by trader-id).
+        """
+        self.traders = [traders[tid] for tid in traders]
+        self.recipients = {}    # for each combination of events, the list of traders subscribed to any of them
+        self.rounds = 0         # how many times the traders have been given the chance to respond
+        self.time = None        # the time of the most recent round
+        self.prev_book = None   # the book versions at the most recent round
+        self.prev_best = None   # the best prices and quantities at the most recent round
+        for trader in self.traders:
+            if len(trader.subscriptions) == 0:
+                # NB bring the trader's profitpertime up to date before taking over working it out
+                profitpertime = trader.profitpertime
+                trader.dispatcher = self
+                trader.profitpertime = profitpertime
+
+    def dispatch(self, time, exchange, lob, trade, vrbs):
+        """
+        Give the traders the chance to respond to whatever has happened since the previous round.
+        :param time: the current time.
+        :param exchange: the exchange.
+        :param lob: the current public LOB data, as published by the exchange.
+        :param trade: details of the trade that has just happened, if any.
+        :param vrbs: verbosity, passed on to the traders' respond().
+        :return: True if any trader's respond() asked for a new frame of strategy data to be recorded.
+        """
+        events = ['timer']
+        book = (exchange.bids.version, exchange.asks.version)
+        if book != self.prev_book:
+            events.append('book')
+            self.prev_book = book
+            best = exchange.best_quotes()
+            if best != self.prev_best:
+                events.append('best')
+                self.prev_best = best
+        if trade is not None:
+            events.append('trade')
+        events = tuple(events)
+
+        recipients = self.recipients.get(events)
+        if recipients is None:
+            recipients = [trader for trader in self.traders
+                          if any(event in trader.subscriptions for event in events)]
+            self.recipients[events] = recipients
+
+        self.rounds += 1
+        self.time = time
+        record_frame = False
+        for trader in recipients:
+            # NB respond just updates trader's internal variables
+            # doesn't alter the LOB, so processing each trader in
+            # sequence (rather than random/shuffle) isn't a problem
+            if trader.respond(time, lob, trade, vrbs):
+                record_frame = True
+        return record_frame
+
+
+# the policies a TraderSelector can use to choose which traders get a turn
+selection_policies = ('uniform', 'weighted', 'roundrobin', 'poisson')
+
+
+class TraderSelector:
+    """
+    Chooses which traders get a turn on each timestep of the 'ticks' kernel, from a persistent array of trader-ids,
+    according to one of the selection_policies...
+        'uniform' => one trader per timestep, chosen at random with equal probability (the original BSE behaviour);
+        'weighted' => one trader per timestep, chosen at random with probability proportional to a weight given
+                      for each type of trader, so that e.g. one type can be made to act twice as often as another;
+        'roundrobin' => one trader per timestep, chosen at random without replacement: every trader gets one turn,
+                        in a freshly shuffled order, in each round of n_traders timesteps;
+        'poisson' => each trader has its own clock that ticks as a Poisson process, at the same average rate of once
+                     per n_traders timesteps, and gets a turn on each timestep in which its clock ticked, so there
+                     can be none, one, or several turns on any one timestep.
+    The random choices (or Poisson intervals) are drawn from the random module in batches, batch_size at a time,
+    and used up one by one; except for 'roundrobin', where each batch is always one round of n_traders choices.
+    With batch_size=1 the 'uniform' policy makes exactly the same calls to the random module as the original BSE did,
+    and so gives exactly the same sessions; any larger batch gives sessions that are statistically the same,
+    but different, because the random numbers are drawn in a different order.
+    """
+
+    def __init__(self, traders, time, timestep, policy='uniform', batch_size=None, weights=None):
+        """
+        Set up the selector for a population of traders.
+        :param traders: the population of traders (dictionary, keyed by trader-id).
+        :param time: the current time.
+        :param timestep: the length of a timestep.
+        :param policy: one of selection_policies.
+        :param batch_size: how many random choices to draw at a time; if None, 1 for the 'uniform' policy
+            (which keeps sessions exactly as they always were) or selection_batch_size for 'weighted' and 'poisson'.
+            Must be None for 'roundrobin', which always draws one round of n_traders choices at a time.
+        :param weights: for the 'weighted' policy, a dictionary of the relative weight of each type of trader,
+            keyed by ttype (types not in the dictionary have weight 1.0).
+        """
+        if policy not in selection_policies:
+            sys.exit('FAIL: unknown trader selection policy %s' % str(policy))
+        if policy == 'roundrobin':
+            if batch_size is not None:
+                sys.exit('FAIL: trader selection batch_size can\'t be set for the roundrobin policy')
+            batch_size = len(traders)
+        elif batch_size is None:
+            if policy == 'uniform':
+                batch_size = 1
+            else:
+                batch_size = selection_batch_size
+        if batch_size < 1:
+            sys.exit('FAIL: trader selection batch_size=%s must be 1 or more' % str(batch_size))
+        self.policy = policy
+        self.batch_size = batch_size
+        self.timestep = timestep
+        self.tids = list(traders.keys())
+        self.n = len(self.tids)
+        self.indices = list(range(self.n))
+        self.batch = []     # the batch of choices (or, for 'poisson', of unit-mean exponential intervals) drawn so far
+        self.batch_pos = 0  # the position in the batch of the next one to be used
+        # uniform with batches of 1 => draw each choice just as the original BSE did
+        self.per_draw = policy == 'uniform' and batch_size == 1
+        self.cum_weights = None
+        if policy == 'weighted':
+            if weights is None:
+                weights = {}
+            cum_weight = 0.0
+            self.cum_weights = []
+            for tid in self.tids:
+                weight = weights.get(traders[tid].ttype, 1.0)
+                if weight < 0:
+                    sys.exit('FAIL: trader selection weight for %s can\'t be negative' % traders[tid].ttype)
+                cum_weight += weight
+                self.cum_weights.append(cum_weight)
+            if cum_weight <= 0:
+                sys.exit('FAIL: trader selection weights are all zero')
+        self.wakes = None
+        if policy == 'poisson':
+            # the event queue of each trader's next clock-tick: [time, index]
+            self.mean_interval = self.n * timestep
+            self.wakes = []
+            for index in self.indices:
+                heapq.heappush(self.wakes, [time + self.interval(), index])
+
+    def refill(self):
+        """
+        Draw the next batch of random choices, or of unit-mean exponential intervals for the 'poisson' policy.
+        :return: <nothing>
+        """
+        if self.policy == 'uniform':
+            self.batch = random.choices(self.indices, k=self.batch_size)
+        elif self.policy == 'weighted':
+            self.batch = random.choices(self.indices, cum_weights=self.cum_weights, k=self.batch_size)
+        elif self.policy == 'roundrobin':
+            # the batch is one round: every trader once, in random order
+            self.batch = self.indices[:]
+            random.shuffle(self.batch)
+        else:
+            self.batch = [random.expovariate(1.0) for _ in range(self.batch_size)]
+        self.batch_pos = 0
+
+    def draw(self):
+        """
+        Use up the next random choice (or interval) in the batch, drawing a new batch first if need be.
+        :return: the choice.
+        """
+        if self.batch_pos >= len(self.batch):
+            self.refill()
+        value = self.batch[self.batch_pos]
+        self.batch_pos += 1
+        return value
 
+    def interval(self):
+        """ The time from one of a trader's clock-ticks to the next, for the 'poisson' policy """
+        return self.draw() * self.mean_interval
 
-def trade_stats(expid, traders, dumpfile, time, lob):
+    def due(self, time):
+        """
+        Choose the traders that get a turn on the timestep at this time.
+        :param time: the current time.
+        :return: list of the trader-ids, in the order in which they get their turns.
+        """
+        if self.per_draw:
+            return [self.tids[random.randint(0, self.n - 1)]]
+        if self.wakes is None:
+            pos = self.batch_pos
+            if pos >= len(self.batch):
+                self.refill()
+                pos = 0
+            self.batch_pos = pos + 1
+            return [self.tids[self.batch[pos]]]
+        # poisson: every trader whose clock has ticked since the previous timestep, in order of when it ticked
+        due = []
+        while self.wakes[0][0] <= time:
+            wake_time, index = self.wakes[0]
+            due.append(self.tids[index])
+            heapq.heapreplace(self.wakes, [wake_time + self.interval(), index])
+        return due
+
+
+def trade_stats(expid, traders, dumpfile, time, lob, popstats=None):
     """
     Dump CSV statistics on exchange data and trader population to file for later analysis.
     This makes no assumptions about the number of types of traders, or the number of traders of any one type
     -- allows either/both to change between successive calls, but that does make it inefficient as it has to
-    re-analyse the entire set of traders on each call.
+    re-analyse the entire set of traders on each call, unless it's given incrementally-maintained PopulationStats.
     :param expid: the experiment-I.D. character-string.
     :param traders: the list of traders in the market.
     :param dumpfile: the file that will be written to.
     :param time: the current time.
     :param lob: the current state of the LOB.
+    :param popstats: if not None, the PopulationStats for the traders, which are used instead of re-analysing them.
     :return: <nothing>
     """
 
-    # Analyse the set of traders, to see what types we have
-    trader_types = {}
-    for t in traders:
-        ttype = traders[t].ttype
-        if ttype in trader_types.keys():
-            t_balance = trader_types[ttype]['balance_sum'] + traders[t].balance
-            n = trader_types[ttype]['n'] + 1
-        else:
-            t_balance = traders[t].balance
-            n = 1
-        trader_types[ttype] = {'n': n, 'balance_sum': t_balance}
+    if popstats is not None:
+        trader_types = popstats.types
+    else:
+        # Analyse the set of traders, to see what types we have
+        trader_types = {}
+        for t in traders:
+            ttype = traders[t].ttype
+            if ttype in trader_types.keys():
+                t_balance = trader_types[ttype]['balance_sum'] + traders[t].balance
+                n = trader_types[ttype]['n'] + 1
+            else:
+                t_balance = traders[t].balance
+                n = 1
+            trader_types[ttype] = {'n': n, 'balance_sum': t_balance}
 
     # first two columns of output are the session_id and the time
     dumpfile.write('%s, %06d, ' % (expid, time))
@@ -2581,6 +4798,7 @@ def populate_market(trdrs_spec, traders, shuffle, vrbs):
         :param parameters: a list of parameter values for this trader-type.
         :return: a newly created trader of the designated type.
         """
+        nonlocal zip_population
         balance = 0.00
         proptrader_balance = 500  # marketmakers start with zero inventory and a balance of $500
         time0 = 0
@@ -2596,6 +4814,10 @@ def populate_market(trdrs_spec, traders, shuffle, vrbs):
             return TraderZIP('ZIP', name, balance, parameters, time0)
         elif robottype == 'ZIPSH':
             return TraderZIP('ZIPSH', name, balance, parameters, time0)
+        elif robottype == 'ZIPV':
+            if zip_population is None:
+                zip_population = ZIPPopulation()
+            return TraderZIPV('ZIPV', name, balance, parameters, time0, zip_population)
         elif robottype == 'PRZI':
             return TraderPRZI('PRZI', name, balance, parameters, time0)
         elif robottype == 'PRSH':
@@ -2664,6 +4886,9 @@ def populate_market(trdrs_spec, traders, shuffle, vrbs):
                 else:   # ttype=PRZI
                     parameters = {'optimizer': None, 'k': 1,
                                   'strat_min': trader_params['s_min'], 'strat_max': trader_params['s_max']}
+                # optionally, pre-draw batches of quote-prices
+                if 'quote_batch' in trader_params:
+                    parameters['quote_batch'] = trader_params['quote_batch']
             else:
                 sys.exit('FAIL: PRZI/PRSH/PRDE trader needs one or more parameters to be specified')
                 
@@ -2677,6 +4902,7 @@ def populate_market(trdrs_spec, traders, shuffle, vrbs):
         return parameters
 
     landscape_mapping = False   # set to true when mapping fitness landscape (for PRSH etc).
+    zip_population = None       # shared by all the ZIPV traders, created when the first one is.
 
     # the code that follows is a bit of a kludge, needs tidying up.
     n_buyers = 0
@@ -2792,7 +5018,7 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
             price = bse_sys_maxprice
         return price
 
-    def getorderprice(i, schedules, n, stepmode, orderissuetime):
+    def getorderprice(i, schedules, n, stepmode, orderissuetime, offset=None):
         """
         Generate a price for an order, using the given supply/demand schedule, and specified step-mode.
         :param i: index of trader (position in list of traders).
@@ -2803,13 +5029,17 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
                 stepmode=='jittered' => all steps are random, constrained to be within 2 uniform-steps of each other;
                 stepmode=='random' => all steps are generated from a uniform distribution.
         :param orderissuetime: the time that this order will be issued at.
+        :param offset: the offset function's value at orderissuetime, if it has already been found by getoffsets().
         :return: the price.
         """
 
         # does the first schedule range include optional dynamic offset function(s)?
         if len(schedules[0]) > 2:
             offsetfn = schedules[0][2]
-            if callable(offsetfn[0]):
+            if offset is not None:
+                offset_min = offset
+                offset_max = offset_min
+            elif callable(offsetfn[0]):
                 # same offset for min and max
                 offset_min = offsetfn[0](orderissuetime, *offsetfn[1])
                 offset_max = offset_min
@@ -2849,6 +5079,20 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
         order_price = sysmin_check(sysmax_check(order_price))
         return order_price
 
+    def getoffsets(schedules, orderissuetimes):
+        """
+        If the first schedule range's offset function has a vectorised offsets_at() (e.g. an OffsetFunction),
+        look up the offsets for a whole batch of order issue-times in one call.
+        :param schedules: the supply/demand schedules.
+        :param orderissuetimes: the times that the orders will be issued at.
+        :return: list of offsets, one per issue-time; or list of None if there's no vectorised offset function.
+        """
+        if len(schedules[0]) > 2:
+            offsetfn = schedules[0][2]
+            if hasattr(offsetfn[0], 'offsets_at') and len(offsetfn[1]) == 0:
+                return offsetfn[0].offsets_at(orderissuetimes)
+        return [None] * len(orderissuetimes)
+
     def getissuetimes(n_traders, timemode, interval, shuffle, fittointerval):
         """
         Generate a list of issue/arrival times for a set of future customer-orders, over a specified time-interval.
@@ -2940,10 +5184,11 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
 
         ordertype = 'Bid'
         (sched, mode) = getschedmode(time, orders_sched['dem'])
+        offsets = getoffsets(sched, [time + issuetimes[t] for t in range(n_buyers)])
         for t in range(n_buyers):
             issuetime = time + issuetimes[t]
             tname = 'B%02d' % t
-            orderprice = getorderprice(t, sched, n_buyers, mode, issuetime)
+            orderprice = getorderprice(t, sched, n_buyers, mode, issuetime, offsets[t])
             order = Order(tname, ordertype, orderprice, 1, issuetime, chrono.time())
             new_pending.append(order)
 
@@ -2951,10 +5196,11 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
         issuetimes = getissuetimes(n_sellers, orders_sched['timemode'], orders_sched['interval'], shuffle_times, True)
         ordertype = 'Ask'
         (sched, mode) = getschedmode(time, orders_sched['sup'])
+        offsets = getoffsets(sched, [time + issuetimes[t] for t in range(n_sellers)])
         for t in range(n_sellers):
             issuetime = time + issuetimes[t]
             tname = 'S%02d' % t
-            orderprice = getorderprice(t, sched, n_sellers, mode, issuetime)
+            orderprice = getorderprice(t, sched, n_sellers, mode, issuetime, offsets[t])
             # print('time %d sellerprice %d' % (time,orderprice))
             order = Order(tname, ordertype, orderprice, 1, issuetime, chrono.time())
             new_pending.append(order)
@@ -2980,7 +5226,442 @@ def customer_orders(time, traders, trader_stats, orders_sched, pending, vrbs):
     return [new_pending, cancellations]
 
 
-def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dumpfile_flags, sess_vrbs):
+# compressed output sinks: the codecs that session output files can be compressed with, and their filename suffixes
+sink_suffixes = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+# the session output streams that can each be compressed or not (cf. the dump_* flags of market_session())
+sink_streams = ('strats', 'lobs', 'avgbals', 'tape', 'blotters')
+
+
+class CompressedSink:
+    """
+    A text output file that is compressed as it is written, with gzip, xz, or zstd (zstd needs the zstandard package).
+    Writes are gathered up into chunks of about chunk_bytes before being handed to the compressor. Each flush()
+    finishes the current compressed member (a gzip member, an xz stream, or a zstd frame) and writes it out, so the
+    file is always readable up to the last flush; the file as a whole is a concatenation of members, which the
+    standard decompressors read back as one stream (see sink_read_open). NB each flush costs a little compression.
+    """
+
+    def __init__(self, fname, fmode='w', codec='gzip', level=None, chunk_bytes=65536):
+        """
+        Open a compressed output file.
+        :param fname: the filename (the caller is responsible for its suffix, see sink_suffixes).
+        :param fmode: 'w' to write a new file, 'a' to append further members to an existing one.
+        :param codec: 'gzip', 'xz', or 'zstd'.
+        :param level: compression level (gzip 1-9, xz 0-9, zstd 1-22); if None then the codec's default.
+        :param chunk_bytes: size of the chunks that writes are gathered up into.
+        """
+        if codec not in sink_suffixes:
+            sys.exit('FAIL: unknown codec=%s in CompressedSink' % codec)
+        if codec == 'zstd' and zstandard is None:
+            sys.exit('FAIL: codec=zstd needs the zstandard package')
+        if fmode != 'w' and fmode != 'a':
+            sys.exit('FAIL: bad fmode=%s in CompressedSink' % fmode)
+        self.name = fname
+        self.codec = codec
+        self.level = level
+        self.chunk_bytes = chunk_bytes
+        self.file = open(fname, fmode + 'b')
+        self.compressor = None  # compressor for the current member: None until something is written after a flush
+        self.blocks = []        # text written but not yet compressed
+        self.n_bytes = 0
+        self.closed = False
+
+    def new_compressor(self):
+        """ A fresh compressor, for the next compressed member """
+        if self.codec == 'gzip':
+            # wbits=31 => gzip header & trailer
+            return zlib.compressobj(6 if self.level is None else self.level, zlib.DEFLATED, 31)
+        elif self.codec == 'xz':
+            return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=6 if self.level is None else self.level)
+        else:
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compressobj()
+
+    def compress_blocks(self):
+        """ Hand the gathered-up text to the compressor, writing out whatever compressed data it produces """
+        if self.n_bytes > 0:
+            if self.compressor is None:
+                self.compressor = self.new_compressor()
+            self.file.write(self.compressor.compress(''.join(self.blocks).encode()))
+            self.blocks = []
+            self.n_bytes = 0
+
+    def write(self, text):
+        self.blocks.append(text)
+        self.n_bytes += len(text)
+        if self.n_bytes >= self.chunk_bytes:
+            self.compress_blocks()
+
+    def flush(self):
+        """ Finish the current compressed member, and flush it out to the file """
+        self.compress_blocks()
+        if self.compressor is not None:
+            if self.codec == 'zstd':
+                self.file.write(self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH))
+            else:
+                self.file.write(self.compressor.flush())
+            self.compressor = None
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        if not self.closed:
+            if self.file.tell() == 0 and self.compressor is None:
+                # nothing was ever written: a zero-length file isn't valid xz or zstd, so write an empty member
+                self.compressor = self.new_compressor()
+            self.flush()
+            self.file.close()
+            self.closed = True
+
+
+def sink_read_open(fname):
+    """
+    Open a session output text file for reading, decompressing it transparently if it was written compressed.
+    :param fname: the uncompressed filename, e.g. 'sess_tape.csv': if there's no such file, then the compressed
+                  versions (fname plus each of the sink_suffixes) are tried in turn.
+    :return: a text file object, or None if there's no such file in any form.
+    """
+    if os.path.isfile(fname):
+        return open(fname, 'r')
+    if os.path.isfile(fname + sink_suffixes['gzip']):
+        return gzip.open(fname + sink_suffixes['gzip'], 'rt')
+    if os.path.isfile(fname + sink_suffixes['xz']):
+        return lzma.open(fname + sink_suffixes['xz'], 'rt')
+    if os.path.isfile(fname + sink_suffixes['zstd']):
+        if zstandard is None:
+            sys.exit('FAIL: reading %s needs the zstandard package' % (fname + sink_suffixes['zstd']))
+        reader = zstandard.ZstdDecompressor().stream_reader(open(fname + sink_suffixes['zstd'], 'rb'),
+                                                            read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader)
+    return None
+
+
+class AsyncWriter:
+    """
+    A background thread that does the writing for a set of output files, so that the simulation doesn't wait on disk.
+    Each AsyncFile that the writer opens gathers up its writes into blocks of about batch_bytes, and hands each block
+    to the thread via a bounded queue: if the thread falls behind and the queue fills up then the handing-over waits
+    (backpressure), so memory use stays bounded. The thread fsyncs the files every fsync_interval seconds (if not None)
+    and when they're closed. Any AsyncWriter that is still open at exit (including after sys.exit()) gets flushed.
+    """
+
+    def __init__(self, max_queue=64, batch_bytes=65536, fsync_interval=None):
+        """
+        Start a background writer thread.
+        :param max_queue: max number of blocks waiting in the queue.
+        :param batch_bytes: size of the blocks that each file's writes are gathered up into.
+        :param fsync_interval: if not None, how often (in wall-clock seconds) the files are fsynced.
+        """
+        self.queue = queue.Queue(max_queue)
+        self.batch_bytes = batch_bytes
+        self.fsync_interval = fsync_interval
+        self.files = []         # the real file objects, indexed by file number
+        self.afiles = []        # the AsyncFile for each file number
+        self.error = None       # any exception raised in the writer thread
+        self.closing = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        async_writers.append(self)
+
+    def open(self, fname, fmode='w', opener=open):
+        """
+        Open a file that gets written by this writer's thread.
+        :param fname: the filename.
+        :param fmode: file-open write/append mode.
+        :param opener: the function that opens the real file, e.g. a CompressedSink (whose compression then also
+                       gets done by the writer thread).
+        :return: the AsyncFile.
+        """
+        self.files.append(opener(fname, fmode))
+        self.afiles.append(AsyncFile(self, len(self.files) - 1))
+        return self.afiles[-1]
+
+    def put(self, item):
+        """
+        Hand an item to the writer thread: waits if the queue is full.
+        :param item: [action, file number, text] where action is 'write', 'close', 'sync', or 'stop';
+                     for 'sync' the third item is a threading.Event that's set once the files are flushed.
+        :return: <nothing>
+        """
+        if self.error is not None and not self.closing:
+            sys.exit('FAIL: AsyncWriter thread failed: %s' % self.error)
+        self.queue.put(item)
+
+    def run(self):
+        """
+        The writer thread: write each block as it arrives, and fsync every fsync_interval.
+        :return: <nothing>
+        """
+        dirty = set()       # file numbers written to since they were last fsynced
+        last_sync = chrono.time()
+        while True:
+            [action, fnum, text] = self.queue.get()
+            try:
+                if action == 'write':
+                    self.files[fnum].write(text)
+                    dirty.add(fnum)
+                elif action == 'close':
+                    self.files[fnum].flush()
+                    os.fsync(self.files[fnum].fileno())
+                    self.files[fnum].close()
+                    dirty.discard(fnum)
+                elif action == 'sync':
+                    for fnum in dirty:
+                        self.files[fnum].flush()
+                    text.set()
+                elif action == 'stop':
+                    for fnum in dirty:
+                        self.files[fnum].flush()
+                        os.fsync(self.files[fnum].fileno())
+                    return
+                if self.fsync_interval is not None and len(dirty) > 0 and \
+                        chrono.time() - last_sync >= self.fsync_interval:
+                    for fnum in dirty:
+                        self.files[fnum].flush()
+                        os.fsync(self.files[fnum].fileno())
+                    dirty = set()
+                    last_sync = chrono.time()
+            except Exception as e:
+                # remember the error, so the simulation finds out about it; and keep draining the queue
+                self.error = e
+                if action == 'sync':
+                    text.set()
+
+    def sync(self):
+        """
+        Hand over everything written so far, and wait until the writer thread has written it out to the files
+        (e.g. so that the files' sizes can be recorded in a session checkpoint).
+        :return: <nothing>
+        """
+        for afile in self.afiles:
+            if not afile.closed:
+                afile.flush()
+        done = threading.Event()
+        self.put(['sync', None, done])
+        done.wait()
+        if self.error is not None:
+            sys.exit('FAIL: AsyncWriter thread failed: %s' % self.error)
+
+    def close(self):
+        """
+        Flush and close all the files, and stop the writer thread once it has finished writing.
+        :return: <nothing>
+        """
+        if self.closed:
+            return
+        self.closing = True
+        for afile in self.afiles:
+            afile.close()
+        self.put(['stop', None, None])
+        self.thread.join()
+        self.closed = True
+        async_writers.remove(self)
+        if self.error is not None:
+            sys.exit('FAIL: AsyncWriter thread failed: %s' % self.error)
+
+
+class AsyncFile:
+    """ An output file written by an AsyncWriter: only has write(), flush() and close() """
+
+    def __init__(self, writer, fnum):
+        self.writer = writer
+        self.fnum = fnum
+        self.blocks = []        # text written but not yet handed over to the writer thread
+        self.n_bytes = 0
+        self.closed = False
+
+    def write(self, text):
+        self.blocks.append(text)
+        self.n_bytes += len(text)
+        if self.n_bytes >= self.writer.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        """ Hand any gathered-up text over to the writer thread (NB doesn't wait for it to be written) """
+        if self.n_bytes > 0:
+            self.writer.put(['write', self.fnum, ''.join(self.blocks)])
+            self.blocks = []
+            self.n_bytes = 0
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.writer.put(['close', self.fnum, None])
+            self.closed = True
+
+
+# AsyncWriters that are still open: at exit, any that haven't been closed get closed (so their files get flushed)
+async_writers = []
+
+
+def async_writers_close():
+    """
+    Close every AsyncWriter that is still open.
+    :return: <nothing>
+    """
+    for writer in list(async_writers):
+        writer.close()
+
+
+atexit.register(async_writers_close)
+
+
+class SessionProfile:
+    """
+    Built-in wall-clock timers and counters for the phases of a market session.
+    market_session() only creates one of these if asked to, and otherwise uses a NullProfile whose timers and
+    counters do nothing, so profiling costs next to nothing when it is switched off.
+    NB phases can be nested: e.g. the time spent writing the tape file ('tape') is also counted in 'process_order'.
+    """
+
+    def __init__(self, sample_file=None, sample_interval=None):
+        """
+        Create a new, empty, session profile.
+        :param sample_file: if not None, file that a periodic sample of the per-phase timings is written to.
+        :param sample_interval: if sample_file is not None, how often (in simulated seconds) to write a sample.
+        """
+        self.secs = {}              # total wall-clock seconds spent in each phase
+        self.calls = {}             # number of times each phase has been timed, or each counter incremented
+        self.wall_start = chrono.perf_counter()
+        self.sample_file = sample_file
+        self.sample_interval = sample_interval
+        self.next_sample = None     # simulated time at which the next sample is due
+        self.sampled_secs = {}      # per-phase totals at the previous sample, so each sample gives the deltas
+        self.sampled_calls = {}
+
+    def add(self, phase, secs):
+        """
+        Add one timed call to a phase's totals.
+        :param phase: name of the phase.
+        :param secs: wall-clock seconds spent in this call.
+        :return: <nothing>
+        """
+        if phase in self.secs:
+            self.secs[phase] += secs
+            self.calls[phase] += 1
+        else:
+            self.secs[phase] = secs
+            self.calls[phase] = 1
+
+    def count(self, counter, n=1):
+        """
+        Increment a counter (i.e., an untimed phase).
+        :param counter: name of the counter.
+        :param n: how much to increment it by.
+        :return: <nothing>
+        """
+        if counter in self.calls:
+            self.calls[counter] += n
+        else:
+            self.secs[counter] = 0.0
+            self.calls[counter] = n
+
+    def sample(self, time):
+        """
+        If a sample is due, write one line to the sample file giving the per-phase calls and seconds since last time.
+        :param time: the current simulated time.
+        :return: <nothing>
+        """
+        if self.sample_file is None:
+            return
+        if self.next_sample is None:
+            self.next_sample = time + self.sample_interval
+            return
+        if time < self.next_sample:
+            return
+        line_str = 't=,%.3f, wall=,%.6f, ' % (time, chrono.perf_counter() - self.wall_start)
+        for phase in sorted(self.calls):
+            d_calls = self.calls[phase] - self.sampled_calls.get(phase, 0)
+            d_secs = self.secs[phase] - self.sampled_secs.get(phase, 0.0)
+            line_str += '%s=,%d, %.6f, ' % (phase, d_calls, d_secs)
+        self.sample_file.write(line_str + '\n')
+        self.sampled_calls = dict(self.calls)
+        self.sampled_secs = dict(self.secs)
+        while self.next_sample <= time:
+            self.next_sample += self.sample_interval
+
+    def summary_dump(self, dumpfile, sess_id):
+        """
+        Write the per-session summary: one line per phase, busiest first.
+        :param dumpfile: the file to write to.
+        :param sess_id: the session's ID string.
+        :return: <nothing>
+        """
+        wall = chrono.perf_counter() - self.wall_start
+        dumpfile.write('%s, session, 1, %.6f, %.3f, 100.00\n' % (sess_id, wall, 1e6 * wall))
+        for phase in sorted(self.secs, key=lambda ph: self.secs[ph], reverse=True):
+            mean_usec = 1e6 * self.secs[phase] / self.calls[phase]
+            dumpfile.write('%s, %s, %d, %.6f, %.3f, %.2f\n'
+                           % (sess_id, phase, self.calls[phase], self.secs[phase], mean_usec,
+                              100.0 * self.secs[phase] / wall))
+
+
+class NullProfile:
+    """ Stands in for a SessionProfile when profiling is switched off: the same calls, but they do nothing """
+
+    def add(self, phase, secs):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def sample(self, time):
+        pass
+
+
+class TimedWriter:
+    """
+    Wraps an output file so that the time spent writing to it is added to a phase of a SessionProfile.
+    Only used when profiling, so that the files written from inside the Exchange (tape, LOB frames) can be timed.
+    """
+
+    def __init__(self, outfile, profile, phase):
+        self.outfile = outfile
+        self.profile = profile
+        self.phase = phase
+
+    def write(self, outstr):
+        t0 = chrono.perf_counter()
+        self.outfile.write(outstr)
+        self.profile.add(self.phase, chrono.perf_counter() - t0)
+
+    def close(self):
+        self.outfile.close()
+
+
+def checkpoint_write(fname, state):
+    """
+    Write a session checkpoint: the state is pickled to a temporary file that is then renamed, so that a crash
+    part-way through writing never leaves a broken checkpoint in place of the previous good one.
+    :param fname: the checkpoint filename.
+    :param state: dictionary of everything needed to carry on the session (see market_session()).
+    :return: <nothing>
+    """
+    tmp_name = '%s.%d.tmp' % (fname, os.getpid())
+    with open(tmp_name, 'wb') as ckpt_file:
+        pickle.dump(state, ckpt_file, protocol=pickle.HIGHEST_PROTOCOL)
+        ckpt_file.flush()
+        os.fsync(ckpt_file.fileno())
+    os.replace(tmp_name, fname)
+
+
+def checkpoint_read(fname):
+    """
+    Read a session checkpoint written by checkpoint_write().
+    :param fname: the checkpoint filename.
+    :return: the state dictionary.
+    """
+    with open(fname, 'rb') as ckpt_file:
+        state = pickle.load(ckpt_file)
+    if state.get('checkpoint_version') != 1:
+        sys.exit('FAIL: %s is not a BSE session checkpoint' % fname)
+    return state
+
+
+def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dumpfile_flags, sess_vrbs,
+                   sim_mode='ticks', resume=None):
     """
     One session in the market.
     :param sess_id: the character-string ID for this session, used in naming output files.
@@ -2989,7 +5670,51 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
     :param trader_spec: specification of the traders populating the market for this session.
     :param order_schedule: specification of the "customer orders" assigned to traders, i.e. the supply/demand schedule.
     :param dumpfile_flags: a dictionary of Boolean flags specifying which output files to be written for this session.
+            Optionally, dumpfile_flags['avgbals_every_trades'] and/or dumpfile_flags['avgbals_every_secs']
+            down-sample the rows written to the avg_balance file (by default, one row after every trade).
+            Optionally, dumpfile_flags['dump_async']==True has the files written by a background thread (see
+            AsyncWriter), which fsyncs them every dumpfile_flags['fsync_interval'] seconds (if not None) and at
+            the end of the session, rather than fsyncing after every strategy frame.
+            Optionally, dumpfile_flags['dump_compress'] compresses the text output files as they're written (see
+            CompressedSink), adding the codec's suffix to their names: it is either a codec name ('gzip', 'xz', or
+            'zstd') for all files, or a dictionary giving the codec for each stream to compress (the streams are
+            'strats', 'lobs', 'avgbals', 'tape', and 'blotters'); dumpfile_flags['compress_level'] sets the level.
+            Use sink_read_open() to read them back.
+            Optionally, dumpfile_flags['lob_frames_format']=='delta' writes the LOB frames as deltas, with a whole-book
+            keyframe every dumpfile_flags['lob_keyframe_every'] frames (default 1000), to <sess_id>_LOB_deltas.csv
+            instead of <sess_id>_LOB_frames.csv: see LOBDeltaWriter, and lob_frames_from_deltas() to replay them.
+            Optionally, dumpfile_flags['dump_format']=='columnar' writes the tape and blotters as columnar binary
+            files (<sess_id>_tape.bcol and <sess_id>_blotters.bcol, see ColumnarReader) instead of CSV text.
+            Optionally, dumpfile_flags['dump_profile']==True switches on the built-in per-phase timers and counters,
+            and writes a summary of them at the end of the session; if dumpfile_flags['profile_interval'] is
+            also set, a sample of the timers is written every profile_interval simulated seconds.
+            Optionally, dumpfile_flags['checkpoint_interval'] is how often (in simulated seconds) the whole state of
+            the session is written to <sess_id>_checkpoint.pkl, from which market_session_resume() can carry on the
+            session exactly as if it had never stopped: see checkpoint_write(). Only for sim_mode=='ticks'.
+            The checkpoint file is deleted when the session finishes.
+            Optionally, dumpfile_flags['tape_length'] is the max number of events on the exchange's in-memory tape
+            (default 10000); if dumpfile_flags['tape_spill']==True, events evicted from the tape are written to
+            <sess_id>_tape_spill.csv (or .bcol, for dump_format=='columnar'): not with checkpoint_interval.
+            Optionally, dumpfile_flags['pub_depth'] is the max number of price-levels on each side of the LOB
+            published to the traders (by default, all of them).
+            Optionally, dumpfile_flags['lob_impl'] is how the exchange's book is implemented: 'dict' (the default) or
+            'ladder' (see Orderbook); it only affects speed and memory use, not the session's results.
+            Optionally, dumpfile_flags['trace_level'] ('off', the default, 'info', or 'debug') switches on the traders'
+            diagnostic tracing (see Tracer), recorded in the in-memory ring of the module-level tracer, or appended
+            to the file dumpfile_flags['trace_file'] if that's given.
+            Optionally, dumpfile_flags['trader_selection'] is the policy for choosing which traders get a turn on each
+            timestep: 'uniform' (the default), 'weighted' (by the weight for each trader-type given in the dictionary
+            dumpfile_flags['selection_weights']), 'roundrobin', or 'poisson'; dumpfile_flags['selection_batch'] is how
+            many random choices are drawn at a time (not for 'roundrobin'). See TraderSelector.
+            Only for sim_mode=='ticks'.
     :param sess_vrbs: verbosity: if True, output a running commentary on what is going on; if False, stay silent.
+    :param sim_mode: which simulation kernel to use...
+            sim_mode=='ticks' => time advances in fixed timesteps, on each of which one randomly chosen trader is polled;
+            sim_mode=='poll' => event-driven, statistically equivalent to 'ticks' but skipping timesteps where nothing
+                                can happen, because the chosen trader has no customer order;
+            sim_mode=='poisson' => event-driven, each trader holding a customer order wakes up as a Poisson process,
+                                   and PRSH/PRDE/ZIPSH traders also wake up on their strategy-switch deadlines.
+    :param resume: if not None, a checkpoint state (from checkpoint_read()) to carry on from: see market_session_resume().
     :return: <nothing>.
     """
 
@@ -3018,6 +5743,7 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
             # print('PRSH/PRDE/ZIPSH strategy recording, t=%s' % trader)
             if trader.ttype == 'PRSH' or trader.ttype == 'PRDE' or trader.ttype == 'ZIPSH':
                 line_str += 'id=,%s, %s,' % (trader.tid, trader.ttype)
+                trader.strats_pps_settle()
 
                 if trader.ttype == 'ZIPSH':
                     # we know that ZIPSH sorts the set of strats into best-first
@@ -3056,11 +5782,13 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
 
         line_str += '\n'
 
-        if verbose:
-            print('line_str: %s' % line_str)
+        if tracer.debug:
+            tracer.trace(trace_debug, 'line_str: %s', line_str)
         stratfile.write(line_str)
-        stratfile.flush()
-        os.fsync(stratfile)
+        if async_writer is None:
+            # when there's a background writer thread, it takes care of flushing and syncing
+            stratfile.flush()
+            os.fsync(stratfile)
 
     def blotter_dump(session_id, trdrs):
         """
@@ -3069,12 +5797,20 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
         :param trdrs: the population of traders.
         :return: <nothing>
         """
-        bdump = open(session_id+'_blotters.csv', 'w')
+        if dump_format == 'columnar':
+            bdump = ColumnarWriter(session_id + '_blotters.bcol', 'blotter', columnar_blotter_columns)
+            for trdr in trdrs:
+                for b in trdrs[trdr].blotter:
+                    bdump.append([trdrs[trdr].tid, b.type, b.time, b.price, b.party1, b.party2,
+                                  b.qty])
+            bdump.close()
+            return
+        bdump = dump_open(session_id+'_blotters.csv', 'w', 'blotters')
         for trdr in trdrs:
             bdump.write('%s, %d\n' % (trdrs[trdr].tid, len(trdrs[trdr].blotter)))
             for b in trdrs[trdr].blotter:
                 bdump.write('%s, %s, %.3f, %d, %s, %s, %d\n'
-                            % (traders[trdr].tid, b['type'], b['time'], b['price'], b['party1'], b['party2'], b['qty']))
+                            % (traders[trdr].tid, b.type, b.time, b.price, b.party1, b.party2, b.qty))
         bdump.close()
 
     orders_verbose = False
@@ -3084,37 +5820,174 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
     bookkeep_verbose = False
     populate_verbose = False
 
+    # output files are either written directly, or (if dump_async) by a background writer thread
+    async_writer = None
+    if dumpfile_flags.get('dump_async', False):
+        async_writer = AsyncWriter(fsync_interval=dumpfile_flags.get('fsync_interval'))
+
+    # text output files can be compressed as they're written (see CompressedSink): dump_compress is either one codec
+    # for all the streams, or a dictionary giving the codec for each stream that is to be compressed
+    dump_compress = dumpfile_flags.get('dump_compress')
+    if dump_compress is None:
+        compress_codecs = {}
+    elif isinstance(dump_compress, str):
+        compress_codecs = {stream: dump_compress for stream in sink_streams}
+    else:
+        compress_codecs = dict(dump_compress)
+    for stream in compress_codecs:
+        if stream not in sink_streams or compress_codecs[stream] not in sink_suffixes:
+            sys.exit('FAIL: bad dump_compress %s=%s in market_session' % (stream, compress_codecs[stream]))
+    compress_level = dumpfile_flags.get('compress_level')
+
+    # when resuming from a checkpoint, the output files are cut back to where they were at the checkpoint and
+    # then appended to; otherwise they're written from scratch
+    checkpoint_interval = dumpfile_flags.get('checkpoint_interval')
+    checkpoint_fname = sess_id + '_checkpoint.pkl'
+    if (checkpoint_interval is not None or resume is not None) and sim_mode != 'ticks':
+        sys.exit('FAIL: session checkpoints need sim_mode=ticks, not sim_mode=%s' % sim_mode)
+    # the exchange's in-memory tape, and whether the events evicted from it get written to a file
+    tape_length = dumpfile_flags.get('tape_length', 10000)
+    if type(tape_length) is not int or tape_length < 1:
+        sys.exit('FAIL: bad tape_length=%s in market_session' % tape_length)
+    tape_spill = dumpfile_flags.get('tape_spill', False)
+    if tape_spill and checkpoint_interval is not None:
+        sys.exit('FAIL: tape_spill cannot be used with checkpoint_interval in market_session')
+    pub_depth = dumpfile_flags.get('pub_depth')
+    if pub_depth is not None and (type(pub_depth) is not int or pub_depth < 1):
+        sys.exit('FAIL: bad pub_depth=%s in market_session' % pub_depth)
+    lob_impl = dumpfile_flags.get('lob_impl', 'dict')
+    if lob_impl != 'dict' and lob_impl != 'ladder':
+        sys.exit('FAIL: unknown lob_impl=%s in market_session' % lob_impl)
+    fmode = 'w'
+    if resume is not None:
+        fmode = 'a'
+        for fname in resume['file_sizes']:
+            os.truncate(fname, resume['file_sizes'][fname])
+    dump_files = {}     # the files that are flushed, and their sizes recorded, at each checkpoint
+
+    def dump_open(fname, fmode, stream):
+        """
+        Open one of the session's text output files, compressed or not, written directly or by the writer thread.
+        :param fname: the filename (a suffix is added if the file is compressed).
+        :param fmode: file-open write/append mode.
+        :param stream: which of the sink_streams this file is.
+        :return: the file object.
+        """
+        opener = open
+        if compress_codecs.get(stream) is not None:
+            fname = fname + sink_suffixes[compress_codecs[stream]]
+            opener = functools.partial(CompressedSink, codec=compress_codecs[stream], level=compress_level)
+        if async_writer is not None:
+            dump_file = async_writer.open(fname, fmode, opener)
+        else:
+            dump_file = opener(fname, fmode)
+        # NB the blotters file gets added too, but it's only written after the last checkpoint
+        dump_files[fname] = dump_file
+        return dump_file
+
     if dumpfile_flags['dump_strats']:
-        strat_dump = open(sess_id + '_strats.csv', 'w')
+        strat_dump = dump_open(sess_id + '_strats.csv', fmode, 'strats')
     else:
         strat_dump = None
 
+    # LOB frames are either written whole, or as deltas with periodic keyframes (see LOBDeltaWriter)
+    lob_frames_format = dumpfile_flags.get('lob_frames_format', 'full')
+    if lob_frames_format != 'full' and lob_frames_format != 'delta':
+        sys.exit('FAIL: unknown lob_frames_format=%s in market_session' % lob_frames_format)
+
     if dumpfile_flags['dump_lobs']:
-        lobframes = open(sess_id + '_LOB_frames.csv', 'w')
+        if lob_frames_format == 'delta':
+            lobframes = dump_open(sess_id + '_LOB_deltas.csv', fmode, 'lobs')
+        else:
+            lobframes = dump_open(sess_id + '_LOB_frames.csv', fmode, 'lobs')
     else:
         lobframes = None
 
     if dumpfile_flags['dump_avgbals']:
-        avg_bals = open(sess_id + '_avg_balance.csv', 'w')
+        avg_bals = dump_open(sess_id + '_avg_balance.csv', fmode, 'avgbals')
     else:
         avg_bals = None
         
+    # tape and blotter files are either text CSV or columnar binary (see ColumnarWriter)
+    dump_format = dumpfile_flags.get('dump_format', 'csv')
+    if dump_format != 'csv' and dump_format != 'columnar':
+        sys.exit('FAIL: unknown dump_format=%s in market_session' % dump_format)
+
     if dumpfile_flags['dump_tape']:
         # NB writing transactions only -- not writing cancellations
-        tape_dump = open(sess_id + '_tape.csv', 'w')
+        if dump_format == 'columnar':
+            tape_dump = ColumnarWriter(sess_id + '_tape.bcol', 'tape', columnar_tape_columns, fmode)
+            dump_files[sess_id + '_tape.bcol'] = tape_dump
+        else:
+            tape_dump = dump_open(sess_id + '_tape.csv', fmode, 'tape')
     else:
         tape_dump = None
-        
-    # initialise the exchange
-    exchange = Exchange()
 
-    # create a bunch of traders
-    traders = {}
-    trader_stats = populate_market(trader_spec, traders, True, populate_verbose)
+    if tape_spill:
+        if dump_format == 'columnar':
+            spill_dump = ColumnarWriter(sess_id + '_tape_spill.bcol', 'tape', columnar_tape_columns)
+        else:
+            spill_dump = dump_open(sess_id + '_tape_spill.csv', 'w', 'tape')
+    else:
+        spill_dump = None
+        
+    # built-in profiling: unless it's switched on, prof is a NullProfile whose timers and counters do nothing
+    # NB on resuming from a checkpoint the profile starts afresh, covering only the resumed part of the session
+    prof = NullProfile()
+    prof_samples = None
+    clock = chrono.perf_counter
+    if dumpfile_flags.get('dump_profile', False):
+        if dumpfile_flags.get('profile_interval') is not None:
+            prof_samples = open(sess_id + '_profile_samples.csv', 'w')
+        prof = SessionProfile(prof_samples, dumpfile_flags.get('profile_interval'))
+        # time the writes that happen inside the exchange
+        if tape_dump is not None and dump_format == 'csv':
+            tape_dump = TimedWriter(tape_dump, prof, 'tape')
+        if lobframes is not None:
+            lobframes = TimedWriter(lobframes, prof, 'lob_frames')
+
+    # diagnostic tracing: off by default, in which case none of the traders' diagnostic messages are even built
+    tracer.configure(dumpfile_flags.get('trace_level', trace_off), dumpfile_flags.get('trace_file'))
+
+    if resume is None:
+        # initialise the exchange
+        exchange = Exchange(tape_length, spill_dump, lob_impl, pub_depth)
+
+        # create a bunch of traders
+        traders = {}
+        trader_stats = populate_market(trader_spec, traders, True, populate_verbose)
+
+        # per-trader-type statistics of the population, kept up to date as balances change, for trade_stats
+        # NB the trade_stats rows written to the avg_balance file can be down-sampled, to one every
+        # avgbals_every_trades trades and/or one every avgbals_every_secs seconds: by default, one after every trade
+        popstats = PopulationStats(traders, dumpfile_flags.get('avgbals_every_trades'),
+                                   dumpfile_flags.get('avgbals_every_secs'))
+
+        # after each order, only the traders subscribed to whatever has happened get to respond
+        dispatcher = RespondDispatcher(traders)
+    else:
+        # the exchange, traders, population statistics, and dispatcher all come back from the checkpoint
+        exchange = resume['exchange']
+        traders = resume['traders']
+        trader_stats = resume['trader_stats']
+        popstats = resume['popstats']
+        dispatcher = resume.get('dispatcher')
+        if dispatcher is None:
+            dispatcher = RespondDispatcher(traders)
+
+    if lobframes is not None and lob_frames_format == 'delta':
+        if resume is not None and resume['lob_deltas'] is not None:
+            # carry on from the levels recorded in the last frame written before the checkpoint
+            lob_deltas = resume['lob_deltas']
+            lob_deltas.outfile = lobframes
+            lobframes = lob_deltas
+        else:
+            lobframes = LOBDeltaWriter(lobframes, dumpfile_flags.get('lob_keyframe_every', 1000))
 
     # timestep set so that can process all traders in one second
     # NB minimum interarrival time of customer orders may be much less than this!!
-    timestep = 1.0 / float(trader_stats['n_buyers'] + trader_stats['n_sellers'] + trader_stats['n_proptraders'])
+    n_traders = trader_stats['n_buyers'] + trader_stats['n_sellers'] + trader_stats['n_proptraders']
+    timestep = 1.0 / float(n_traders)
 
     session_duration = float(endtime - starttime)
 
@@ -3128,81 +6001,360 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
     # frames_done is record of what frames we have printed data for thus far
     frames_done = set()
 
-    while time < endtime:
-
-        # how much time left, as a percentage?
-        time_left = (endtime - time) / session_duration
+    next_checkpoint = None
+    if checkpoint_interval is not None:
+        next_checkpoint = starttime + checkpoint_interval
+
+    if resume is not None:
+        time = resume['time']
+        pending_cust_orders = resume['pending_cust_orders']
+        frames_done = resume['frames_done']
+        next_checkpoint = resume['next_checkpoint']
+        random.setstate(resume['random_state'])
+
+    # which traders get a turn on each timestep of the 'ticks' kernel
+    selection = dumpfile_flags.get('trader_selection', 'uniform')
+    if selection != 'uniform' and sim_mode != 'ticks':
+        sys.exit('FAIL: trader_selection=%s needs sim_mode=ticks' % selection)
+    if resume is not None and resume.get('selector') is not None:
+        selector = resume['selector']
+    else:
+        selector = TraderSelector(traders, time, timestep, selection, dumpfile_flags.get('selection_batch'),
+                                  dumpfile_flags.get('selection_weights'))
 
-        if sess_vrbs:
-            print('\n\n%s; t=%08.2f (%4.1f/100) ' % (sess_id, time, time_left*100))
-
-        [pending_cust_orders, kills] = customer_orders(time, traders, trader_stats,
-                                                       order_schedule, pending_cust_orders, orders_verbose)
-
-        # if any newly-issued customer orders mean quotes on the LOB need to be cancelled, kill them
-        if len(kills) > 0:
-            # if verbose : print('Kills: %s' % (kills))
-            for kill in kills:
-                # if verbose : print('lastquote=%s' % traders[kill].lastquote)
-                if traders[kill].lastquote is not None:
-                    # if verbose : print('Killing order %s' % (str(traders[kill].lastquote)))
-                    # NB if exchange.del_order() third argument = None then cancellations not written to tape file.
-                    # exchange.del_order(time, traders[kill].lastquote, tape_dump, sess_vrbs)
-                    exchange.del_order(time, traders[kill].lastquote, None, sess_vrbs)
-
-        # get a limit-order quote (or None) from a randomly chosen trader
-        tid = list(traders.keys())[random.randint(0, len(traders) - 1)]
-
-        order = traders[tid].getorder(time, time_left, exchange.publish_lob(time, lobframes, lob_verbose))
+    def session_checkpoint():
+        """
+        Write the whole state of the session to the checkpoint file, after getting all the output written so far
+        onto disk, so that on resuming the output files can be cut back to exactly this point.
+        :return: <nothing>
+        """
+        for fname in dump_files:
+            dump_files[fname].flush()
+        if async_writer is not None:
+            async_writer.sync()
+        # NB exchange, traders, popstats and dispatcher refer to one another, so they are pickled together in one state
+        state = {'checkpoint_version': 1, 'sess_id': sess_id, 'starttime': starttime, 'endtime': endtime,
+                 'trader_spec': trader_spec, 'dumpfile_flags': dumpfile_flags, 'sim_mode': sim_mode,
+                 'time': time, 'next_checkpoint': next_checkpoint, 'exchange': exchange, 'traders': traders,
+                 'trader_stats': trader_stats, 'popstats': popstats, 'dispatcher': dispatcher,
+                 'selector': selector, 'pending_cust_orders': pending_cust_orders,
+                 'frames_done': frames_done, 'random_state': random.getstate(),
+                 'lob_deltas': lobframes if isinstance(lobframes, LOBDeltaWriter) else None,
+                 'file_sizes': {fname: os.path.getsize(fname) for fname in dump_files}}
+        try:
+            # the order schedule can only be saved if it is picklable (e.g. no lambda offset functions)
+            # NB kept as pickled bytes, so that a schedule that can't be unpickled on resuming doesn't spoil the rest
+            state['order_schedule'] = pickle.dumps(order_schedule)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            state['order_schedule'] = None
+        checkpoint_write(checkpoint_fname, state)
+
+    def trader_turn(tid, t_now, t_left):
+        """
+        Give one trader the chance to issue an order, process it, and let all traders respond to what happened.
+        :param tid: the i.d. of the trader whose turn it is.
+        :param t_now: the current time.
+        :param t_left: how much time left, as a fraction of the session duration.
+        :return: None if the trader issued no order, otherwise a list of the traders whose customer orders may have
+            changed as a result: the trader itself, and the counterparties to any trade.
+        """
+        prof.sample(t_now)
+        t0 = clock()
+        lob = exchange.publish_lob(t_now, lobframes, lob_verbose)
+        t1 = clock()
+        prof.add('publish_lob', t1 - t0)
+        order = traders[tid].getorder(t_now, t_left, lob)
+        prof.add('getorder:' + traders[tid].ttype, clock() - t1)
         if sess_vrbs:
             print('trader=%s order=%s' % (tid, order))
 
-        if order is not None:
-            if order.otype == 'Ask' and order.price < traders[tid].orders[0].price:
-                sys.exit('Bad ask')
-            if order.otype == 'Bid' and order.price > traders[tid].orders[0].price:
-                sys.exit('Bad bid')
-            # send order to exchange
-            traders[tid].n_quotes = 1
-            trade = exchange.process_order(time, order, tape_dump, process_verbose)
-            if trade is not None:
-                # trade occurred,
-                # so the counterparties update order lists and blotters
-                traders[trade['party1']].bookkeep(time, trade, order, bookkeep_verbose)
-                traders[trade['party2']].bookkeep(time, trade, order, bookkeep_verbose)
-                if dumpfile_flags['dump_avgbals']:
-                    trade_stats(sess_id, traders, avg_bals, time, exchange.publish_lob(time, lobframes, lob_verbose))
-
-            # traders respond to whatever happened
-            lob = exchange.publish_lob(time, lobframes, lob_verbose)
-            any_record_frame = False
-            for t in traders:
-                # NB respond just updates trader's internal variables
-                # doesn't alter the LOB, so processing each trader in
-                # sequence (rather than random/shuffle) isn't a problem
-                record_frame = traders[t].respond(time, lob, trade, respond_verbose)
-                if record_frame:
-                    any_record_frame = True
-
-            # log all the PRSH/PRDE/ZIPSH strategy info for this timestep?
-            if any_record_frame and dumpfile_flags['dump_strats']:
-                # print one more frame to strategy dumpfile
-                dump_strats_frame(time, strat_dump, traders)
-                # record that we've written this frame
-                frames_done.add(int(time))
-
-        time = time + timestep
+        if order is None:
+            return None
+
+        if order.otype == 'Ask' and order.price < traders[tid].orders[0].price:
+            sys.exit('Bad ask')
+        if order.otype == 'Bid' and order.price > traders[tid].orders[0].price:
+            sys.exit('Bad bid')
+        # send order to exchange
+        traders[tid].n_quotes = 1
+        t0 = clock()
+        trade = exchange.process_order(t_now, order, tape_dump, process_verbose)
+        prof.add('process_order:' + traders[tid].ttype, clock() - t0)
+        if trade is not None:
+            # trade occurred,
+            # so the counterparties update order lists and blotters
+            prof.count('trades')
+            for party in (trade.party1, trade.party2):
+                t0 = clock()
+                traders[party].bookkeep(t_now, trade, order, bookkeep_verbose)
+                prof.add('bookkeep:' + traders[party].ttype, clock() - t0)
+            row_due = popstats.trade(traders[trade.party1].ttype, traders[trade.party2].ttype, t_now)
+            if dumpfile_flags['dump_avgbals'] and row_due:
+                t0 = clock()
+                trade_stats(sess_id, traders, avg_bals, t_now, exchange.publish_lob(t_now, lobframes, lob_verbose),
+                            popstats)
+                prof.add('trade_stats', clock() - t0)
+
+        # traders respond to whatever happened
+        t0 = clock()
+        lob = exchange.publish_lob(t_now, lobframes, lob_verbose)
+        t1 = clock()
+        prof.add('publish_lob', t1 - t0)
+        any_record_frame = dispatcher.dispatch(t_now, exchange, lob, trade, respond_verbose)
+        prof.add('respond', clock() - t1)
+
+        # log all the PRSH/PRDE/ZIPSH strategy info for this timestep?
+        if any_record_frame and dumpfile_flags['dump_strats']:
+            # print one more frame to strategy dumpfile
+            t0 = clock()
+            dump_strats_frame(t_now, strat_dump, traders)
+            prof.add('dump_strats_frame', clock() - t0)
+            # record that we've written this frame
+            frames_done.add(int(t_now))
+
+        if trade is None:
+            return [tid]
+        return [tid, trade.party1, trade.party2]
+
+    def issue_customer_order(cust_order):
+        """
+        Event-driven kernel: issue a customer order to its trader, cancelling the trader's quote on the LOB if need be.
+        :param cust_order: the customer order.
+        :return: <nothing>
+        """
+        t0 = clock()
+        tname = cust_order.tid
+        response = traders[tname].add_order(cust_order, orders_verbose)
+        t1 = clock()
+        prof.add('customer_orders', t1 - t0)
+        if response == 'LOB_Cancel' and traders[tname].lastquote is not None:
+            exchange.del_order(time, traders[tname].lastquote, None, sess_vrbs)
+            prof.add('kills', clock() - t1)
+
+    def strat_deadline(trdr):
+        """
+        Event-driven kernel: when will this trader next want to switch strategy?
+        :param trdr: the trader.
+        :return: the time of the trader's next strategy-switch deadline, or None if it doesn't switch strategies.
+        """
+        if trdr.ttype == 'PRSH':
+            oldest_start = min([s['start_t'] for s in trdr.strats])
+            return min(trdr.last_strat_change_time + trdr.strat_wait_time, oldest_start + trdr.strat_eval_time)
+        elif trdr.ttype in ('PRDE', 'ZIPSH') and trdr.strats is not None:
+            return trdr.strats[trdr.active_strat]['start_t'] + trdr.strat_wait_time
+        return None
+
+    if sim_mode == 'ticks':
+        # the original fixed-timestep kernel: on each timestep, poll one randomly chosen trader
+        # (or, with a trader_selection policy other than 'uniform', whichever traders the selector chooses)
+
+        while time < endtime:
+
+            if next_checkpoint is not None and time >= next_checkpoint:
+                session_checkpoint()
+                next_checkpoint += checkpoint_interval
+
+            # how much time left, as a percentage?
+            time_left = (endtime - time) / session_duration
+
+            if sess_vrbs:
+                print('\n\n%s; t=%08.2f (%4.1f/100) ' % (sess_id, time, time_left*100))
+
+            t0 = clock()
+            [pending_cust_orders, kills] = customer_orders(time, traders, trader_stats,
+                                                           order_schedule, pending_cust_orders, orders_verbose)
+            t1 = clock()
+            prof.add('customer_orders', t1 - t0)
+
+            # if any newly-issued customer orders mean quotes on the LOB need to be cancelled, kill them
+            if len(kills) > 0:
+                # if verbose : print('Kills: %s' % (kills))
+                for kill in kills:
+                    # if verbose : print('lastquote=%s' % traders[kill].lastquote)
+                    if traders[kill].lastquote is not None:
+                        # if verbose : print('Killing order %s' % (str(traders[kill].lastquote)))
+                        # NB if exchange.del_order() third argument = None then cancellations not written to tape file.
+                        # exchange.del_order(time, traders[kill].lastquote, tape_dump, sess_vrbs)
+                        exchange.del_order(time, traders[kill].lastquote, None, sess_vrbs)
+                prof.add('kills', clock() - t1)
+
+            # get a limit-order quote (or None) from the trader(s) chosen for this timestep
+            for tid in selector.due(time):
+                trader_turn(tid, time, time_left)
+
+            time = time + timestep
+
+    elif sim_mode == 'poll' or sim_mode == 'poisson':
+        # discrete-event kernel: a priority queue of timestamped events, so that idle intervals are skipped
+        # events are [time, seq, kind, payload] where seq breaks ties in order of scheduling, and kind is...
+        #   'order' => a customer order arrives at its trader (payload is the order);
+        #   'replenish' => the batch of pending customer orders is used up, so generate the next batch;
+        #   'wake' => (poisson mode only) a trader holding a customer order wakes up to take its turn;
+        #   'strat' => (poisson mode only) check whether a PRSH/PRDE/ZIPSH trader is due to switch strategy;
+        #   'end' => the session ends.
+        # In 'poll' mode traders are polled just as in the 'ticks' kernel -- one randomly chosen trader per timestep --
+        # but runs of timesteps where the chosen trader would hold no customer order are skipped over in one jump:
+        # the length of each run is drawn from the geometric distribution, so this is statistically equivalent.
+        # In 'poisson' mode each trader holding a customer order wakes up as a Poisson process, at the same
+        # average rate of once per second that it gets polled in the 'ticks' kernel.
+        events = []
+        event_seq = 0
+
+        def schedule(t_event, kind, payload):
+            """ Push an event onto the event queue """
+            nonlocal event_seq
+            heapq.heappush(events, [t_event, event_seq, kind, payload])
+            event_seq += 1
+
+        tids = list(traders.keys())
+        tid_index = {tid: i for i, tid in enumerate(tids)}
+        # traders holding customer orders, kept in the same order as tids (active_idx holds their indexes into tids),
+        # and (poisson mode) traders that have a wake-up event on the queue
+        active = [tid for tid in tids if len(traders[tid].orders) > 0]
+        active_idx = [tid_index[tid] for tid in active]
+        awake = set()
+        # traders that can give themselves customer orders whenever they respond
+        self_ordering = [tid for tid in tids if traders[tid].self_orders]
+
+        def update_active(changed):
+            """
+            Bring the list of active traders up to date after some traders' customer orders may have changed;
+            in poisson mode, give any newly active ones a wake-up event.
+            :param changed: the i.d.s of the traders whose customer orders may have changed.
+            :return: <nothing>
+            """
+            for i in sorted(set([tid_index[tid] for tid in changed])):
+                tid = tids[i]
+                k = bisect.bisect_left(active_idx, i)
+                listed = k < len(active_idx) and active_idx[k] == i
+                if len(traders[tid].orders) > 0:
+                    if not listed:
+                        active_idx.insert(k, i)
+                        active.insert(k, tid)
+                    if sim_mode == 'poisson' and tid not in awake:
+                        schedule(time + random.expovariate(1.0 / (n_traders * timestep)), 'wake', tid)
+                        awake.add(tid)
+                elif listed:
+                    del active_idx[k]
+                    del active[k]
+
+        schedule(time, 'replenish', None)
+        schedule(endtime, 'end', None)
+        if sim_mode == 'poisson':
+            for tid in tids:
+                if strat_deadline(traders[tid]) is not None:
+                    schedule(strat_deadline(traders[tid]), 'strat', tid)
+
+        tick = 0    # poll mode: index of the next timestep that hasn't yet been processed
+        while len(events) > 0:
+
+            if sim_mode == 'poll':
+                # first tick at which the next event gets dealt with (cf. customer_orders(): order.time < time)
+                evt_tick = int((events[0][0] - starttime) / timestep) + 1
+                if events[0][2] == 'end':
+                    evt_tick = int(math.ceil((endtime - starttime) / timestep))
+                if len(active) > 0:
+                    # how many idle timesteps before an active trader is chosen?
+                    p_active = len(active) / float(n_traders)
+                    if p_active >= 1.0:
+                        n_idle = 0
+                    else:
+                        n_idle = int(math.log(1.0 - random.random()) / math.log(1.0 - p_active))
+                    if tick + n_idle < evt_tick:
+                        tick = tick + n_idle
+                        time = starttime + tick * timestep
+                        time_left = (endtime - time) / session_duration
+                        tid = active[random.randint(0, len(active) - 1)]
+                        changed = trader_turn(tid, time, time_left)
+                        if changed is not None:
+                            update_active(changed + self_ordering)
+                        tick += 1
+                        continue
+                # nothing happens before the next event: jump straight to it
+                tick = max(tick, evt_tick)
+                time = starttime + tick * timestep
+                while len(events) > 0 and (events[0][0] < time or events[0][2] == 'end'):
+                    [t_event, seq, kind, payload] = heapq.heappop(events)
+                    if kind == 'end':
+                        events = []
+                    elif kind == 'order':
+                        issue_customer_order(payload)
+                        update_active([payload.tid])
+                    elif kind == 'replenish':
+                        t0 = clock()
+                        [new_pending, kills] = customer_orders(time, traders, trader_stats,
+                                                               order_schedule, [], orders_verbose)
+                        prof.add('customer_orders', clock() - t0)
+                        for cust_order in new_pending:
+                            schedule(cust_order.time, 'order', cust_order)
+                        if new_pending:
+                            schedule(max([o.time for o in new_pending]), 'replenish', None)
+                if len(events) > 0:
+                    if time < endtime:
+                        # and this timestep's randomly chosen trader takes its turn, as in the 'ticks' kernel
+                        tid = tids[random.randint(0, n_traders - 1)]
+                        changed = trader_turn(tid, time, (endtime - time) / session_duration)
+                        if changed is not None:
+                            update_active(changed + self_ordering)
+                    tick += 1
+
+            else:
+                # poisson mode: continuous time, just process the next event
+                [time, seq, kind, payload] = heapq.heappop(events)
+                if sess_vrbs:
+                    print('\n\n%s; t=%08.2f event=%s %s' % (sess_id, time, kind, payload))
+                if kind == 'end':
+                    break
+                elif kind == 'order':
+                    issue_customer_order(payload)
+                    update_active([payload.tid])
+                elif kind == 'replenish':
+                    t0 = clock()
+                    [new_pending, kills] = customer_orders(time, traders, trader_stats,
+                                                           order_schedule, [], orders_verbose)
+                    prof.add('customer_orders', clock() - t0)
+                    for cust_order in new_pending:
+                        schedule(cust_order.time, 'order', cust_order)
+                    if new_pending:
+                        schedule(max([o.time for o in new_pending]), 'replenish', None)
+                elif kind == 'wake':
+                    awake.discard(payload)
+                    changed = None
+                    if len(traders[payload].orders) > 0:
+                        changed = trader_turn(payload, time, (endtime - time) / session_duration)
+                    if changed is None:
+                        update_active([payload])
+                    else:
+                        update_active(changed + self_ordering)
+                elif kind == 'strat':
+                    trader = traders[payload]
+                    deadline = strat_deadline(trader)
+                    if time >= deadline:
+                        # this trader is due to switch strategy: let it respond to the (unchanged) market
+                        lob = exchange.publish_lob(time, lobframes, lob_verbose)
+                        if trader.respond(time, lob, None, respond_verbose) and dumpfile_flags['dump_strats']:
+                            dump_strats_frame(time, strat_dump, traders)
+                            frames_done.add(int(time))
+                        deadline = strat_deadline(trader)
+                    schedule(max(deadline, time + timestep), 'strat', payload)
+
+    else:
+        sys.exit('FAIL: unknown sim_mode=%s in market_session' % sim_mode)
 
     # session has ended
 
     # write trade_stats for this session (NB could use this to write end-of-session summary only)
     if dumpfile_flags['dump_avgbals']:
-        trade_stats(sess_id, traders, avg_bals, time, exchange.publish_lob(time, lobframes, lob_verbose))
+        t0 = clock()
+        trade_stats(sess_id, traders, avg_bals, time, exchange.publish_lob(time, lobframes, lob_verbose), popstats)
+        prof.add('trade_stats', clock() - t0)
         avg_bals.close()
 
     if dumpfile_flags['dump_blotters']:
         # record the blotter for each trader
+        t0 = clock()
         blotter_dump(sess_id, traders)
+        prof.add('blotter_dump', clock() - t0)
 
     if dumpfile_flags['dump_strats']:
         strat_dump.close()
@@ -3210,6 +6362,482 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
     if dumpfile_flags['dump_lobs']:
         lobframes.close()
 
+    if dumpfile_flags['dump_tape']:
+        tape_dump.close()
+
+    if spill_dump is not None:
+        spill_dump.close()
+
+    if async_writer is not None:
+        # wait for the writer thread to finish writing, and syncing, all the files
+        async_writer.close()
+
+    if isinstance(prof, SessionProfile):
+        # write the summary of where the time went in this session
+        prof_dump = open(sess_id + '_profile.csv', 'w')
+        prof.summary_dump(prof_dump, sess_id)
+        prof_dump.close()
+        if prof_samples is not None:
+            prof_samples.close()
+
+    tracer.close()
+
+    if os.path.exists(checkpoint_fname):
+        # the session is done, so there's nothing to resume
+        os.remove(checkpoint_fname)
+
+
+def market_session_resume(checkpoint_fname, order_schedule=None, sess_vrbs=False):
+    """
+    Carry on a market session from a checkpoint written by market_session() (see dumpfile_flags['checkpoint_interval']),
+    e.g. after a crash: the session continues exactly as it would have done had it never stopped.
+    :param checkpoint_fname: the checkpoint file.
+    :param order_schedule: the session's order schedule; if None, the one saved in the checkpoint is used (if it could
+            be saved: order schedules with unpicklable offset functions, e.g. lambdas, have to be given here).
+    :param sess_vrbs: verbosity: if True, output a running commentary on what is going on; if False, stay silent.
+    :return: <nothing>.
+    """
+    state = checkpoint_read(checkpoint_fname)
+    if order_schedule is None:
+        try:
+            order_schedule = pickle.loads(state['order_schedule'])
+        except (pickle.UnpicklingError, AttributeError, TypeError, ImportError):
+            sys.exit('FAIL: order schedule not usable from %s, it must be given to market_session_resume()'
+                     % checkpoint_fname)
+    market_session(state['sess_id'], state['starttime'], state['endtime'], state['trader_spec'], order_schedule,
+                   state['dumpfile_flags'], sess_vrbs, state['sim_mode'], resume=state)
+
+
+# the per-trial data-files that run_trials() knows how to merge, and whether each line needs the trial_id prepending
+# (the avg_balance and profile lines already start with the session id, all the others don't)
+trial_merge_files = [('_avg_balance.csv', False), ('_tape.csv', True), ('_blotters.csv', True), ('_strats.csv', True),
+                     ('_profile.csv', False)]
+# the per-trial columnar data-files that run_trials() merges: the merged file gets an extra first column, 'trial'
+trial_merge_columnar = ['_tape.bcol', '_blotters.bcol']
+
+
+def trial_seed(base_seed, trial_n):
+    """
+    Derive a reproducible seed for one trial from the base seed, so that any trial can be rerun on its own.
+    :param base_seed: the seed for the whole batch of trials.
+    :param trial_n: this trial's position in the batch (0, 1, 2...).
+    :return: the integer seed for this trial.
+    """
+    return random.Random('%d/%d' % (base_seed, trial_n)).getrandbits(32)
+
+
+def trial_worker(trial):
+    """
+    Run a single trial (i.e. one market session) in whichever process this is called from.
+    Failures are caught here and reported back rather than raised, so that one broken trial (including a trader
+    that calls sys.exit()) doesn't take down the rest of the batch.
+    The trial reseeds the random module, so the caller's RNG state is saved beforehand and put back afterwards.
+    :param trial: dictionary specifying the trial: see run_trials() for the keys.
+    :return: dictionary summarising the outcome: trial_id, sess_id, seed, ok, error, and wall-clock duration.
+    """
+    outcome = {'trial_id': trial['trial_id'], 'sess_id': trial['sess_id'], 'seed': trial['seed'],
+               'ok': False, 'error': None, 'walltime': None}
+    random_state = random.getstate()
+    random.seed(trial['seed'])
+    wall_start = chrono.time()
+    try:
+        market_session(trial['sess_id'], trial['starttime'], trial['endtime'], trial['trader_spec'],
+                       trial['order_schedule'], trial['dumpfile_flags'], trial['verbose'], trial['sim_mode'])
+        outcome['ok'] = True
+    except SystemExit as e:
+        outcome['error'] = 'SystemExit: %s' % str(e.code)
+    except Exception as e:
+        outcome['error'] = '%s: %s' % (type(e).__name__, str(e))
+    # if the session failed part-way, make sure that whatever it wrote gets flushed
+    async_writers_close()
+    outcome['walltime'] = chrono.time() - wall_start
+    random.setstate(random_state)
+    return outcome
+
+
+def trial_failed(trial, error):
+    """
+    The outcome of a trial that didn't get to report back, e.g. because its worker process died.
+    :param trial: dictionary specifying the trial.
+    :param error: description of what went wrong.
+    :return: outcome dictionary, as for trial_worker().
+    """
+    return {'trial_id': trial['trial_id'], 'sess_id': trial['sess_id'], 'seed': trial['seed'],
+            'ok': False, 'error': error, 'walltime': None}
+
+
+def merge_trial_files(outcomes, merge_prefix):
+    """
+    Concatenate the per-trial data-files of a batch of trials into one file per type, named merge_prefix+suffix.
+    Columnar files (see trial_merge_columnar) are merged into a columnar file with an extra 'trial' column.
+    Trials that failed, or that didn't write a given file, are skipped.
+    :param outcomes: the list of trial outcomes returned by run_trials(), in trial order.
+    :param merge_prefix: path/prefix for the merged files.
+    :return: list of the merged filenames that were written.
+    """
+    merged = []
+    for suffix, prepend_id in trial_merge_files:
+        sources = [o for o in outcomes if o['ok'] and
+                   any(os.path.isfile(o['sess_id'] + suffix + ext) for ext in [''] + list(sink_suffixes.values()))]
+        if len(sources) == 0:
+            continue
+        with open(merge_prefix + suffix, 'w') as mergefile:
+            for o in sources:
+                # NB the trial's file may have been written compressed
+                with sink_read_open(o['sess_id'] + suffix) as trialfile:
+                    for line in trialfile:
+                        if prepend_id:
+                            mergefile.write('%s, %s' % (o['trial_id'], line))
+                        else:
+                            mergefile.write(line)
+        merged.append(merge_prefix + suffix)
+    for suffix in trial_merge_columnar:
+        sources = [o for o in outcomes if o['ok'] and os.path.isfile(o['sess_id'] + suffix)]
+        if len(sources) == 0:
+            continue
+        mergefile = None
+        for o in sources:
+            trialfile = ColumnarReader(o['sess_id'] + suffix)
+            if mergefile is None:
+                mergefile = ColumnarWriter(merge_prefix + suffix, trialfile.schema,
+                                           [['trial', 's']] + trialfile.columns)
+            names = [column[0] for column in trialfile.columns]
+            for record in trialfile.rows():
+                mergefile.append([o['trial_id']] + [record[name] for name in names])
+            trialfile.close()
+        mergefile.close()
+        merged.append(merge_prefix + suffix)
+    return merged
+
+
+def run_trials(trials, n_workers=None, base_seed=None, outdir=None, merge_prefix=None, vrbs=False):
+    """
+    Run a batch of independent trials (market sessions), fanned out across a pool of worker processes.
+    Each trial is a dictionary with keys 'trial_id', 'starttime', 'endtime', 'trader_spec', 'order_schedule' and
+    'dumpfile_flags', plus optionally 'sim_mode' (default 'ticks'), 'verbose' (default False), and 'seed'.
+    Every trial gets its own reproducible seed (unless one is given explicitly) and writes its data-files under its
+    own prefix, so trials can't clobber each other's output: rerunning a trial with the same seed gives the same output
+    whatever the number of workers.
+    If a worker process dies (e.g. killed for running out of memory), the trials it may have been running are rerun one
+    at a time, each in a worker of its own, so that only the trial that kills its worker is recorded as failed.
+    :param trials: list of trial-specification dictionaries.
+    :param n_workers: how many worker processes to use; None means one per CPU; 1 means run in this process.
+    :param base_seed: seed from which per-trial seeds are derived; if None, one is drawn from the current RNG.
+    :param outdir: if not None, directory that all the per-trial data-files are written into.
+    :param merge_prefix: if not None, merge the per-trial data-files into files with this prefix once all are done.
+    :param vrbs: if True then print a line as each trial finishes.
+    :return: list of trial outcomes (dictionaries, see trial_worker()), in the same order as trials.
+    """
+    if base_seed is None:
+        base_seed = random.getrandbits(32)
+
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+
+    jobs = []
+    for trial_n, trial in enumerate(trials):
+        job = dict(trial)
+        job.setdefault('sim_mode', 'ticks')
+        job.setdefault('verbose', False)
+        if job.get('seed') is None:
+            job['seed'] = trial_seed(base_seed, trial_n)
+        if outdir is None:
+            job['sess_id'] = job['trial_id']
+        else:
+            job['sess_id'] = os.path.join(outdir, job['trial_id'])
+        jobs.append(job)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(jobs))
+
+    outcomes = []
+    if n_workers <= 1:
+        for job in jobs:
+            outcomes.append(trial_worker(job))
+            if vrbs:
+                print('trial %s: ok=%s error=%s' % (outcomes[-1]['trial_id'], outcomes[-1]['ok'], outcomes[-1]['error']))
+    else:
+        # a worker process that dies breaks the whole pool, failing every trial that hadn't yet finished
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(trial_worker, job) for job in jobs]
+            for job, future in zip(jobs, futures):
+                try:
+                    outcome = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    # rerun this trial in a pool of its own, to find out whether it was the one that broke the pool
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as rerun_pool:
+                        try:
+                            outcome = rerun_pool.submit(trial_worker, job).result()
+                        except concurrent.futures.process.BrokenProcessPool:
+                            outcome = trial_failed(job, 'BrokenProcessPool: worker process died')
+                outcomes.append(outcome)
+                if vrbs:
+                    print('trial %s: ok=%s error=%s' % (outcome['trial_id'], outcome['ok'], outcome['error']))
+
+    if merge_prefix is not None:
+        merge_trial_files(outcomes, merge_prefix)
+
+    return outcomes
+
+
+# sidecar cache files for price-offset event-lists read from CSV files
+offset_cache_magic = b'BSEOFS01'
+offset_cache_suffix = '.offcache'
+
+
+def offset_csv_parse(filename, col_t, col_p, first_row_is_header=True):
+    """
+    Parse a CSV file of timestamped prices, e.g. a real-world price series used as a schedule price-offset.
+    Timestamps are assumed to be 'YYYY-MM-DD HH:MM:SS...' (or with a 'T' separator); anything after the seconds
+    is ignored. The timestamps are converted in one go rather than with a strptime() call per row.
+    :param filename: the CSV file to read.
+    :param col_t: column in the CSV that has the time data.
+    :param col_p: column in the CSV that has the price data.
+    :param first_row_is_header: if True, the first row is skipped.
+    :return: [dates, secs, prices]: each row's date string, its time in seconds since the start of the first date,
+             and its price.
+    """
+    tstamps = []
+    prices = []
+    with open(filename, 'r', newline='') as csv_file:
+        rwd_csv = csv.reader(csv_file)
+        if first_row_is_header:
+            next(rwd_csv, None)
+        for line in rwd_csv:
+            tstamps.append(line[col_t])
+            # delete any commas so 1,000,000 becomes 1000000
+            prices.append(float(line[col_p].replace(',', '')))
+
+    if len(tstamps) == 0:
+        sys.exit('FAIL: no data rows in price-offset file %s' % filename)
+
+    dates = [tstamp[:10] for tstamp in tstamps]
+    if numpy is not None:
+        tstamps64 = numpy.array([date + 'T' + tstamp[11:19] for date, tstamp in zip(dates, tstamps)],
+                                dtype='datetime64[s]')
+        secs = (tstamps64 - tstamps64.astype('datetime64[D]')[0]).astype(numpy.float64).tolist()
+    else:
+        # dates repeat a lot, so only convert each distinct one
+        day_ordinals = {}
+        first_ordinal = None
+        secs = []
+        for date, tstamp in zip(dates, tstamps):
+            ordinal = day_ordinals.get(date)
+            if ordinal is None:
+                ordinal = datetime.strptime(date, '%Y-%m-%d').toordinal()
+                day_ordinals[date] = ordinal
+            if first_ordinal is None:
+                first_ordinal = ordinal
+            secs.append(float((ordinal - first_ordinal) * 86400 +
+                              int(tstamp[11:13]) * 3600 + int(tstamp[14:16]) * 60 + int(tstamp[17:19])))
+
+    return [dates, secs, prices]
+
+
+def offset_events_normalise(secs, prices, scale_factor):
+    """
+    Turn a time-series of prices into a price-offset event-list: times are normalised to fractions of the
+    series' duration, prices are normalised to the series' price range and then scaled to integers.
+    :param secs: the times, in seconds, in increasing order.
+    :param prices: the prices.
+    :param scale_factor: multiplier on the normalised prices.
+    :return: the event-list: one [fraction of time elapsed, integer offset value] item per price.
+    """
+    minprice = min(prices)
+    pricerange = max(prices) - minprice
+    starttime = secs[0]
+    endtime = float(secs[-1] - starttime)
+    if endtime <= 0:
+        sys.exit('FAIL: price-offset series has zero duration')
+
+    offsetfn_eventlist = []
+    for t, p in zip(secs, prices):
+        # normalise price (a flat series is all zero offset) & clip
+        normld_price = 0.0 if pricerange == 0 else (p - minprice) / pricerange
+        normld_price = max(0.0, min(normld_price, 1.0))
+        # scale & convert to integer cents
+        offsetfn_eventlist.append([(t - starttime) / endtime, int(round(normld_price * scale_factor))])
+    return offsetfn_eventlist
+
+
+def offset_cache_write(cache_name, key, series):
+    """
+    Write price-offset event-lists to a binary sidecar file: the magic bytes, a uint32 length, a JSON header
+    giving the cache key and each series' label and length, then each series' times (float64) and offsets (int64).
+    The file is written under a temporary name and then renamed, so concurrent trials never see a partial file.
+    :param cache_name: the sidecar filename.
+    :param key: the cache key string.
+    :param series: list of [label, event-list] pairs.
+    :return: True if the file was written, False if it couldn't be (e.g. a read-only directory).
+    """
+    header = {'key': key, 'byteorder': sys.byteorder, 'series': [[label, len(events)] for label, events in series]}
+    header = json.dumps(header).encode()
+    header += b' ' * columnar_pad(len(offset_cache_magic) + 4 + len(header))
+    tmp_name = '%s.%d.tmp' % (cache_name, os.getpid())
+    try:
+        with open(tmp_name, 'wb') as cache_file:
+            cache_file.write(offset_cache_magic + struct.pack('<I', len(header)) + header)
+            for label, events in series:
+                array('d', [event[0] for event in events]).tofile(cache_file)
+                array('q', [event[1] for event in events]).tofile(cache_file)
+        os.replace(tmp_name, cache_name)
+    except OSError:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        return False
+    return True
+
+
+def offset_cache_read(cache_name, key):
+    """
+    Read price-offset event-lists back from a binary sidecar file written by offset_cache_write().
+    :param cache_name: the sidecar filename.
+    :param key: the cache key string: the sidecar is only used if it was written with the same key.
+    :return: list of [label, event-list] pairs, or None if there's no usable sidecar.
+    """
+    try:
+        with open(cache_name, 'rb') as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+    if data[:len(offset_cache_magic)] != offset_cache_magic:
+        return None
+    pos = len(offset_cache_magic)
+    header_len = struct.unpack_from('<I', data, pos)[0]
+    pos += 4
+    header = json.loads(data[pos:pos + header_len].decode())
+    pos += header_len
+    if header['key'] != key:
+        return None
+
+    series = []
+    for label, n in header['series']:
+        times = array('d')
+        times.frombytes(data[pos:pos + 8 * n])
+        pos += 8 * n
+        offsets = array('q')
+        offsets.frombytes(data[pos:pos + 8 * n])
+        pos += 8 * n
+        if header['byteorder'] != sys.byteorder:
+            times.byteswap()
+            offsets.byteswap()
+        series.append([label, [[t, offset] for t, offset in zip(times, offsets)]])
+    return series
+
+
+def offset_file_events(filename, col_t, col_p, scale_factor=75, days='first', cache=True, vrbs=False):
+    """
+    Read a CSV data-file for the supply/demand schedule time-varying price-offset value, via a binary sidecar cache.
+    The sidecar is named filename+offset_cache_suffix and is keyed on a hash of the file's contents and on the
+    other arguments, so repeated launches on the same file skip the CSV parse; if the file or the arguments
+    change, the sidecar is rebuilt.
+    :param filename: the CSV file to read.
+    :param col_t: column in the CSV that has the time data.
+    :param col_p: column in the CSV that has the price data.
+    :param scale_factor: multiplier on prices.
+    :param days: how to treat files that span more than one calendar date...
+                 'first' => only use the first date's data (the original behaviour);
+                 'each' => normalise each date separately;
+                 'continuous' => treat the whole file as one series running across the dates.
+    :param cache: if True, read/write the sidecar; if False, always parse the CSV.
+    :param vrbs: if True then print a running commentary.
+    :return: for days='first' or 'continuous', an offset value event-list: one item for each change in offset
+             value, each item is fraction of time elapsed followed by the new offset value at that time;
+             for days='each', a dictionary of event-lists keyed by date string, in date order.
+    """
+    if days not in ('first', 'each', 'continuous'):
+        sys.exit('FAIL: bad days=%s in offset_file_events()' % days)
+
+    cache_name = filename + offset_cache_suffix
+    key = None
+    series = None
+    if cache:
+        file_hash = hashlib.sha1()
+        with open(filename, 'rb') as data_file:
+            for block in iter(functools.partial(data_file.read, 1 << 20), b''):
+                file_hash.update(block)
+        key = '%s:%r:%d:%d:%s' % (file_hash.hexdigest(), scale_factor, col_t, col_p, days)
+        series = offset_cache_read(cache_name, key)
+        if vrbs and series is not None:
+            print('offset_file_events(): read %s' % cache_name)
+
+    if series is None:
+        [dates, secs, prices] = offset_csv_parse(filename, col_t, col_p)
+        if days == 'continuous':
+            series = [['all', offset_events_normalise(secs, prices, scale_factor)]]
+        else:
+            # group the rows by date, in order of each date's first appearance
+            by_date = {}
+            for date, t, p in zip(dates, secs, prices):
+                if date not in by_date:
+                    if days == 'first' and len(by_date) > 0:
+                        continue
+                    by_date[date] = [[], []]
+                by_date[date][0].append(t)
+                by_date[date][1].append(p)
+            series = [[date, offset_events_normalise(t_p[0], t_p[1], scale_factor)]
+                      for date, t_p in by_date.items()]
+        if cache:
+            written = offset_cache_write(cache_name, key, series)
+            if vrbs:
+                print('offset_file_events(): parsed %s, sidecar written=%s' % (filename, written))
+
+    if vrbs:
+        for label, events in series:
+            print('%s: %d events, offsets %d..%d' % (label, len(events),
+                                                     min(e[1] for e in events), max(e[1] for e in events)))
+
+    if days == 'each':
+        return {label: events for label, events in series}
+    return series[0][1]
+
+
+class OffsetFunction:
+    """
+    A time-varying schedule price-offset, compiled from an offset event-list (e.g. from offset_file_events()) into
+    sorted arrays, so that each lookup is a binary search rather than a walk along the whole list.
+    An instance is callable, so it can go straight into a supply/demand schedule range as (offsetfn, []).
+    As in the original event-list walk, the offset at time t is the value of the first event whose time is later
+    than t's fraction of final_time, or the last event's value if there's no such event.
+    """
+
+    def __init__(self, offset_events, final_time):
+        """
+        :param offset_events: the offset event-list: one [fraction of time elapsed, offset value] item per change.
+        :param final_time: the final time (the end-time) of the session: event times are fractions of this.
+        """
+        if len(offset_events) < 1:
+            sys.exit('FAIL: empty offset event-list in OffsetFunction')
+        self.final_time = float(final_time)
+        self.times = array('d', [event[0] for event in offset_events])
+        self.offsets = array('q', [event[1] for event in offset_events])
+        self.last = len(self.offsets) - 1
+        self.np_times = None
+        self.np_offsets = None
+        if numpy is not None:
+            self.np_times = numpy.frombuffer(self.times, dtype=numpy.float64)
+            self.np_offsets = numpy.frombuffer(self.offsets, dtype=numpy.int64)
+
+    def __call__(self, time):
+        """
+        :param time: the current time.
+        :return: integer price offset value at that time.
+        """
+        return self.offsets[min(bisect.bisect_right(self.times, time / self.final_time), self.last)]
+
+    def offsets_at(self, times):
+        """
+        Vectorised lookup, e.g. for pricing a whole batch of customer orders in one go.
+        :param times: sequence of times.
+        :return: list of integer price offset values, one per time.
+        """
+        if self.np_times is not None:
+            percent_elapsed = numpy.asarray(times, dtype=numpy.float64) / self.final_time
+            indices = numpy.minimum(numpy.searchsorted(self.np_times, percent_elapsed, side='right'), self.last)
+            return self.np_offsets[indices].tolist()
+        return [self(time) for time in times]
+
 
 #############################
 # # Below here is where we set up and run a whole series of experiments
@@ -3231,117 +6859,20 @@ if __name__ == "__main__":
     duration = end_time - start_time
 
 
-    def schedule_offsetfn_read_file(filename, col_t, col_p, scale_factor=75):
+    def schedule_offsetfn_read_file(filename, col_t, col_p, scale_factor=75, days='first'):
         """
         Read in a CSV data-file for the supply/demand schedule time-varying price-offset value
         :param filename: the CSV file to read
         :param col_t: column in the CSV that has the time data
         :param col_p: column in the CSV that has the price data
         :param scale_factor: multiplier on prices
+        :param days: 'first', 'each', or 'continuous': see offset_file_events()
         :return: on offset value event-list: one item for each change in offset value
                 -- each item is percentage time elapsed, followed by the new offset value at that time
         """
-        
-        vrbs = True
-        
-        # does two passes through the file
-        # assumes data file is all for one date, sorted in time order, in correct format, etc. etc.
-        rwd_csv = csv.reader(open(filename, 'r'))
-        
-        # first pass: get time & price events, find out how long session is, get min & max price
-        minprice = None
-        maxprice = None
-        firsttimeobj = None
-        timesincestart = 0
-        priceevents = []
-        
-        first_row_is_header = True
-        this_is_first_row = True
-        this_is_first_data_row = True
-        first_date = None
-        
-        for line in rwd_csv:
-            
-            if vrbs:
-                print(line)
-            
-            if this_is_first_row and first_row_is_header:
-                this_is_first_row = False
-                this_is_first_data_row = True
-                continue
-                
-            row_date = line[col_t][:10]
-            
-            if this_is_first_data_row:
-                first_date = row_date
-                this_is_first_data_row = False
-                
-            if row_date != first_date:
-                continue
-                
-            time = line[col_t][11:19]
-            if firsttimeobj is None:
-                firsttimeobj = datetime.strptime(time, '%H:%M:%S')
-                
-            timeobj = datetime.strptime(time, '%H:%M:%S')
-            
-            price_str = line[col_p]
-            # delete any commas so 1,000,000 becomes 1000000
-            price_str_no_commas = price_str.replace(',', '')
-            price = float(price_str_no_commas)
-            
-            if minprice is None or price < minprice:
-                minprice = price
-            if maxprice is None or price > maxprice:
-                maxprice = price
-            timesincestart = (timeobj - firsttimeobj).total_seconds()
-            priceevents.append([timesincestart, price])
-            
-            if vrbs:
-                print(row_date, time, timesincestart, price)
-            
-        # second pass: normalise times to fractions of entire time-series duration
-        #              & normalise price range
-        pricerange = maxprice - minprice
-        endtime = float(timesincestart)
-        offsetfn_eventlist = []
-        for event in priceevents:
-            # normalise price
-            normld_price = (event[1] - minprice) / pricerange
-            # clip
-            normld_price = min(normld_price, 1.0)
-            normld_price = max(0.0, normld_price)
-            # scale & convert to integer cents
-            price = int(round(normld_price * scale_factor))
-            normld_event = [event[0] / endtime, price]
-            if vrbs:
-                print(normld_event)
-            offsetfn_eventlist.append(normld_event)
-        
-        return offsetfn_eventlist
-
 
-    def schedule_offsetfn_from_eventlist(time, params):
-        """
-        Returns a price offset-value for the current time, by reading from an offset event-list.
-        :param time: the current time
-        :param params: a list of parameter values...
-            params[1] is the final time (the end-time) of the current session.
-            params[2] is the offset event-list: one item for each change in offset value
-                        -- each item is percentage time elapsed, followed by the new offset value at that time
-        :return: integer price offset value
-        """
-
-        final_time = float(params[0])
-        offset_events = params[1]
-        # this is quite inefficient: on every call it walks the event-list
-        percent_elapsed = time/final_time
-        offset = None
-        for event in offset_events:
-            offset = event[1]
-            if percent_elapsed < event[0]:
-                break
-        return offset
+        # the parsed & normalised event-list is cached in a binary sidecar next to the CSV file
+        return offset_file_events(filename, col_t, col_p, scale_factor=scale_factor, days=days, vrbs=False)
 
 
     def schedule_offsetfn_increasing_sinusoid(t, params):
@@ -3376,12 +6907,15 @@ if __name__ == "__main__":
     if price_offset_filename is not None:
         offsetfn_events = schedule_offsetfn_read_file(price_offset_filename, 0, 1)
 
+    # the event-list is compiled into an OffsetFunction, which looks up offsets by binary search
+    offsetfn = OffsetFunction(offsetfn_events, end_time)
+
     # supply schedule (defines the supply curve)
-    range1 = (75, 110, (schedule_offsetfn_from_eventlist, [[end_time, offsetfn_events]]))
+    range1 = (75, 110, (offsetfn, []))
     supply_schedule = [{'from': start_time, 'to': end_time, 'ranges': [range1], 'stepmode': 'random'}]
 
     # demand schedule (defines the demand curve)
-    range2 = (125, 90, (schedule_offsetfn_from_eventlist, [[end_time, offsetfn_events]]))
+    range2 = (125, 90, (offsetfn, []))
     demand_schedule = [{'from': start_time, 'to': end_time, 'ranges': [range2], 'stepmode': 'random'}]
 
     # new customer orders arrive at each trader approx once every order_interval seconds
@@ -3402,6 +6936,10 @@ if __name__ == "__main__":
     # n_recorded is how many trials (i.e. market sessions) to write full data-files for
     n_trials_recorded = 5
 
+    # n_workers is how many trials to run in parallel: None means use one worker process per CPU
+    n_workers = 1
+
+    trials = []
     trial = 1
 
     while trial < (n_trials+1):
@@ -3429,13 +6967,20 @@ if __name__ == "__main__":
         else:
             # we're still recording all the required data-files
             dump_flags = {'dump_blotters': True, 'dump_lobs': False, 'dump_strats': True,
-                          'dump_avgbals': True, 'dump_tape': True}
+                          'dump_avgbals': True, 'dump_tape': True, 'dump_async': True, 'fsync_interval': 10}
 
-        # simulate the market session
-        market_session(trial_id, start_time, end_time, traders_spec, order_sched, dump_flags, verbose)
+        trials.append({'trial_id': trial_id, 'starttime': start_time, 'endtime': end_time,
+                       'trader_spec': traders_spec, 'order_schedule': order_sched,
+                       'dumpfile_flags': dump_flags, 'verbose': verbose})
 
         trial = trial + 1
 
+    # simulate the market sessions
+    trial_outcomes = run_trials(trials, n_workers, vrbs=verbose)
+    for outcome in trial_outcomes:
+        if not outcome['ok']:
+            print('Trial %s failed: %s' % (outcome['trial_id'], outcome['error']))
+
     # The code in comments below here is for illustration, in case you want to do an exhaustive sweep of all possible
     # combinations of some set of trading strategies: if its of no interest, it can be deleted.
     #
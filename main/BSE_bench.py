@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# BSE_bench: benchmark suite for the Bristol Stock Exchange (BSE.py)
+#
+# Measures:
+#   (a) throughput of the matching engine -- Exchange.add_order(), del_order(), process_order() -- at a range of
+#       book depths, for each of the LOB implementations;
+#   (b) latency of Exchange.publish_lob() at the same range of book depths;
+#   (c) end-to-end speed of market_session(), in simulated seconds per wall-clock second, for the standard
+#       SHVR/GVWY/ZIC/ZIP + PT1/PT2 trader mix scaled to a range of population sizes.
+#
+# Results are written as JSON; a previous results file can be given as a baseline, in which case each result is
+# compared with the baseline value and the run FAILs if any result is worse than the baseline by more than the
+# tolerance. Typical use:
+#
+#       python BSE_bench.py --out baseline.json
+#       ...make some changes to BSE.py...
+#       python BSE_bench.py --out new.json --compare baseline.json
+#
+
+import sys
+import os
+import io
+import json
+import time as chrono
+import random
+import platform
+import argparse
+import contextlib
+from datetime import datetime
+
+import BSE
+
+
+# book depths (number of orders resting on each side) used for the matching-engine benchmarks
+bench_depths = [10, 100, 1000, 10000, 100000]
+
+# population sizes (total number of buyers+sellers) used for the end-to-end session benchmarks,
+# and the session duration (simulated seconds) for each: larger populations get shorter sessions
+bench_populations = [50, 500, 5000, 50000]
+bench_session_secs = {50: 600.0, 500: 60.0, 5000: 6.0, 50000: 1.0}
+
+# the reduced set of sizes used with --quick
+quick_depths = [10, 1000, 10000]
+quick_populations = [50, 500]
+
+
+def bench_record(name, value, unit, higher_is_better, params):
+    """
+    Wrap up a single benchmark result.
+    :param name: unique name for this result, used to match it against the baseline.
+    :param value: the measured value.
+    :param unit: units of the measured value.
+    :param higher_is_better: True if bigger values are better (e.g. throughput), False if not (e.g. latency).
+    :param params: dictionary of the parameters that produced this result.
+    :return: the result record (a dictionary).
+    """
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': higher_is_better, 'params': params}
+
+
+def fill_book(exchange, depth, rng):
+    """
+    Put depth non-crossing orders on each side of the exchange's book: bids priced 1-99, asks priced 101-199.
+    :param exchange: the exchange to fill.
+    :param depth: how many orders to put on each side.
+    :param rng: random.Random instance used to draw the prices.
+    :return: <nothing>
+    """
+    for i in range(depth):
+        exchange.add_order(BSE.Order('B%06d' % i, 'Bid', rng.randint(1, 99), 1, 0.0, None), False)
+        exchange.add_order(BSE.Order('S%06d' % i, 'Ask', rng.randint(101, 199), 1, 0.0, None), False)
+
+
+def bench_book(lob_impl, depth, n_ops, repeats):
+    """
+    Benchmark the matching engine, with depth orders on each side of the book.
+    add_order: add n_ops non-crossing orders; del_order: delete them again;
+    process_order: alternately send a bid that lifts the best ask and an ask that replenishes the ask side,
+    so that the depth of the book stays constant.
+    publish_lob: latency of publish_lob() after a change to the book, both with and without materialising the
+    full 'lob' lists of each side (which traders such as PT1/PT2 do, and most traders don't).
+    :param lob_impl: which LOB implementation the exchange should use ('dict' or 'ladder').
+    :param depth: how many orders are resting on each side of the book.
+    :param n_ops: how many operations to time.
+    :param repeats: number of repeats: the best of these is reported.
+    :return: list of result records.
+    """
+    best = {'add_order': None, 'del_order': None, 'process_order': None, 'publish_lob': None, 'publish_lob_full': None}
+
+    for r in range(repeats):
+        rng = random.Random(r)
+        exchange = BSE.Exchange(lob_impl=lob_impl)
+        fill_book(exchange, depth, rng)
+
+        # add_order
+        orders = [BSE.Order('X%06d' % i, 'Bid', rng.randint(1, 99), 1, 1.0, None) for i in range(n_ops)]
+        t0 = chrono.perf_counter()
+        for order in orders:
+            exchange.add_order(order, False)
+        t_add = chrono.perf_counter() - t0
+
+        # del_order
+        t0 = chrono.perf_counter()
+        for order in orders:
+            exchange.del_order(2.0, order, None, False)
+        t_del = chrono.perf_counter() - t0
+
+        # process_order
+        orders = []
+        for i in range(n_ops):
+            orders.append(BSE.Order('P%06d' % i, 'Bid', 200, 1, 3.0, None))
+            orders.append(BSE.Order('Q%06d' % i, 'Ask', rng.randint(101, 199), 1, 3.0, None))
+        t0 = chrono.perf_counter()
+        for order in orders:
+            exchange.process_order(3.0, order, None, False)
+        t_proc = chrono.perf_counter() - t0
+        if exchange.asks.n_orders != depth:
+            sys.exit('FAIL: book depth not maintained in bench_book (%d != %d)' % (exchange.asks.n_orders, depth))
+
+        # publish_lob, after each change to the book
+        t_pub = 0.0
+        t_full = 0.0
+        for i in range(n_ops):
+            order = BSE.Order('B%06d' % (i % depth), 'Bid', rng.randint(1, 99), 1, 4.0, None)
+            exchange.add_order(order, False)
+            t0 = chrono.perf_counter()
+            lob = exchange.publish_lob(4.0 + i, None, False)
+            t1 = chrono.perf_counter()
+            bids = lob['bids']['lob']
+            asks = lob['asks']['lob']
+            t2 = chrono.perf_counter()
+            t_pub += t1 - t0
+            t_full += t2 - t0
+            if len(bids) == 0 or len(asks) == 0:
+                sys.exit('FAIL: empty LOB in bench_book')
+
+        for key, value in [('add_order', n_ops / t_add), ('del_order', n_ops / t_del),
+                           ('process_order', 2 * n_ops / t_proc),
+                           ('publish_lob', 1e6 * t_pub / n_ops), ('publish_lob_full', 1e6 * t_full / n_ops)]:
+            if best[key] is None:
+                best[key] = value
+            elif key[:11] == 'publish_lob':
+                best[key] = min(best[key], value)
+            else:
+                best[key] = max(best[key], value)
+
+    params = {'lob_impl': lob_impl, 'depth': depth, 'n_ops': n_ops, 'repeats': repeats}
+    results = []
+    for key in ['add_order', 'del_order', 'process_order']:
+        results.append(bench_record('book/%s/depth=%d/%s' % (lob_impl, depth, key),
+                                    best[key], 'ops/sec', True, params))
+    for key in ['publish_lob', 'publish_lob_full']:
+        results.append(bench_record('book/%s/depth=%d/%s' % (lob_impl, depth, key),
+                                    best[key], 'usec/call', False, params))
+    return results
+
+
+def standard_spec(n_traders):
+    """
+    The standard trader mix, i.e. the one in BSE.py's __main__ section, scaled to a given population size.
+    :param n_traders: total number of buyers+sellers (multiple of 50 for an exact scaling of the standard mix).
+    :return: trader_spec for market_session().
+    """
+    scale = max(1, int(round(n_traders / 50.0)))
+    buyers_spec = [('SHVR', 5 * scale), ('GVWY', 5 * scale), ('ZIC', 2 * scale), ('ZIP', 13 * scale)]
+    proptraders_spec = [('PT1', 1, {'bid_percent': 0.95, 'ask_delta': 7}), ('PT2', 1, {'n_past_trades': 25})]
+    return {'sellers': buyers_spec, 'buyers': buyers_spec, 'proptraders': proptraders_spec}
+
+
+def bench_session(n_traders, duration, sim_mode, repeats):
+    """
+    Benchmark a whole market session, with no data-files written.
+    :param n_traders: total number of buyers+sellers.
+    :param duration: length of the session in simulated seconds.
+    :param sim_mode: which simulation kernel market_session() should use.
+    :param repeats: number of repeats: the best of these is reported.
+    :return: list of result records.
+    """
+    supply_schedule = [{'from': 0, 'to': duration, 'ranges': [(60, 140)], 'stepmode': 'random'}]
+    demand_schedule = [{'from': 0, 'to': duration, 'ranges': [(60, 140)], 'stepmode': 'random'}]
+    order_sched = {'sup': supply_schedule, 'dem': demand_schedule, 'interval': 10, 'timemode': 'drip-poisson'}
+    dump_flags = {'dump_blotters': False, 'dump_lobs': False, 'dump_strats': False,
+                  'dump_avgbals': False, 'dump_tape': False}
+    spec = standard_spec(n_traders)
+
+    best_wall = None
+    for r in range(repeats):
+        random.seed(r)
+        t0 = chrono.perf_counter()
+        # the traders can be chatty when they're created, so silence them
+        with contextlib.redirect_stdout(io.StringIO()):
+            BSE.market_session('bench', 0.0, duration, spec, order_sched, dump_flags, False, sim_mode)
+        wall = chrono.perf_counter() - t0
+        if best_wall is None or wall < best_wall:
+            best_wall = wall
+
+    params = {'n_traders': n_traders, 'duration': duration, 'sim_mode': sim_mode, 'repeats': repeats}
+    return [bench_record('session/%s/n=%d/sim_secs_per_wall_sec' % (sim_mode, n_traders),
+                         duration / best_wall, 'simsec/wallsec', True, params)]
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare a set of benchmark results with a baseline set, printing a table of the ratios.
+    :param results: list of result records for this run.
+    :param baseline: list of result records from the baseline run.
+    :param tolerance: fractional worsening (e.g. 0.1 for 10%) that is tolerated before a result counts as a regression.
+    :return: list of the names of the results that have regressed.
+    """
+    base = {}
+    for record in baseline:
+        base[record['name']] = record
+
+    regressions = []
+    print('%-56s %14s %14s %8s' % ('benchmark', 'baseline', 'now', 'speedup'))
+    for record in results:
+        if record['name'] not in base:
+            print('%-56s %14s %14.3f %8s' % (record['name'], '-', record['value'], 'new'))
+            continue
+        b_value = base[record['name']]['value']
+        if record['higher_is_better']:
+            speedup = record['value'] / b_value
+        else:
+            speedup = b_value / record['value']
+        flag = ''
+        if speedup < 1.0 - tolerance:
+            flag = ' <<< REGRESSION'
+            regressions.append(record['name'])
+        print('%-56s %14.3f %14.3f %7.2fx%s' % (record['name'], b_value, record['value'], speedup, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark suite for BSE')
+    parser.add_argument('--out', default=None, help='write results to this JSON file')
+    parser.add_argument('--compare', default=None, help='compare results with this baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fractional slowdown allowed before a result counts as a regression (default 0.1)')
+    parser.add_argument('--quick', action='store_true', help='run a reduced set of sizes')
+    parser.add_argument('--depths', type=int, nargs='*', default=None, help='book depths to benchmark')
+    parser.add_argument('--populations', type=int, nargs='*', default=None, help='population sizes to benchmark')
+    parser.add_argument('--lob_impls', nargs='*', default=['dict', 'ladder'], help='LOB implementations to benchmark')
+    parser.add_argument('--sim_mode', default='ticks', help='simulation kernel for the session benchmarks')
+    parser.add_argument('--n_ops', type=int, default=10000, help='operations timed per book benchmark')
+    parser.add_argument('--repeats', type=int, default=3, help='repeats per benchmark (best is reported)')
+    args = parser.parse_args()
+
+    depths = args.depths
+    if depths is None:
+        depths = quick_depths if args.quick else bench_depths
+    populations = args.populations
+    if populations is None:
+        populations = quick_populations if args.quick else bench_populations
+
+    all_results = []
+    for impl in args.lob_impls:
+        for d in depths:
+            for result in bench_book(impl, d, args.n_ops, args.repeats):
+                print('%-56s %14.3f %s' % (result['name'], result['value'], result['unit']))
+                all_results.append(result)
+
+    for n in populations:
+        secs = bench_session_secs.get(n, max(1.0, 30000.0 / n))
+        # big populations are slow, so only do them once
+        n_repeats = args.repeats if n <= 500 else 1
+        for result in bench_session(n, secs, args.sim_mode, n_repeats):
+            print('%-56s %14.3f %s' % (result['name'], result['value'], result['unit']))
+            all_results.append(result)
+
+    if args.out is not None:
+        meta = {'timestamp': datetime.now().isoformat(), 'python': platform.python_version(),
+                'platform': platform.platform(), 'argv': sys.argv[1:], 'bse': os.path.abspath(BSE.__file__)}
+        with open(args.out, 'w') as outfile:
+            json.dump({'meta': meta, 'results': all_results}, outfile, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as basefile:
+            baseline_results = json.load(basefile)['results']
+        regressed = compare_results(all_results, baseline_results, args.tolerance)
+        if len(regressed) > 0:
+            sys.exit('FAIL: %d benchmark(s) regressed by more than %.0f%%' % (len(regressed), 100 * args.tolerance))
@@ -1971,6 +1971,9 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
 
         if verbose: print('\n%s;  ' % (sess_id))
 
+        # persistent array of trader-ids, so that choosing a trader doesn't build a new list on every timestep
+        tids = list(traders.keys())
+        n_traders = len(tids)
 
         while time < endtime:
 
@@ -1997,7 +2000,7 @@ def market_session(sess_id, starttime, endtime, trader_spec, order_schedule, dum
 
 
                 # get a limit-order quote (or None) from a randomly chosen trader
-                tid = list(traders.keys())[random.randint(0, len(traders) - 1)]
+                tid = tids[random.randint(0, n_traders - 1)]
                 order = traders[tid].getorder(time, time_left, exchange.publish_lob(time, lob_verbose))
 
                 # if verbose: print('Trader Quote: %s' % (order))